@@ -28,10 +28,10 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
         # Werkzeug gestiona la longitud de forma interna.
         # Ya no es necesario el trucado a 72 bytes.
         result = check_password_hash(hashed_password, plain_password)
-        logger.debug(f"Verificación de contraseña con Werkzeug: {result}")
+        logger.debug("Verificación de contraseña con Werkzeug: %s", result)
         return result
     except Exception as e:
-        logger.error(f"Error al verificar contraseña con Werkzeug: {e}", exc_info=True)
+        logger.error("Error al verificar contraseña con Werkzeug: %s", e, exc_info=True)
         return False
 
 
@@ -69,21 +69,21 @@ def get_current_user_simplified(token: str = Depends(oauth2_scheme),
         user = crud.get_user_by_cedula_or_correo(db, token)
 
         if user is None:
-            logger.warning(f"Token inválido o usuario no encontrado: {token}")
+            logger.warning("Token inválido o usuario no encontrado: %s", token)
             raise credentials_exception
 
         if not user.activo:
-            logger.warning(f"Usuario inactivo intentó acceder: {token}")
+            logger.warning("Usuario inactivo intentó acceder: %s", token)
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Usuario inactivo",
             )
 
-        logger.debug(f"Usuario autenticado: {user.cedula}")
+        logger.debug("Usuario autenticado: %s", user.cedula)
         return user
 
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error al obtener usuario actual: {e}", exc_info=True)
+        logger.error("Error al obtener usuario actual: %s", e, exc_info=True)
         raise credentials_exception
\ No newline at end of file
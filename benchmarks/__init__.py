@@ -0,0 +1 @@
+# Benchmarks y herramientas de medición de rendimiento (no se ejecutan con pytest)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""
+Mide los índices en memoria de busqueda.py sobre autos sintéticos
+(generar_datos): tiempo de construcción y mediana por consulta del
+autocompletado por prefijo y de la búsqueda aproximada por trigramas.
+
+Uso:
+    python -m benchmarks.bench_busqueda --filas 1000000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import busqueda
+import generar_datos
+
+PREFIJOS = ["t", "mod", "hyun", "kona e"]
+CON_ERRATAS = ["Tesal", "Kona Electrc", "Modle Y", "Nissan Lef", "zzzz"]
+
+
+def _mediana_ms(funcion, repeticiones: int) -> float:
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return statistics.median(tiempos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filas", type=int, default=100000)
+    parser.add_argument("--repeticiones", type=int, default=20)
+    parser.add_argument("--semilla", type=int, default=42)
+    args = parser.parse_args()
+
+    filas = [{"id": i, **fila} for i, fila in
+             enumerate(generar_datos.generar_autos(args.filas, random.Random(args.semilla)), start=1)]
+    campos = busqueda.CAMPOS_BUSQUEDA["autos"]
+
+    for nombre, clase, consultas, buscar in [
+        ("prefijos", busqueda.IndicePrefijos, PREFIJOS, lambda indice, q: indice.sugerir(q, 10)),
+        ("ngramas", busqueda.IndiceNgramas, CON_ERRATAS, lambda indice, q: indice.buscar(q, 20)),
+    ]:
+        indice = clase(campos)
+        inicio = time.perf_counter()
+        indice.cargar(filas)
+        print(f"\n{nombre}: {len(filas)} filas, construcción {time.perf_counter() - inicio:.1f} s")
+        for q in consultas:
+            ms = _mediana_ms(lambda: buscar(indice, q), args.repeticiones)
+            print(f"  {q!r:<16} {ms:8.3f} ms   {len(buscar(indice, q))} resultado(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+"""
+Microbenchmarks de las funciones de crud.py con volúmenes realistas.
+
+Para cada tamaño (10k, 100k, 1M filas por defecto) crea una base de datos
+nueva, la llena y mide cada función varias veces. Los resultados se guardan
+en JSON (por defecto benchmarks/resultados/<commit>.json) para comparar
+entre commits con --comparar.
+
+Uso:
+    python -m benchmarks.bench_crud
+    python -m benchmarks.bench_crud --tamanos 10000 100000 --url postgresql+psycopg://localhost/bench
+    python -m benchmarks.bench_crud --comparar benchmarks/resultados/abc123.json
+
+Sin --url se mide SQLite y, si está definida, la base de BENCH_POSTGRES_URL
+(para un Postgres local sin SSL añade ?sslmode=disable a la URL).
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import sqlalchemy
+from sqlalchemy import insert
+
+from database import Base, crear_engine, crear_sessionmaker
+import models_sql as models
+import crud
+import crud_usuarios
+import generar_datos
+
+DIRECTORIO_RESULTADOS = Path(__file__).parent / "resultados"
+LOTE = 10000
+
+
+# --------------------- DATOS ---------------------
+
+def _filas_usuarios(n, rnd):
+    # Hash fijo: el benchmark mide la búsqueda, no PBKDF2
+    for i in range(n):
+        yield {
+            "nombre": f"Usuario {i}", "edad": rnd.randint(18, 90), "correo": f"usuario{i}@ejemplo.com",
+            "cedula": str(10000000 + i), "celular": "3000000000", "hashed_password": "pbkdf2:sha256:x",
+            "activo": True,
+        }
+
+
+def _insertar(engine, tabla, filas):
+    lote = []
+    with engine.begin() as conn:
+        for fila in filas:
+            lote.append(fila)
+            if len(lote) >= LOTE:
+                conn.execute(insert(tabla), lote)
+                lote = []
+        if lote:
+            conn.execute(insert(tabla), lote)
+
+
+def poblar(engine, n: int, semilla: int = 42):
+    """Crea las tablas y las llena con n autos, cargas y estaciones (más historial y n/10 usuarios)."""
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    generar_datos.poblar_db(engine, n, semilla=semilla, tamano_lote=LOTE)
+    _insertar(engine, models.UsuarioSQL.__table__, _filas_usuarios(max(n // 10, 1), random.Random(semilla)))
+
+
+# --------------------- MEDICIÓN ---------------------
+
+def medir(funcion, repeticiones: int) -> dict:
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    tiempos.sort()
+    return {
+        "min_ms": round(tiempos[0], 3),
+        "mediana_ms": round(statistics.median(tiempos), 3),
+        "p95_ms": round(tiempos[min(len(tiempos) - 1, int(len(tiempos) * 0.95))], 3),
+        "repeticiones": repeticiones,
+    }
+
+
+def casos(SessionLocal, n: int):
+    """Funciones a medir. Cada una abre su propia sesión como hace get_db."""
+    def con_sesion(funcion):
+        def ejecutar():
+            with SessionLocal() as db:
+                funcion(db)
+        return ejecutar
+
+    # Cada delete_auto usa un id distinto para que siempre archive una fila
+    ids_a_borrar = iter(range(n, 0, -1))
+    usuarios = max(n // 10, 1)
+    with SessionLocal() as db:
+        modelo_buscado = crud.get_auto(db, n // 3).modelo
+
+    return {
+        "get_autos_inicio": con_sesion(lambda db: crud.get_autos(db, skip=0, limit=100)),
+        "get_autos_offset_profundo": con_sesion(lambda db: crud.get_autos(db, skip=n - 100, limit=100)),
+        "get_estaciones_inicio": con_sesion(lambda db: crud.get_estaciones(db, skip=0, limit=100)),
+        "get_parcial_estaciones": con_sesion(
+            lambda db: crud.get_parcial(db, "estaciones", ["nombre", "potencia_kw"], skip=0, limit=100)),
+        "get_auto": con_sesion(lambda db: crud.get_auto(db, n // 2)),
+        "get_auto_by_modelo": con_sesion(lambda db: crud.get_auto_by_modelo(db, modelo_buscado)),
+        "delete_auto": con_sesion(lambda db: crud.delete_auto(db, next(ids_a_borrar))),
+        "get_autos_count": con_sesion(crud.get_autos_count),
+        "get_average_autonomia": con_sesion(crud.get_average_autonomia),
+        "get_cars_by_brand_stats": con_sesion(crud.get_cars_by_brand_stats),
+        "get_charge_difficulty_distribution": con_sesion(crud.get_charge_difficulty_distribution),
+        "get_station_power_by_connector_type_stats": con_sesion(crud.get_station_power_by_connector_type_stats),
+        "get_user_by_cedula_or_correo": con_sesion(
+            lambda db: crud_usuarios.get_user_by_cedula_or_correo(db, f"usuario{usuarios // 2}@ejemplo.com")),
+    }
+
+
+def ejecutar_backend(url: str, tamanos, repeticiones: int, semilla: int) -> dict:
+    resultados = {}
+    for n in tamanos:
+        url_n = url
+        temporal = None
+        if url == "sqlite":
+            temporal = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+            temporal.close()
+            url_n = f"sqlite:///{temporal.name}"
+
+        engine = crear_engine(url_n)
+        try:
+            inicio = time.perf_counter()
+            poblar(engine, n, semilla)
+            print(f"  [{engine.dialect.name}] {n:>9,} filas pobladas en {time.perf_counter() - inicio:.1f}s")
+
+            SessionLocal = crear_sessionmaker(engine)
+            resultados[str(n)] = {}
+            for nombre, funcion in casos(SessionLocal, n).items():
+                resultados[str(n)][nombre] = medir(funcion, repeticiones)
+                print(f"    {nombre:<45} mediana {resultados[str(n)][nombre]['mediana_ms']:>10.3f} ms")
+        finally:
+            engine.dispose()
+            if temporal is not None:
+                os.unlink(temporal.name)
+    return resultados
+
+
+def commit_actual() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return "desconocido"
+
+
+def comparar(actual: dict, anterior: dict):
+    """Imprime la variación de la mediana de cada función respecto a otro resultado."""
+    print(f"\nComparación {anterior['meta']['commit']} -> {actual['meta']['commit']}")
+    for backend, por_tamano in actual["resultados"].items():
+        for n, funciones in por_tamano.items():
+            previas = anterior["resultados"].get(backend, {}).get(n, {})
+            for nombre, datos in funciones.items():
+                if nombre not in previas:
+                    continue
+                antes, ahora = previas[nombre]["mediana_ms"], datos["mediana_ms"]
+                cambio = (ahora - antes) / antes * 100 if antes else 0.0
+                print(f"  {backend:<10} {n:>9} {nombre:<45} {antes:>10.3f} -> {ahora:>10.3f} ms ({cambio:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tamanos", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--url", action="append",
+                        help="URL de base de datos ('sqlite' crea un archivo temporal). Repetible.")
+    parser.add_argument("--repeticiones", type=int, default=20)
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--salida", help="Archivo JSON de resultados")
+    parser.add_argument("--comparar", help="JSON de un resultado anterior para comparar")
+    args = parser.parse_args()
+
+    urls = args.url or ["sqlite"]
+    if not args.url and os.getenv("BENCH_POSTGRES_URL"):
+        urls.append(os.getenv("BENCH_POSTGRES_URL"))
+    commit = commit_actual()
+    resultado = {
+        "meta": {
+            "commit": commit,
+            "fecha": datetime.utcnow().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlalchemy": sqlalchemy.__version__,
+            "tamanos": args.tamanos,
+            "repeticiones": args.repeticiones,
+        },
+        "resultados": {},
+    }
+
+    for url in urls:
+        nombre_backend = "sqlite" if url == "sqlite" else crear_engine(url).dialect.name
+        print(f"Backend {nombre_backend}")
+        resultado["resultados"][nombre_backend] = ejecutar_backend(url, args.tamanos, args.repeticiones, args.semilla)
+
+    salida = Path(args.salida) if args.salida else DIRECTORIO_RESULTADOS / f"{commit}.json"
+    salida.parent.mkdir(parents=True, exist_ok=True)
+    salida.write_text(json.dumps(resultado, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"\nResultados guardados en {salida}")
+
+    if args.comparar:
+        comparar(resultado, json.loads(Path(args.comparar).read_text(encoding="utf-8")))
+
+
+if __name__ == "__main__":
+    main()
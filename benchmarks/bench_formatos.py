@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+Compara tamaño y tiempo de codificación/decodificación de los formatos de
+respuesta (formatos.py) para un listado de estaciones y otro de autos.
+
+    json            lista de objetos (respuesta por defecto)
+    json_columnas   layout=columns
+    msgpack         Accept: application/msgpack
+    msgpack_columnas
+
+Las filas salen de generar_datos (mismas columnas que /api/estaciones), así
+que no hace falta base de datos.
+
+Uso:
+    python -m benchmarks.bench_formatos --filas 10000
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import formatos
+import generar_datos
+
+
+def _filas(generador, n: int, semilla: int) -> list:
+    return [{"id": i, **fila} for i, fila in enumerate(generador(n, random.Random(semilla)), start=1)]
+
+
+def _mediana_ms(funcion, repeticiones: int) -> float:
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return statistics.median(tiempos)
+
+
+def comparar(nombre: str, filas: list, repeticiones: int):
+    columnas = formatos.a_columnas(filas)
+    variantes = {
+        "json": (formatos.codificar_json, json.loads, filas),
+        "json_columnas": (formatos.codificar_json, json.loads, columnas),
+    }
+    if formatos.msgpack is not None:
+        variantes["msgpack"] = (formatos.codificar_msgpack, formatos.msgpack.unpackb, filas)
+        variantes["msgpack_columnas"] = (formatos.codificar_msgpack, formatos.msgpack.unpackb, columnas)
+    else:
+        print("msgpack no está instalado: solo se mide JSON (pip install msgpack)")
+
+    print(f"\n{nombre}: {len(filas)} filas")
+    base = len(formatos.codificar_json(filas))
+    for variante, (codificar, decodificar, datos) in variantes.items():
+        cuerpo = codificar(datos)
+        t_codificar = _mediana_ms(lambda: codificar(datos), repeticiones)
+        t_decodificar = _mediana_ms(lambda: decodificar(cuerpo), repeticiones)
+        print(f"  {variante:<18} {len(cuerpo) / 1024:>9.1f} KiB ({len(cuerpo) / base * 100:5.1f}%)"
+              f"   codificar {t_codificar:7.2f} ms   decodificar {t_decodificar:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filas", type=int, default=10000)
+    parser.add_argument("--repeticiones", type=int, default=15)
+    parser.add_argument("--semilla", type=int, default=42)
+    args = parser.parse_args()
+
+    comparar("estaciones", _filas(generar_datos.generar_estaciones, args.filas, args.semilla), args.repeticiones)
+    comparar("autos", _filas(generar_datos.generar_autos, args.filas, args.semilla), args.repeticiones)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+Mide el coste de logging por petición, visto desde el hilo que atiende.
+
+Reproduce los registros de un login (el endpoint que más escribe: intento,
+verificación de contraseña, usuario autenticado, login exitoso) y compara:
+
+    sincrono   basicConfig(DEBUG) a stdout con f-strings (configuración anterior)
+    cola       configurar_logging() con LOG_LEVEL=INFO (producción)
+    cola_debug configurar_logging() en DEBUG con muestreo del 10% de los DEBUG
+
+La salida se descarta (os.devnull) para medir el logging y no la terminal.
+
+Uso:
+    python -m benchmarks.bench_logging --peticiones 20000
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import logging_config
+
+logger_api = logging.getLogger("FastAPI")
+logger_auth = logging.getLogger("auth_utils")
+
+
+def login_fstring(usuario: str, cedula: str):
+    logger_api.info(f"Intento de login para: {usuario}")
+    logger_api.debug(f"Verificando contraseña para usuario: {cedula}")
+    logger_auth.debug(f"Verificación de contraseña con Werkzeug: {True}")
+    logger_auth.debug(f"Usuario autenticado: {cedula}")
+    logger_api.info(f"Login exitoso para: {cedula}")
+
+
+def login_perezoso(usuario: str, cedula: str):
+    logger_api.info("Intento de login para: %s", usuario)
+    logger_api.debug("Verificando contraseña para usuario: %s", cedula)
+    logger_auth.debug("Verificación de contraseña con Werkzeug: %s", True)
+    logger_auth.debug("Usuario autenticado: %s", cedula)
+    logger_api.info("Login exitoso para: %s", cedula)
+
+
+def _limpiar_raiz():
+    logging_config.detener_logging()
+    raiz = logging.getLogger()
+    for handler in list(raiz.handlers):
+        raiz.removeHandler(handler)
+        handler.close()
+
+
+def medir(funcion, peticiones: int) -> float:
+    """Microsegundos por petición en el hilo que registra."""
+    for i in range(200):
+        funcion(f"usuario{i}@ejemplo.com", str(10000000 + i))
+    inicio = time.perf_counter()
+    for i in range(peticiones):
+        funcion(f"usuario{i}@ejemplo.com", str(10000000 + i))
+    return (time.perf_counter() - inicio) / peticiones * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--peticiones", type=int, default=20000)
+    args = parser.parse_args()
+
+    # La cola debe caber la ráfaga completa para no medir descartes
+    os.environ["LOG_QUEUE_SIZE"] = str(args.peticiones * 6)
+    resultados = {}
+    with open(os.devnull, "w") as nulo:
+        _limpiar_raiz()
+        logging.basicConfig(level=logging.DEBUG, stream=nulo, format=logging_config.FORMATO_TEXTO)
+        resultados["sincrono"] = medir(login_fstring, args.peticiones)
+
+        _limpiar_raiz()
+        logging_config.configurar_logging(stream=nulo, nivel="INFO")
+        resultados["cola"] = medir(login_perezoso, args.peticiones)
+
+        _limpiar_raiz()
+        logging_config.configurar_logging(stream=nulo, nivel="DEBUG", muestreo=0.1)
+        resultados["cola_debug"] = medir(login_perezoso, args.peticiones)
+        _limpiar_raiz()
+
+    base = resultados["sincrono"]
+    for nombre, us in resultados.items():
+        print(f"{nombre:<12} {us:>8.2f} µs/petición ({us / base * 100:5.1f}% del síncrono)")
+
+
+if __name__ == "__main__":
+    main()
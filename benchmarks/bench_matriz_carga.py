@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+Mide matriz_carga.py sobre autos, cargas y estaciones sintéticos
+(generar_datos): construcción, top-k por auto (sin y con resultado
+guardado), recomendación ponderada con distancia, actualización
+incremental y recorrido de la matriz completa.
+
+Uso:
+    python -m benchmarks.bench_matriz_carga --autos 10000 --estaciones 50000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import crud
+import eventos
+import generar_datos
+import matriz_carga
+
+
+def _con_ids(filas):
+    return [{"id": i, **fila} for i, fila in enumerate(filas, start=1)]
+
+
+def _mediana_ms(funcion, repeticiones: int) -> float:
+    tiempos = []
+    for i in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion(i)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return statistics.median(tiempos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--autos", type=int, default=10000)
+    parser.add_argument("--estaciones", type=int, default=50000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--repeticiones", type=int, default=200)
+    parser.add_argument("--semilla", type=int, default=42)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.semilla)
+    autos = _con_ids(generar_datos.generar_autos(args.autos, rnd))
+    cargas = _con_ids(generar_datos.generar_cargas(args.autos, rnd))
+    enlaces = crud.emparejar_cargas(autos, cargas)
+    for carga in cargas:
+        carga["auto_id"] = enlaces.get(carga["id"])
+    estaciones = _con_ids(generar_datos.generar_estaciones(args.estaciones, rnd))
+
+    matriz = matriz_carga.MatrizCarga()
+    inicio = time.perf_counter()
+    matriz.cargar(autos, cargas, estaciones)
+    print(f"{args.autos} autos × {args.estaciones} estaciones, construcción {time.perf_counter() - inicio:.2f} s")
+
+    for criterio in matriz_carga.CRITERIOS:
+        ms = _mediana_ms(lambda i: matriz.mejores(rnd.randint(1, args.autos), args.k, criterio), args.repeticiones)
+        print(f"  {f'top-{args.k} por {criterio}':<22} {ms:8.3f} ms")
+    ms = _mediana_ms(lambda i: matriz.mejores(1, args.k), args.repeticiones)
+    print(f"  {f'top-{args.k} guardado':<22} {ms:8.3f} ms")
+    ms = _mediana_ms(lambda i: matriz.recomendar(rnd.randint(1, args.autos), args.k, latitud=4.65, longitud=-74.1),
+                     args.repeticiones)
+    print(f"  {f'recomendar top-{args.k}':<22} {ms:8.3f} ms")
+
+    evento = eventos.Evento(0, "estaciones", "update", 1, estaciones[0])
+    ms = _mediana_ms(lambda i: matriz.aplicar(evento), args.repeticiones)
+    print(f"  {'evento de estación':<22} {ms:8.3f} ms")
+
+    inicio = time.perf_counter()
+    mas_barata = np.empty(0, dtype=np.int64)
+    for _, _, coste in matriz.bloques():
+        mas_barata = np.concatenate([mas_barata, coste.argmin(axis=1)])
+    print(f"  matriz completa (argmin por auto) {time.perf_counter() - inicio:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""
+Mide el coste por petición del middleware de métricas.
+
+Invoca la aplicación ASGI directamente (sin red ni cliente HTTP) para que la
+diferencia entre la versión con y sin middleware refleje solo el middleware.
+
+Uso:
+    python -m benchmarks.bench_metricas --peticiones 20000 --presupuesto-us 50
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from fastapi import FastAPI
+
+import metricas
+
+
+def crear_app(con_middleware: bool) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/api/ping/{item_id}")
+    async def ping(item_id: int):
+        return {"id": item_id}
+
+    if con_middleware:
+        app.add_middleware(metricas.MetricasMiddleware)
+    return app
+
+
+async def ejecutar(app, peticiones: int) -> float:
+    """Devuelve los segundos que tarda en atender `peticiones` peticiones."""
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    def scope(i):
+        return {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+            "method": "GET", "scheme": "http", "path": f"/api/ping/{i}", "raw_path": b"",
+            "root_path": "", "query_string": b"", "headers": [],
+            "client": ("127.0.0.1", 1234), "server": ("testserver", 80),
+        }
+
+    # Calentamiento (construcción de la pila de middlewares, caches de rutas)
+    for i in range(200):
+        await app(scope(i), receive, send)
+
+    inicio = time.perf_counter()
+    for i in range(peticiones):
+        await app(scope(i), receive, send)
+    return time.perf_counter() - inicio
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--peticiones", type=int, default=20000)
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--presupuesto-us", type=float, default=50.0,
+                        help="Sobrecoste máximo aceptable por petición, en microsegundos")
+    args = parser.parse_args()
+
+    base, medida = [], []
+    for _ in range(args.repeticiones):
+        base.append(asyncio.run(ejecutar(crear_app(False), args.peticiones)))
+        medida.append(asyncio.run(ejecutar(crear_app(True), args.peticiones)))
+
+    # Se toma el mejor tiempo de cada variante para reducir el ruido
+    por_peticion_base = min(base) / args.peticiones * 1e6
+    por_peticion_medida = min(medida) / args.peticiones * 1e6
+    sobrecoste = por_peticion_medida - por_peticion_base
+
+    print(f"Sin middleware: {por_peticion_base:8.2f} µs/petición")
+    print(f"Con middleware: {por_peticion_medida:8.2f} µs/petición")
+    print(f"Sobrecoste:     {sobrecoste:8.2f} µs/petición (presupuesto {args.presupuesto_us:.0f} µs)")
+    return 0 if sobrecoste <= args.presupuesto_us else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
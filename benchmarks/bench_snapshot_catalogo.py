@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""
+Mide snapshot_catalogo.py sobre estaciones sintéticas (generar_datos):
+construcción, memoria, página del listado, detalle por id, facetas con y
+sin filtro, media por grupo y evento de escritura.
+
+Uso:
+    python -m benchmarks.bench_snapshot_catalogo --estaciones 100000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import eventos
+import generar_datos
+import snapshot_catalogo
+
+
+def _mediana_ms(funcion, repeticiones: int) -> float:
+    tiempos = []
+    for i in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion(i)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return statistics.median(tiempos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--estaciones", type=int, default=100000)
+    parser.add_argument("--repeticiones", type=int, default=200)
+    parser.add_argument("--semilla", type=int, default=42)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.semilla)
+    estaciones = [{"id": i, **fila} for i, fila in
+                  enumerate(generar_datos.generar_estaciones(args.estaciones, rnd), start=1)]
+
+    tabla = snapshot_catalogo.nueva_tabla("estaciones")
+    filas = [tuple(e.get(campo) for campo in tabla.campos) for e in estaciones]
+    estimado = len(filas) * tabla.estimar_bytes_por_fila(filas[:snapshot_catalogo.FILAS_MUESTRA])
+    inicio = time.perf_counter()
+    tabla.cargar(filas)
+    print(f"{args.estaciones} estaciones, construcción {time.perf_counter() - inicio:.2f} s, "
+          f"~{tabla.memoria() / 2 ** 20:.1f} MB (estimado {estimado / 2 ** 20:.1f} MB)")
+
+    facetas = ("tipo_conector", "operador", "acceso_publico")
+    conector = estaciones[0]["tipo_conector"]
+    casos = [
+        ("página de 100", lambda i: tabla.pagina(rnd.randrange(args.estaciones), 100)),
+        ("detalle por id", lambda i: tabla.obtener(rnd.randint(1, args.estaciones))),
+        ("facetas sin filtro", lambda i: tabla.facetas({}, facetas)),
+        ("facetas con filtro", lambda i: tabla.facetas({"tipo_conector": [conector]}, facetas)),
+        ("media por conector", lambda i: tabla.medias("tipo_conector", "potencia_kw")),
+        ("evento de estación", lambda i: tabla.aplicar(
+            eventos.Evento(0, "estaciones", "update", 1, {**estaciones[0], "potencia_kw": float(i)}))),
+    ]
+    for nombre, funcion in casos:
+        print(f"  {nombre:<22} {_mediana_ms(funcion, args.repeticiones):8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
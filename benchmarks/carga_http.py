@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+"""
+Generador de carga HTTP de extremo a extremo.
+
+Levanta la aplicación con Gunicorn (o usa una ya levantada con --url), la
+siembra con datos por la propia API y reproduce una mezcla configurable de
+tráfico: páginas /index y /cars, listados, búsquedas y detalle de la API,
+logins (PBKDF2), subidas de imágenes y escrituras. Al final informa por
+escenario p50/p95/p99, rendimiento y tasa de error.
+
+Uso:
+    python -m benchmarks.carga_http --duracion 30 --concurrencia 32
+    python -m benchmarks.carga_http --workers 2 --env DATABASE_READ_URL=... --salida resultado.json
+    python -m benchmarks.carga_http --mezcla api_lista=50,api_detalle=30,login=20
+    python -m benchmarks.carga_http --url http://localhost:8000
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import httpx
+
+RAIZ = Path(__file__).resolve().parent.parent
+
+MEZCLA_POR_DEFECTO = {
+    "pagina_index": 10,
+    "pagina_cars": 10,
+    "api_lista": 25,
+    "api_busqueda": 15,
+    "api_detalle": 20,
+    "login": 5,
+    "subida_imagen": 3,
+    "escritura": 12,
+}
+
+USUARIO = {
+    "nombre": "Carga Test", "edad": 30, "correo": "carga@example.com",
+    "cedula": "5550001", "celular": "3005550001", "password": "CargaTest123",
+}
+
+# PNG de 1x1 píxel
+IMAGEN_PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082"
+)
+
+MARCAS = ["Tesla", "Nissan", "Hyundai", "Chevrolet", "BYD", "Renault", "Kia"]
+
+
+# --------------------- ESCENARIOS ---------------------
+
+class Escenarios:
+    """Cada escenario hace una petición (o una secuencia corta) y devuelve la última respuesta."""
+
+    def __init__(self, cliente: httpx.AsyncClient, ids_autos, cookies, semilla: int):
+        self.cliente = cliente
+        self.ids_autos = ids_autos
+        self.cookies = cookies
+        self.rnd = random.Random(semilla)
+        self.contador = itertools.count()
+        self.imagenes_subidas = []
+
+    async def pagina_index(self):
+        return await self.cliente.get("/index", cookies=self.cookies)
+
+    async def pagina_cars(self):
+        return await self.cliente.get("/cars", cookies=self.cookies)
+
+    async def api_lista(self):
+        return await self.cliente.get("/api/autos", params={"skip": self.rnd.randint(0, 50), "limit": 50})
+
+    async def api_busqueda(self):
+        return await self.cliente.get("/api/autos/search/", params={"modelo": f"Carga {self.rnd.randrange(len(self.ids_autos))}"})
+
+    async def api_detalle(self):
+        return await self.cliente.get(f"/api/autos/{self.rnd.choice(self.ids_autos)}")
+
+    async def login(self):
+        return await self.cliente.post(
+            "/api/login", data={"username": USUARIO["cedula"], "password": USUARIO["password"]})
+
+    async def subida_imagen(self):
+        respuesta = await self.cliente.post(
+            "/upload_image/", files={"file": ("carga.png", IMAGEN_PNG, "image/png")})
+        if respuesta.status_code == 200:
+            self.imagenes_subidas.append(respuesta.json()["url"])
+        return respuesta
+
+    async def escritura(self):
+        # Alterna crear, actualizar y borrar para ejercitar todo el camino de escritura
+        n = next(self.contador)
+        if n % 3 == 0:
+            return await self.cliente.post("/api/autos", json=auto_aleatorio(self.rnd, f"Escritura {n}"))
+        if n % 3 == 1:
+            return await self.cliente.put(
+                f"/api/autos/{self.rnd.choice(self.ids_autos)}",
+                json={"autonomia_km": round(self.rnd.uniform(200, 600), 1)})
+        respuesta = await self.cliente.post("/api/autos", json=auto_aleatorio(self.rnd, f"Borrado {n}"))
+        if respuesta.status_code != 201:
+            return respuesta
+        return await self.cliente.delete(f"/api/autos/{respuesta.json()['id']}")
+
+
+def auto_aleatorio(rnd, modelo):
+    return {
+        "marca": rnd.choice(MARCAS), "modelo": modelo[:30], "anio": rnd.randint(2011, 2025),
+        "capacidad_bateria_kwh": round(rnd.uniform(20, 120), 1),
+        "autonomia_km": round(rnd.uniform(150, 700), 1), "disponible": True,
+    }
+
+
+# --------------------- SERVIDOR ---------------------
+
+def puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def iniciar_servidor(workers: int, env_extra: dict, database_url: str):
+    puerto = puerto_libre()
+    env = {**os.environ, "DATABASE_URL": database_url, "PORT": str(puerto), **env_extra}
+    comando = [
+        sys.executable, "-m", "gunicorn", "main:app", "-c", "gunicorn_config.py",
+        "-w", str(workers), "-b", f"127.0.0.1:{puerto}", "--access-logfile", "/dev/null",
+    ]
+    proceso = subprocess.Popen(comando, cwd=RAIZ, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    url = f"http://127.0.0.1:{puerto}"
+
+    limite = time.monotonic() + 30
+    while time.monotonic() < limite:
+        if proceso.poll() is not None:
+            raise RuntimeError(f"El servidor terminó al arrancar:\n{proceso.stderr.read().decode()}")
+        try:
+            if httpx.get(f"{url}/health", timeout=1).status_code == 200:
+                return proceso, url
+        except httpx.TransportError:
+            time.sleep(0.2)
+    proceso.terminate()
+    raise RuntimeError("El servidor no respondió a /health en 30 segundos")
+
+
+def preparar_base_de_datos(database_url: str):
+    """Crea las tablas de la base que usará el servidor."""
+    env = {**os.environ, "DATABASE_URL": database_url}
+    codigo = "from database import Base, engine; import models_sql; Base.metadata.create_all(bind=engine)"
+    subprocess.run([sys.executable, "-c", codigo], cwd=RAIZ, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def sembrar(cliente: httpx.AsyncClient, autos: int, semilla: int):
+    """Crea autos y el usuario de pruebas por la API. Devuelve (ids, cookies)."""
+    rnd = random.Random(semilla)
+    ids = []
+    for i in range(autos):
+        respuesta = await cliente.post("/api/autos", json=auto_aleatorio(rnd, f"Carga {i}"))
+        if respuesta.status_code == 201:
+            ids.append(respuesta.json()["id"])
+    if not ids:
+        ids = [auto["id"] for auto in (await cliente.get("/api/autos")).json()]
+
+    await cliente.post("/register", data=USUARIO)
+    login = await cliente.post("/api/login", data={"username": USUARIO["cedula"], "password": USUARIO["password"]})
+    return ids or [1], dict(login.cookies)
+
+
+# --------------------- EJECUCIÓN ---------------------
+
+def percentil(valores_ordenados, p: float) -> float:
+    if not valores_ordenados:
+        return 0.0
+    indice = min(len(valores_ordenados) - 1, max(0, int(round(p / 100 * len(valores_ordenados))) - 1))
+    return valores_ordenados[indice]
+
+
+async def trabajador(escenarios: Escenarios, nombres, pesos, fin: float, resultados, rnd):
+    while time.monotonic() < fin:
+        nombre = rnd.choices(nombres, weights=pesos)[0]
+        inicio = time.perf_counter()
+        try:
+            respuesta = await getattr(escenarios, nombre)()
+            error = respuesta.status_code >= 400
+        except httpx.HTTPError:
+            error = True
+        resultados[nombre].append((time.perf_counter() - inicio, error))
+
+
+async def ejecutar(url: str, args, mezcla: dict) -> dict:
+    limites = httpx.Limits(max_connections=args.concurrencia, max_keepalive_connections=args.concurrencia)
+    async with httpx.AsyncClient(base_url=url, timeout=30, limits=limites) as cliente:
+        ids, cookies = await sembrar(cliente, args.autos, args.semilla)
+        escenarios = Escenarios(cliente, ids, cookies, args.semilla)
+
+        nombres = [n for n, peso in mezcla.items() if peso > 0]
+        pesos = [mezcla[n] for n in nombres]
+        resultados = defaultdict(list)
+        inicio = time.monotonic()
+        fin = inicio + args.duracion
+        rnd_base = random.Random(args.semilla)
+        await asyncio.gather(*(
+            trabajador(escenarios, nombres, pesos, fin, resultados, random.Random(rnd_base.random()))
+            for _ in range(args.concurrencia)
+        ))
+        transcurrido = time.monotonic() - inicio
+
+    if args.url is None:
+        # Las imágenes de prueba no deben quedarse en static/images
+        for url_imagen in escenarios.imagenes_subidas:
+            (RAIZ / url_imagen.lstrip("/")).unlink(missing_ok=True)
+
+    return resumir(resultados, transcurrido)
+
+
+def resumir(resultados, transcurrido: float) -> dict:
+    resumen = {"duracion_s": round(transcurrido, 2), "escenarios": {}}
+    total, errores = 0, 0
+    for nombre, muestras in sorted(resultados.items()):
+        latencias = sorted(d * 1000 for d, _ in muestras)
+        fallos = sum(1 for _, error in muestras if error)
+        total += len(muestras)
+        errores += fallos
+        resumen["escenarios"][nombre] = {
+            "peticiones": len(muestras),
+            "rps": round(len(muestras) / transcurrido, 2),
+            "p50_ms": round(percentil(latencias, 50), 2),
+            "p95_ms": round(percentil(latencias, 95), 2),
+            "p99_ms": round(percentil(latencias, 99), 2),
+            "max_ms": round(latencias[-1], 2) if latencias else 0.0,
+            "tasa_error": round(fallos / len(muestras), 4) if muestras else 0.0,
+        }
+    resumen["total"] = {
+        "peticiones": total,
+        "rps": round(total / transcurrido, 2) if transcurrido else 0.0,
+        "tasa_error": round(errores / total, 4) if total else 0.0,
+    }
+    return resumen
+
+
+def imprimir(resumen: dict):
+    print(f"\n{'escenario':<16}{'peticiones':>11}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'error %':>9}")
+    for nombre, datos in resumen["escenarios"].items():
+        print(f"{nombre:<16}{datos['peticiones']:>11}{datos['rps']:>9.1f}{datos['p50_ms']:>9.1f}"
+              f"{datos['p95_ms']:>9.1f}{datos['p99_ms']:>9.1f}{datos['tasa_error'] * 100:>9.2f}")
+    total = resumen["total"]
+    print(f"{'TOTAL':<16}{total['peticiones']:>11}{total['rps']:>9.1f}{'':>27}{total['tasa_error'] * 100:>9.2f}")
+
+
+def parsear_mezcla(texto: str) -> dict:
+    mezcla = {}
+    for parte in texto.split(","):
+        nombre, _, peso = parte.partition("=")
+        nombre = nombre.strip()
+        if not hasattr(Escenarios, nombre):
+            raise SystemExit(f"Escenario desconocido: {nombre}. Opciones: {', '.join(MEZCLA_POR_DEFECTO)}")
+        mezcla[nombre] = float(peso or 1)
+    return mezcla
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Servidor ya levantado (si no, se arranca uno con Gunicorn)")
+    parser.add_argument("--workers", type=int, default=1, help="Workers de Gunicorn del servidor arrancado")
+    parser.add_argument("--database-url", help="Base de datos del servidor arrancado (por defecto SQLite temporal)")
+    parser.add_argument("--env", action="append", default=[], metavar="CLAVE=VALOR",
+                        help="Variables de entorno extra para el servidor (pool, toggles...)")
+    parser.add_argument("--duracion", type=float, default=20.0, help="Segundos de carga")
+    parser.add_argument("--concurrencia", type=int, default=16, help="Clientes simultáneos")
+    parser.add_argument("--mezcla", help="Pesos por escenario, p. ej. api_lista=50,login=10")
+    parser.add_argument("--autos", type=int, default=100, help="Autos a sembrar antes de la carga")
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--salida", help="Guardar el resumen en JSON")
+    args = parser.parse_args()
+
+    mezcla = parsear_mezcla(args.mezcla) if args.mezcla else dict(MEZCLA_POR_DEFECTO)
+    env_extra = dict(item.split("=", 1) for item in args.env)
+
+    proceso, temporal = None, None
+    url = args.url
+    if url is None:
+        database_url = args.database_url
+        if database_url is None:
+            temporal = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+            temporal.close()
+            database_url = f"sqlite:///{temporal.name}"
+        preparar_base_de_datos(database_url)
+        proceso, url = iniciar_servidor(args.workers, env_extra, database_url)
+        print(f"Servidor en {url} con {args.workers} worker(s)")
+
+    try:
+        resumen = asyncio.run(ejecutar(url, args, mezcla))
+    finally:
+        if proceso is not None:
+            proceso.send_signal(signal.SIGTERM)
+            proceso.wait(timeout=30)
+        if temporal is not None:
+            os.unlink(temporal.name)
+
+    resumen["configuracion"] = {
+        "workers": args.workers if args.url is None else None, "concurrencia": args.concurrencia,
+        "mezcla": mezcla, "env": env_extra,
+    }
+    imprimir(resumen)
+    if args.salida:
+        Path(args.salida).write_text(json.dumps(resumen, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"\nResumen guardado en {args.salida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+"""
+busqueda.py - Índices en memoria para el autocompletado y la búsqueda aproximada
+
+- IndicePrefijos (autocompletado): array ordenado de claves normalizadas
+  (minúsculas, sin acentos) donde un prefijo se resuelve con bisect. Se
+  indexa el texto completo y cada palabra a partir de la segunda, así "mod"
+  y "3" sugieren "Model 3".
+- IndiceNgramas (búsqueda tolerante a erratas): índice invertido de
+  trigramas con listas de documentos en arrays de enteros. Los candidatos se
+  cuentan con NumPy y se puntúan por trigramas compartidos y distancia de
+  edición por palabra (con transposiciones), así "Tesal" o "Kona Electrc"
+  encuentran resultados.
+
+Los índices se construyen con una sola consulta la primera vez que se piden
+y después se mantienen con los eventos de crud (eventos.py). Cada
+BUSQUEDA_TTL_SEGUNDOS se reconstruyen para recoger escrituras de otros workers.
+"""
+
+import bisect
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+import unicodedata
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import eventos
+import models_sql
+
+try:
+    from rapidfuzz.distance import OSA as _OSA
+except ImportError:  # pragma: no cover - depende del entorno
+    _OSA = None
+
+BUSQUEDA_TTL_SEGUNDOS = float(os.getenv("BUSQUEDA_TTL_SEGUNDOS", "300"))
+
+CAMPOS_SUGERENCIAS = {
+    "autos": ("marca", "modelo"),
+    "cargas": ("modelo_auto",),
+    "estaciones": ("nombre", "operador"),
+}
+CAMPOS_BUSQUEDA = {
+    "autos": ("marca", "modelo"),
+    "cargas": ("modelo_auto",),
+    "estaciones": ("nombre", "operador", "ubicacion"),
+}
+_MODELOS = {
+    "autos": models_sql.AutoElectricoSQL,
+    "cargas": models_sql.CargaSQL,
+    "estaciones": models_sql.EstacionSQL,
+}
+
+
+def normalizar(texto: str) -> str:
+    """Minúsculas, sin acentos y con los espacios colapsados."""
+    sin_acentos = unicodedata.normalize("NFKD", texto)
+    sin_acentos = "".join(c for c in sin_acentos if not unicodedata.combining(c))
+    return " ".join(sin_acentos.casefold().split())
+
+
+def _claves(texto: str) -> set:
+    palabras = normalizar(texto).split()
+    return {" ".join(palabras[i:]) for i in range(len(palabras))}
+
+
+class IndicePrefijos:
+    """
+    Claves (clave, campo, texto) ordenadas; cada término aparece una vez
+    aunque lo tengan varias filas, con su frecuencia aparte para ordenar
+    las sugerencias por popularidad.
+    """
+
+    def __init__(self, campos: Iterable[str]):
+        self.campos = tuple(campos)
+        self._claves: List[Tuple[str, str, str]] = []
+        self._frecuencia: Dict[Tuple[str, str], int] = {}
+        self._por_id: Dict[int, Tuple[Tuple[str, str], ...]] = {}
+        self._lock = threading.Lock()
+
+    def _terminos(self, datos: dict) -> Tuple[Tuple[str, str], ...]:
+        return tuple((campo, datos[campo]) for campo in self.campos if datos.get(campo))
+
+    def cargar(self, filas: Iterable[dict]):
+        """Construcción inicial: cuenta todo y ordena una sola vez."""
+        frecuencia, por_id = {}, {}
+        for fila in filas:
+            terminos = self._terminos(fila)
+            por_id[fila["id"]] = terminos
+            for termino in terminos:
+                frecuencia[termino] = frecuencia.get(termino, 0) + 1
+        claves = sorted((clave, campo, texto) for campo, texto in frecuencia for clave in _claves(texto))
+        with self._lock:
+            self._claves, self._frecuencia, self._por_id = claves, frecuencia, por_id
+
+    def _sumar(self, termino: Tuple[str, str]):
+        n = self._frecuencia.get(termino, 0)
+        self._frecuencia[termino] = n + 1
+        if n == 0:
+            campo, texto = termino
+            for clave in _claves(texto):
+                bisect.insort(self._claves, (clave, campo, texto))
+
+    def _restar(self, termino: Tuple[str, str]):
+        n = self._frecuencia.get(termino, 0)
+        if n > 1:
+            self._frecuencia[termino] = n - 1
+            return
+        self._frecuencia.pop(termino, None)
+        campo, texto = termino
+        for clave in _claves(texto):
+            entrada = (clave, campo, texto)
+            i = bisect.bisect_left(self._claves, entrada)
+            if i < len(self._claves) and self._claves[i] == entrada:
+                del self._claves[i]
+
+    def upsert(self, id: int, datos: dict):
+        nuevos = self._terminos(datos)
+        with self._lock:
+            for termino in self._por_id.get(id, ()):
+                self._restar(termino)
+            for termino in nuevos:
+                self._sumar(termino)
+            self._por_id[id] = nuevos
+
+    def eliminar(self, id: int):
+        with self._lock:
+            for termino in self._por_id.pop(id, ()):
+                self._restar(termino)
+
+    def sugerir(self, prefijo: str, limite: int = 10) -> List[dict]:
+        prefijo = normalizar(prefijo)
+        if not prefijo:
+            return []
+        # Se recorre todo el rango del prefijo y un heap elige los más frecuentes:
+        # cortar antes por orden alfabético dejaría fuera términos populares
+        with self._lock:
+            inicio = bisect.bisect_left(self._claves, (prefijo,))
+            fin = bisect.bisect_left(self._claves, (prefijo + "\U0010ffff",), inicio)
+            encontrados = {(campo, texto) for _, campo, texto in itertools.islice(self._claves, inicio, fin)}
+            candidatos = [(termino, self._frecuencia[termino]) for termino in encontrados]
+        mejores = heapq.nsmallest(limite, candidatos, key=lambda t: (-t[1], t[0][1]))
+        return [{"texto": texto, "campo": campo, "total": total} for (campo, texto), total in mejores]
+
+    def __len__(self):
+        return len(self._por_id)
+
+
+# --------------------- Búsqueda aproximada (trigramas) ---------------------
+
+# Suma máxima de listas de documentos que se recorren por consulta; los
+# trigramas más frecuentes (los que menos discriminan) se descartan primero
+MAX_POSTINGS = int(os.getenv("BUSQUEDA_MAX_POSTINGS", "2000000"))
+# Documentos que pasan a la verificación con distancia de edición
+MAX_VERIFICADOS = 200
+# Fracción de trigramas de la consulta que debe compartir un candidato
+SOLAPE_MINIMO = 0.3
+PUNTAJE_MINIMO = 0.45
+
+
+def ngramas(texto: str, n: int = 3) -> set:
+    """Trigramas por palabra con relleno (como pg_trgm): '  kona ' -> {'  k', ' ko', 'kon', 'ona', 'na '}."""
+    grams = set()
+    for palabra in texto.split():
+        relleno = " " * (n - 1) + palabra + " "
+        grams.update(relleno[i:i + n] for i in range(len(relleno) - n + 1))
+    return grams
+
+
+def distancia_edicion(a: str, b: str) -> int:
+    """
+    Levenshtein con transposiciones de letras vecinas (Damerau restringida):
+    "tesal" -> "tesla" cuesta 1. Usa rapidfuzz si está instalado.
+    """
+    if _OSA is not None:
+        return _OSA.distance(a, b)
+    previa, anterior = None, list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        actual = [i]
+        for j, cb in enumerate(b, 1):
+            costo = min(anterior[j] + 1, actual[j - 1] + 1, anterior[j - 1] + (ca != cb))
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                costo = min(costo, previa[j - 2] + 1)
+            actual.append(costo)
+        previa, anterior = anterior, actual
+    return anterior[-1]
+
+
+def _similitud_palabras(consulta: List[str], texto: List[str], cache: dict) -> float:
+    """Media, por palabra de la consulta, de la mejor similitud 1 - distancia/longitud."""
+    total = 0.0
+    for q in consulta:
+        mejor = 0.0
+        for t in texto:
+            clave = (q, t)
+            similitud = cache.get(clave)
+            if similitud is None:
+                similitud = cache[clave] = 1 - distancia_edicion(q, t) / max(len(q), len(t))
+            if similitud > mejor:
+                mejor = similitud
+                if mejor == 1.0:
+                    break
+        total += mejor
+    return total / len(consulta)
+
+
+class IndiceNgramas:
+    """
+    Índice invertido trigrama -> array('i') de números de documento. Cada
+    upsert añade un documento nuevo y marca el anterior como muerto, así las
+    listas solo crecen por el final y siguen ordenadas; cuando los muertos
+    pasan de un cuarto del total se compacta.
+    """
+
+    def __init__(self, campos: Iterable[str]):
+        self.campos = tuple(campos)
+        self._vaciar()
+        self._lock = threading.Lock()
+
+    def _vaciar(self):
+        self._postings: Dict[str, array] = {}
+        self._filas = array("i")                 # documento -> id de la fila
+        self._textos: List[Optional[str]] = []   # documento -> texto normalizado (None si muerto)
+        self._documento: Dict[int, int] = {}     # id de la fila -> documento vivo
+        self._muertos = 0
+
+    def _texto(self, datos: dict) -> str:
+        return normalizar(" ".join(str(datos[campo]) for campo in self.campos if datos.get(campo)))
+
+    def _agregar(self, id: int, texto: str):
+        documento = len(self._textos)
+        self._textos.append(texto)
+        self._filas.append(id)
+        self._documento[id] = documento
+        for gram in ngramas(texto):
+            lista = self._postings.get(gram)
+            if lista is None:
+                lista = self._postings[gram] = array("i")
+            lista.append(documento)
+
+    def _matar(self, id: int):
+        documento = self._documento.pop(id, None)
+        if documento is not None:
+            self._textos[documento] = None
+            self._muertos += 1
+
+    def _compactar_si_hace_falta(self):
+        if self._muertos > max(1000, len(self._textos) // 4):
+            vivos = [(self._filas[d], t) for d, t in enumerate(self._textos) if t is not None]
+            self._vaciar()
+            for id, texto in vivos:
+                self._agregar(id, texto)
+
+    def cargar(self, filas: Iterable[dict]):
+        with self._lock:
+            self._vaciar()
+            for fila in filas:
+                self._agregar(fila["id"], self._texto(fila))
+
+    def upsert(self, id: int, datos: dict):
+        texto = self._texto(datos)
+        with self._lock:
+            documento = self._documento.get(id)
+            if documento is not None and self._textos[documento] == texto:
+                return
+            self._matar(id)
+            self._agregar(id, texto)
+            self._compactar_si_hace_falta()
+
+    def eliminar(self, id: int):
+        with self._lock:
+            self._matar(id)
+            self._compactar_si_hace_falta()
+
+    def buscar(self, q: str, limite: int = 20, presupuesto_ms: float = 50.0) -> List[Tuple[int, float]]:
+        """
+        [(id, puntaje)] de mayor a menor. Puntaje = media entre la fracción de
+        trigramas de la consulta que tiene el documento (no se penaliza que el
+        documento tenga más campos) y la similitud de edición por palabra. La
+        verificación se corta al agotar `presupuesto_ms` (los candidatos van
+        de más a menos trigramas compartidos).
+        """
+        inicio = time.perf_counter()
+        consulta = normalizar(q)
+        grams = ngramas(consulta)
+        if not grams:
+            return []
+
+        with self._lock:
+            listas = sorted((self._postings[g] for g in grams if g in self._postings), key=len)
+            usadas, recorridos = [], 0
+            for lista in listas:
+                if usadas and recorridos + len(lista) > MAX_POSTINGS:
+                    break
+                usadas.append(np.frombuffer(lista, dtype=np.int32).copy())
+                recorridos += len(lista)
+            textos = self._textos
+            filas = self._filas
+        if not usadas:
+            return []
+
+        conteo = np.bincount(np.concatenate(usadas))
+        candidatos = np.flatnonzero(conteo >= max(1, math.ceil(len(grams) * SOLAPE_MINIMO)))
+        if len(candidatos) > MAX_VERIFICADOS:
+            mejores = np.argpartition(conteo[candidatos], -MAX_VERIFICADOS)[-MAX_VERIFICADOS:]
+            candidatos = candidatos[mejores]
+        candidatos = candidatos[np.argsort(-conteo[candidatos], kind="stable")]
+
+        palabras_consulta = consulta.split()
+        cache, puntajes = {}, {}
+        limite_tiempo = inicio + presupuesto_ms / 1000
+        for documento in candidatos.tolist():
+            texto = textos[documento]
+            if texto is None:
+                continue
+            cobertura = conteo[documento] / len(grams)
+            puntaje = (cobertura + _similitud_palabras(palabras_consulta, texto.split(), cache)) / 2
+            if puntaje >= PUNTAJE_MINIMO:
+                puntajes[filas[documento]] = round(float(puntaje), 4)
+            if time.perf_counter() > limite_tiempo:
+                break
+        return sorted(puntajes.items(), key=lambda t: -t[1])[:limite]
+
+    def __len__(self):
+        return len(self._documento)
+
+
+# --------------------- Índices de la aplicación ---------------------
+
+_TIPOS = {
+    "prefijos": (IndicePrefijos, CAMPOS_SUGERENCIAS),
+    "ngramas": (IndiceNgramas, CAMPOS_BUSQUEDA),
+}
+
+
+def _aplicar(indice, evento):
+    if evento.accion == "delete":
+        indice.eliminar(evento.id)
+    elif evento.datos is not None:
+        indice.upsert(evento.id, evento.datos)
+
+
+def _construir(clave: Tuple[str, str], db: Session):
+    tipo, entidad = clave
+    clase, campos = _TIPOS[tipo]
+    nuevo = clase(campos[entidad])
+    tabla = _MODELOS[entidad].__table__
+    columnas = [tabla.c.id] + [tabla.c[campo] for campo in nuevo.campos]
+    nuevo.cargar(db.execute(select(*columnas)).mappings())
+    return nuevo
+
+
+# (tipo, entidad) -> índice
+_indices = eventos.CacheEventos("busqueda", _construir, _aplicar, ttl=BUSQUEDA_TTL_SEGUNDOS,
+                                entidades=lambda clave: clave[1:])
+
+
+def indice(db: Session, entidad: str, tipo: str = "prefijos"):
+    """Índice de la entidad; lo construye si no existe o caducó."""
+    return _indices.obtener((tipo, entidad), db)
+
+
+def sugerir(db: Session, entidad: str, q: str, limite: int = 10) -> List[dict]:
+    return indice(db, entidad, "prefijos").sugerir(q, limite)
+
+
+def buscar_aproximado(db: Session, entidad: str, q: str, limite: int = 20) -> List[Tuple[int, float]]:
+    """[(id, puntaje)] de las filas más parecidas a `q`, tolerando erratas."""
+    return indice(db, entidad, "ngramas").buscar(q, limite)
+
+
+def invalidar(entidad: Optional[str] = None):
+    """Descarta los índices (todos o los de una entidad) para reconstruirlos en la próxima consulta."""
+    _indices.invalidar(entidad)
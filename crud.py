@@ -1,13 +1,166 @@
 # crud.py - CORREGIDO PARA SQLALCHEMY 2.0 (VERSION FINAL)
-from sqlalchemy import func, select, update, delete  # Añadidos select, update, delete
+from sqlalchemy import func, select, insert, update, delete, text, literal, union_all, Boolean  # Añadidos select, insert, update, delete
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from datetime import datetime
+import json
+import os
+import threading
+import time
 import models_sql as models
+import eventos
+import horarios
+import invalidacion
+import metricas
+from busqueda import normalizar
 # Se asume que AutoActualizado debe estar importado para update_auto
 from modelos import AutoElectrico, CargaBase, EstacionBase, CargaActualizada, EstacionActualizada, AutoActualizado, \
     EstacionActualizada
 
 
+# --------------------- ESCRITURA CON RETURNING ---------------------
+
+# Entidad de cada tabla en los eventos de cambios (eventos.py)
+_ENTIDAD = {models.AutoElectricoSQL: "autos", models.CargaSQL: "cargas", models.EstacionSQL: "estaciones"}
+# Tabla de historial de cada entidad; las versiones son comunes a filas vivas y lápidas
+_HISTORIAL = {
+    models.AutoElectricoSQL: models.AutoEliminadoSQL,
+    models.CargaSQL: models.CargaEliminadaSQL,
+    models.EstacionSQL: models.EstacionEliminadaSQL,
+}
+
+
+def modelo_de(entidad: str):
+    """Modelo SQLAlchemy de una entidad ("autos", "cargas", "estaciones")."""
+    return next(m for m, nombre in _ENTIDAD.items() if nombre == entidad)
+
+
+def _siguiente_version(db: Session, modelo):
+    """
+    Expresión SQL con la siguiente versión de la entidad, para calcularla dentro
+    del mismo INSERT/UPDATE. Devuelve (expresión, CTE a añadir o None).
+
+    - Postgres: contador en versiones_catalogo incrementado en un CTE. El
+      bloqueo de esa fila hasta el commit hace que las versiones se confirmen
+      en orden, así un lector con `since` nunca se salta una fila.
+    - SQLite: 1 + MAX(version) de filas vivas y lápidas; SQLite ya serializa
+      las escrituras, así que el resultado es igual de monotónico.
+    """
+    dialecto = db.get_bind().dialect.name
+    if dialecto == "postgresql":
+        contador = models.VersionCatalogoSQL.__table__
+        cte = (
+            update(contador)
+            .where(contador.c.entidad == _ENTIDAD[modelo])
+            .values(valor=contador.c.valor + 1)
+            .returning(contador.c.valor)
+            .cte("siguiente_version")
+        )
+        return select(cte.c.valor).scalar_subquery(), cte
+
+    vivas = func.coalesce(select(func.max(modelo.__table__.c.version)).scalar_subquery(), 0)
+    lapidas = func.coalesce(select(func.max(_HISTORIAL[modelo].__table__.c.version)).scalar_subquery(), 0)
+    mayor = func.max(vivas, lapidas) if dialecto == "sqlite" else func.greatest(vivas, lapidas)
+    return mayor + 1, None
+
+
+def _con_version(stmt, db: Session, modelo):
+    version, cte = _siguiente_version(db, modelo)
+    stmt = stmt.values(version=version)
+    return stmt.add_cte(cte) if cte is not None else stmt
+
+
+def _fila_a_dict(db_obj) -> dict:
+    """Convierte un objeto ORM en un dict con las columnas de su tabla."""
+    return {col.key: getattr(db_obj, col.key) for col in db_obj.__table__.columns}
+
+
+def _insertar_returning(db: Session, modelo, valores: dict) -> dict:
+    """
+    Inserta una fila y la devuelve en un solo viaje (INSERT ... RETURNING).
+    Si el dialecto no soporta RETURNING se relee la fila por su clave primaria.
+    """
+    tabla = modelo.__table__
+    stmt = _con_version(insert(tabla).values(**valores), db, modelo)
+    if db.get_bind().dialect.insert_returning:
+        fila = dict(db.execute(stmt.returning(*tabla.c)).mappings().one())
+        obj_id = fila["id"]
+    else:
+        fila, obj_id = None, db.execute(stmt).inserted_primary_key[0]
+    if modelo is models.EstacionSQL:
+        _guardar_horario(db, obj_id, valores["horario_apertura"], nueva=True)
+    db.commit()
+    if fila is None:
+        fila = _fila_a_dict(db.get(modelo, obj_id))
+
+    invalidacion.propia(_ENTIDAD[modelo], fila["version"])
+    eventos.publicar(_ENTIDAD[modelo], "create", fila["id"], fila)
+    return fila
+
+
+def _actualizar_returning(db: Session, modelo, obj_id: int, valores: dict) -> Optional[dict]:
+    """
+    Actualiza una fila por ID y la devuelve en un solo viaje (UPDATE ... RETURNING).
+    Retorna None si la fila no existe. Sin RETURNING se emula con UPDATE + SELECT.
+    """
+    tabla = modelo.__table__
+    if not valores:
+        fila = db.execute(select(*tabla.c).where(tabla.c.id == obj_id)).mappings().first()
+        return dict(fila) if fila else None
+
+    stmt = _con_version(update(tabla).where(tabla.c.id == obj_id).values(**valores), db, modelo)
+    if db.get_bind().dialect.update_returning:
+        fila = db.execute(stmt.returning(*tabla.c)).mappings().first()
+    else:
+        resultado = db.execute(stmt)
+        fila = None
+        if resultado.rowcount:
+            fila = db.execute(select(*tabla.c).where(tabla.c.id == obj_id)).mappings().first()
+
+    if fila is None:
+        db.rollback()
+        return None
+
+    fila = dict(fila)
+    if modelo is models.EstacionSQL and "horario_apertura" in valores:
+        _guardar_horario(db, obj_id, valores["horario_apertura"])
+    db.commit()
+    invalidacion.propia(_ENTIDAD[modelo], fila["version"])
+    eventos.publicar(_ENTIDAD[modelo], "update", obj_id, fila)
+    return fila
+
+
+def _archivar(db: Session, modelo, db_obj) -> dict:
+    """
+    Copia la fila al historial como lápida (id original y versión del borrado)
+    y la elimina de la tabla principal, en la misma transacción.
+    """
+    historial = _HISTORIAL[modelo].__table__
+    valores = {
+        col.key: getattr(db_obj, col.key)
+        for col in historial.columns
+        if col.key in modelo.__table__.c and col.key not in ("id", "version")
+    }
+    valores.update(id_original=db_obj.id, eliminado_en=datetime.utcnow())
+    stmt = _con_version(insert(historial).values(**valores), db, modelo)
+    if db.get_bind().dialect.insert_returning:
+        version = db.execute(stmt.returning(historial.c.version)).scalar_one()
+    else:
+        version = None
+        db.execute(stmt)
+    if modelo is models.AutoElectricoSQL:
+        # ON DELETE SET NULL también donde no se aplican las claves foráneas (SQLite)
+        cargas = models.CargaSQL.__table__
+        db.execute(update(cargas).where(cargas.c.auto_id == db_obj.id).values(auto_id=None))
+    if modelo is models.EstacionSQL:
+        _guardar_horario(db, db_obj.id, None)
+    db.execute(delete(modelo).where(modelo.id == db_obj.id))
+    db.commit()
+    invalidacion.propia(_ENTIDAD[modelo], version)
+    eventos.publicar(_ENTIDAD[modelo], "delete", db_obj.id)
+    return valores
+
+
 # --------------------- OPERACIONES AUTOS ---------------------
 
 def get_autos(db: Session, skip: int = 0, limit: int = 100):
@@ -41,30 +194,13 @@ def create_auto(db: Session, auto: AutoElectrico):
     if existing_auto:
         raise ValueError(f"Ya existe un auto con el modelo '{auto.modelo}' y año '{auto.anio}'")
 
-    db_auto = models.AutoElectricoSQL(**auto.model_dump())
-    db.add(db_auto)
-    db.commit()
-    db.refresh(db_auto)
-    return db_auto
+    return _insertar_returning(db, models.AutoElectricoSQL, auto.model_dump())
 
 
 def update_auto(db: Session, auto_id: int, auto: AutoActualizado):
     """Actualiza un auto eléctrico existente."""
-    stmt_get = select(models.AutoElectricoSQL).where(models.AutoElectricoSQL.id == auto_id)
-    db_auto = db.scalar(stmt_get)
-
-    if not db_auto:
-        return None
-
     update_data = auto.model_dump(exclude_unset=True)
-
-    # Actualización directa del objeto ORM, la forma recomendada en sesiones
-    for key, value in update_data.items():
-        setattr(db_auto, key, value)
-
-    db.commit()
-    db.refresh(db_auto)
-    return db_auto
+    return _actualizar_returning(db, models.AutoElectricoSQL, auto_id, update_data)
 
 
 def delete_auto(db: Session, auto_id: int):
@@ -75,20 +211,7 @@ def delete_auto(db: Session, auto_id: int):
     if not db_auto:
         return None
 
-    # Mover al historial
-    auto_data = db_auto.__dict__.copy()
-    auto_data.pop('_sa_instance_state', None)
-    auto_data.pop('id', None)  # Permitir que el ID del historial se autogenere
-
-    db_auto_eliminado = models.AutoEliminadoSQL(**auto_data)
-    db.add(db_auto_eliminado)
-
-    # Eliminar con la sentencia delete
-    stmt_delete = delete(models.AutoElectricoSQL).where(models.AutoElectricoSQL.id == auto_id)
-    db.execute(stmt_delete)
-
-    db.commit()
-    return db_auto_eliminado
+    return _archivar(db, models.AutoElectricoSQL, db_auto)
 
 
 # --------------------- OPERACIONES CARGAS ---------------------
@@ -112,29 +235,19 @@ def get_carga_by_modelo(db: Session, modelo: str):
 
 
 def create_carga(db: Session, carga: CargaBase):
-    """Crea un nuevo registro de dificultad de carga."""
-    db_carga = models.CargaSQL(**carga.model_dump())
-    db.add(db_carga)
-    db.commit()
-    db.refresh(db_carga)
-    return db_carga
+    """Crea un nuevo registro de dificultad de carga (enlazado a su auto si no se indica)."""
+    valores = carga.model_dump()
+    if valores.get("auto_id") is None:
+        valores["auto_id"] = auto_de_modelo(db, valores["modelo_auto"])
+    return _insertar_returning(db, models.CargaSQL, valores)
 
 
 def update_carga(db: Session, carga_id: int, carga: CargaActualizada):
     """Actualiza un registro de dificultad de carga existente."""
-    stmt_get = select(models.CargaSQL).where(models.CargaSQL.id == carga_id)
-    db_carga = db.scalar(stmt_get)
-
-    if not db_carga:
-        return None
-
     update_data = carga.model_dump(exclude_unset=True)
-    for key, value in update_data.items():
-        setattr(db_carga, key, value)
-
-    db.commit()
-    db.refresh(db_carga)
-    return db_carga
+    if update_data.get("modelo_auto") and "auto_id" not in update_data:
+        update_data["auto_id"] = auto_de_modelo(db, update_data["modelo_auto"])
+    return _actualizar_returning(db, models.CargaSQL, carga_id, update_data)
 
 
 def delete_carga(db: Session, carga_id: int):
@@ -145,27 +258,14 @@ def delete_carga(db: Session, carga_id: int):
     if not db_carga:
         return None
 
-    # Mover al historial
-    carga_data = db_carga.__dict__.copy()
-    carga_data.pop('_sa_instance_state', None)
-    carga_data.pop('id', None)
-
-    db_carga_eliminada = models.CargaEliminadaSQL(**carga_data)
-    db.add(db_carga_eliminada)
-
-    # Eliminar con la sentencia delete
-    stmt_delete = delete(models.CargaSQL).where(models.CargaSQL.id == carga_id)
-    db.execute(stmt_delete)
-
-    db.commit()
-    return db_carga_eliminada
+    return _archivar(db, models.CargaSQL, db_carga)
 
 
 # --------------------- OPERACIONES ESTACIONES ---------------------
 
-def get_estaciones(db: Session, skip: int = 0, limit: int = 100):
-    """Obtiene una lista de estaciones de carga con paginación."""
-    stmt = select(models.EstacionSQL).offset(skip).limit(limit)
+def get_estaciones(db: Session, skip: int = 0, limit: int = 100, condiciones: Sequence = ()):
+    """Obtiene una lista de estaciones de carga con paginación (y filtros opcionales, p. ej. abierta_en)."""
+    stmt = select(models.EstacionSQL).where(*condiciones).offset(skip).limit(limit)
     return db.scalars(stmt).all()
 
 
@@ -175,36 +275,21 @@ def get_estacion(db: Session, estacion_id: int):
     return db.scalar(stmt)
 
 
-def get_estacion_by_nombre(db: Session, nombre: str):
+def get_estacion_by_nombre(db: Session, nombre: str, condiciones: Sequence = ()):
     """Busca estaciones de carga por una parte de su nombre (case-insensitive)."""
-    stmt = select(models.EstacionSQL).where(models.EstacionSQL.nombre.ilike(f"%{nombre}%"))
+    stmt = select(models.EstacionSQL).where(models.EstacionSQL.nombre.ilike(f"%{nombre}%"), *condiciones)
     return db.scalars(stmt).all()
 
 
 def create_estacion(db: Session, estacion: EstacionBase):
     """Crea una nueva estación de carga."""
-    db_estacion = models.EstacionSQL(**estacion.model_dump())
-    db.add(db_estacion)
-    db.commit()
-    db.refresh(db_estacion)
-    return db_estacion
+    return _insertar_returning(db, models.EstacionSQL, estacion.model_dump())
 
 
 def update_estacion(db: Session, estacion_id: int, estacion: EstacionActualizada):
     """Actualiza una estación de carga existente."""
-    stmt_get = select(models.EstacionSQL).where(models.EstacionSQL.id == estacion_id)
-    db_estacion = db.scalar(stmt_get)
-
-    if not db_estacion:
-        return None
-
     update_data = estacion.model_dump(exclude_unset=True)
-    for key, value in update_data.items():
-        setattr(db_estacion, key, value)
-
-    db.commit()
-    db.refresh(db_estacion)
-    return db_estacion
+    return _actualizar_returning(db, models.EstacionSQL, estacion_id, update_data)
 
 
 def delete_estacion(db: Session, estacion_id: int):
@@ -215,20 +300,104 @@ def delete_estacion(db: Session, estacion_id: int):
     if not db_estacion:
         return None
 
-    # Mover al historial
-    estacion_data = db_estacion.__dict__.copy()
-    estacion_data.pop('_sa_instance_state', None)
-    estacion_data.pop('id', None)
-
-    db_estacion_eliminada = models.EstacionEliminadaSQL(**estacion_data)
-    db.add(db_estacion_eliminada)
-
-    # Eliminar con la sentencia delete
-    stmt_delete = delete(models.EstacionSQL).where(models.EstacionSQL.id == estacion_id)
-    db.execute(stmt_delete)
-
-    db.commit()
-    return db_estacion_eliminada
+    return _archivar(db, models.EstacionSQL, db_estacion)
+
+
+# --------------------- ENLACE CARGAS - AUTOS ---------------------
+
+def emparejar_cargas(autos: Iterable[dict], cargas: Iterable[dict]) -> Dict[int, int]:
+    """
+    {id de carga: id de auto} comparando modelo_auto con "marca modelo"
+    normalizado (minúsculas, sin acentos). Si modelo_auto no trae la marca se
+    acepta el modelo solo cuando es de una única marca. Entre varios años del
+    mismo modelo se elige el más reciente.
+    """
+    por_nombre, por_modelo = {}, {}
+    for auto in sorted(autos, key=lambda a: (a["anio"], a["id"])):
+        por_nombre[normalizar(f"{auto['marca']} {auto['modelo']}")] = auto["id"]
+        marcas, _ = por_modelo.get(normalizar(auto["modelo"]), (set(), None))
+        por_modelo[normalizar(auto["modelo"])] = (marcas | {normalizar(auto["marca"])}, auto["id"])
+
+    enlaces = {}
+    for carga in cargas:
+        clave = normalizar(carga["modelo_auto"])
+        auto_id = por_nombre.get(clave)
+        if auto_id is None and clave in por_modelo and len(por_modelo[clave][0]) == 1:
+            auto_id = por_modelo[clave][1]
+        if auto_id is not None:
+            enlaces[carga["id"]] = auto_id
+    return enlaces
+
+
+def auto_de_modelo(db: Session, modelo_auto: str) -> Optional[int]:
+    """
+    Auto que corresponde al texto de una carga, con el mismo criterio que
+    emparejar_cargas. Primero se prueba solo con los autos de las marcas con
+    las que empieza el texto (comparadas ya normalizadas); si no hay
+    coincidencia se usa el catálogo completo para el caso de modelo sin marca.
+    """
+    autos = models.AutoElectricoSQL.__table__
+    columnas = (autos.c.id, autos.c.marca, autos.c.modelo, autos.c.anio)
+    carga = [{"id": 0, "modelo_auto": modelo_auto}]
+    clave = normalizar(modelo_auto)
+    marcas = [m for m in db.scalars(select(autos.c.marca).distinct())
+              if clave.startswith(normalizar(m) + " ")]
+    if marcas:
+        candidatos = db.execute(select(*columnas).where(autos.c.marca.in_(marcas))).mappings().all()
+        auto_id = emparejar_cargas(candidatos, carga).get(0)
+        if auto_id is not None:
+            return auto_id
+    return emparejar_cargas(db.execute(select(*columnas)).mappings().all(), carga).get(0)
+
+
+def get_auto_completo(db: Session, auto_id: int, campos_auto: List[str], campos_carga: List[str]) -> Optional[dict]:
+    """
+    El auto y sus perfiles de carga (cargas.auto_id) en una sola consulta:
+    LEFT JOIN por la clave indexada, una fila por carga.
+    """
+    autos, cargas = models.AutoElectricoSQL.__table__, models.CargaSQL.__table__
+    stmt = (
+        select(*(autos.c[c].label(f"a_{c}") for c in campos_auto),
+               *(cargas.c[c].label(f"c_{c}") for c in campos_carga))
+        .select_from(autos.outerjoin(cargas, cargas.c.auto_id == autos.c.id))
+        .where(autos.c.id == auto_id)
+        .order_by(cargas.c.id)
+    )
+    filas = db.execute(stmt).mappings().all()
+    if not filas:
+        return None
+    return {
+        "auto": {c: filas[0][f"a_{c}"] for c in campos_auto},
+        "cargas": [{c: fila[f"c_{c}"] for c in campos_carga} for fila in filas if fila["c_id"] is not None],
+    }
+
+
+# --------------------- HORARIOS DE APERTURA ---------------------
+
+def _guardar_horario(db: Session, estacion_id: int, horario: Optional[str], nueva: bool = False):
+    """
+    Sustituye los intervalos de apertura de la estación por los de `horario`
+    (ninguno si es None o no se entiende), dentro de la transacción de la escritura.
+    """
+    tabla = models.IntervaloHorarioSQL.__table__
+    if not nueva:
+        db.execute(delete(tabla).where(tabla.c.estacion_id == estacion_id))
+    intervalos = horarios.intervalos(horario) if horario is not None else ()
+    if intervalos:
+        db.execute(insert(tabla), [{"estacion_id": estacion_id, "inicio": inicio, "fin": fin}
+                                   for inicio, fin in intervalos])
+
+
+def abierta_en(minuto: int):
+    """
+    Condición para filtrar estaciones abiertas en un minuto de la semana
+    (horarios.parsear_instante). Usa el índice (inicio, fin) de
+    horarios_estaciones; las estaciones con horario no interpretable no salen.
+    """
+    tabla = models.IntervaloHorarioSQL.__table__
+    return models.EstacionSQL.id.in_(
+        select(tabla.c.estacion_id).where(tabla.c.inicio <= minuto, tabla.c.fin > minuto)
+    )
 
 
 # --------------------- OPERACIONES DE HISTORIAL (ELIMINADOS) ---------------------
@@ -271,6 +440,255 @@ def get_estacion_eliminada(db: Session, estacion_id: int):
     return db.scalar(stmt)
 
 
+# --------------------- LECTURA POR LOTES DE IDS ---------------------
+
+def get_por_ids(db: Session, entidad: str, ids: List[int], historial: bool = False,
+                campos: Optional[List[str]] = None, condiciones: Sequence = ()):
+    """
+    Resuelve varios ids con un solo `WHERE id IN (...)`. Devuelve (filas, faltantes):
+    las filas en el orden pedido (sin repetidos) y los ids que no existen.
+    Con `historial` busca en la tabla de eliminados y devuelve diccionarios;
+    con `campos` solo lee esas columnas (ver get_parcial). Las `condiciones`
+    (p. ej. abierta_en) se añaden al WHERE; los ids que no las cumplen
+    cuentan como faltantes.
+    """
+    modelo = modelo_de(entidad)
+    unicos = list(dict.fromkeys(ids))
+    if historial or campos:
+        tabla = _HISTORIAL[modelo].__table__ if historial else modelo.__table__
+        columnas = _columnas(tabla, campos) if campos else tabla.c
+        filas = db.execute(select(*columnas).where(tabla.c.id.in_(unicos), *condiciones)).mappings().all()
+        por_id = {f["id"]: dict(f) for f in filas}
+    else:
+        por_id = {f.id: f for f in db.scalars(select(modelo).where(modelo.id.in_(unicos), *condiciones))}
+    return [por_id[i] for i in unicos if i in por_id], [i for i in unicos if i not in por_id]
+
+
+# --------------------- PROYECCIÓN DE COLUMNAS (fields=) ---------------------
+
+def _columnas(tabla, campos: List[str]) -> list:
+    """Columnas pedidas; el id se incluye siempre para poder identificar la fila."""
+    return [tabla.c.id] + [tabla.c[c] for c in dict.fromkeys(campos) if c != "id"]
+
+
+def get_parcial(db: Session, entidad: str, campos: List[str], skip: int = 0, limit: int = 100,
+                condiciones: Sequence = ()) -> List[dict]:
+    """
+    Listado paginado que solo selecciona las columnas pedidas y devuelve
+    diccionarios, sin cargar objetos ORM completos (ubicacion, url_imagen...).
+    """
+    modelo = modelo_de(entidad)
+    stmt = select(*_columnas(modelo.__table__, campos)).where(*condiciones).offset(skip).limit(limit)
+    return [dict(f) for f in db.execute(stmt).mappings()]
+
+
+# --------------------- FEED DE CAMBIOS ---------------------
+
+def get_cambios(db: Session, entidad: str, desde: int = 0, limite: int = 500) -> dict:
+    """
+    Filas creadas/actualizadas y lápidas con versión mayor que `desde`, en
+    orden de versión. El cliente guarda `token` y lo envía como `since` en la
+    siguiente llamada; `hay_mas` indica que debe seguir pidiendo.
+    """
+    modelo = modelo_de(entidad)
+    tabla = modelo.__table__
+    historial = _HISTORIAL[modelo].__table__
+
+    vivas = db.execute(
+        select(*tabla.c).where(tabla.c.version > desde).order_by(tabla.c.version).limit(limite + 1)
+    ).mappings().all()
+    lapidas = db.execute(
+        select(historial.c.id_original, historial.c.version, historial.c.eliminado_en)
+        .where(historial.c.version > desde, historial.c.id_original.isnot(None))
+        .order_by(historial.c.version)
+        .limit(limite + 1)
+    ).mappings().all()
+
+    cambios = [{"accion": "upsert", "id": f["id"], "version": f["version"], "datos": dict(f)} for f in vivas]
+    cambios += [
+        {"accion": "delete", "id": f["id_original"], "version": f["version"], "eliminado_en": f["eliminado_en"]}
+        for f in lapidas
+    ]
+    cambios.sort(key=lambda c: c["version"])
+
+    return {
+        "token": cambios[min(limite, len(cambios)) - 1]["version"] if cambios else desde,
+        "hay_mas": len(cambios) > limite,
+        "cambios": cambios[:limite],
+    }
+
+
+# --------------------- BÚSQUEDA POR FACETAS ---------------------
+
+FACETAS = {
+    "autos": ("marca", "anio", "disponible"),
+    "cargas": ("dificultad_carga", "requiere_instalacion_domestica"),
+    "estaciones": ("tipo_conector", "operador", "acceso_publico"),
+}
+
+
+def _conteos_facetas(db: Session, tabla, facetas, condiciones) -> dict:
+    """
+    Conteos de todas las facetas con una sola sentencia: GROUPING SETS en
+    Postgres; en el resto, UNION ALL de un GROUP BY por faceta (SQLite no
+    tiene GROUPING SETS, pero sigue siendo un único viaje a la base).
+    """
+    columnas = [tabla.c[f] for f in facetas]
+    if db.get_bind().dialect.name == "postgresql":
+        stmt = (
+            select(*columnas, *(func.grouping(c) for c in columnas), func.count())
+            .where(*condiciones)
+            .group_by(func.grouping_sets(*columnas))
+        )
+        n, filas = len(columnas), []
+        for fila in db.execute(stmt):
+            # GROUPING(col) = 0 para la columna por la que se agrupó la fila
+            i = list(fila[n:2 * n]).index(0)
+            filas.append((facetas[i], fila[i], fila[-1]))
+    else:
+        stmt = union_all(*(
+            select(literal(f).label("faceta"), c.label("valor"), func.count().label("total"))
+            .where(*condiciones)
+            .group_by(c)
+            for f, c in zip(facetas, columnas)
+        ))
+        filas = db.execute(stmt).all()
+
+    conteos = {f: [] for f in facetas}
+    for faceta, valor, total in filas:
+        if isinstance(tabla.c[faceta].type, Boolean) and valor is not None:
+            valor = bool(valor)
+        conteos[faceta].append({"valor": valor, "total": total})
+    for valores in conteos.values():
+        valores.sort(key=lambda v: (-v["total"], str(v["valor"])))
+    return conteos
+
+
+def get_facetas(db: Session, entidad: str, filtros: dict, campos: List[str], skip: int = 0,
+                limit: int = 20) -> dict:
+    """
+    Resultados paginados y conteos por faceta para el filtro actual. `filtros`
+    es {faceta: [valores]}: OR dentro de una faceta y AND entre facetas.
+    """
+    modelo = modelo_de(entidad)
+    tabla = modelo.__table__
+    condiciones = [tabla.c[f].in_(valores) for f, valores in filtros.items()]
+
+    facetas = _conteos_facetas(db, tabla, FACETAS[entidad], condiciones)
+    resultados = db.execute(
+        select(*_columnas(tabla, campos)).where(*condiciones).order_by(tabla.c.id).offset(skip).limit(limit)
+    ).mappings().all()
+    return {
+        "total": sum(v["total"] for v in facetas[FACETAS[entidad][0]]),
+        "resultados": [dict(f) for f in resultados],
+        "facetas": facetas,
+    }
+
+
+# --------------------- TOTALES PARA PAGINACIÓN ---------------------
+
+# Por encima de este número de filas no se hace COUNT(*) sino que se estima
+CONTEO_UMBRAL = int(os.getenv("CONTEO_UMBRAL", "10000"))
+# Cada cuánto se vuelve a leer el total de la base (las escrituras propias se
+# suman al momento; las de otros workers llegan como 'reset', ver invalidacion.py)
+CONTEO_TTL_SEGUNDOS = float(os.getenv("CONTEO_TTL_SEGUNDOS", "60"))
+
+# entidad -> [total, es_estimacion, leido_en]
+_totales = {}
+_totales_lock = threading.Lock()
+
+
+@eventos.bus.escuchar
+def _ajustar_total(evento):
+    """Mantiene el total en memoria con las altas y bajas de este proceso."""
+    if evento.accion == "reset":
+        with _totales_lock:
+            _totales.pop(evento.entidad, None)
+        return
+    delta = {"create": 1, "delete": -1}.get(evento.accion)
+    if delta is None:
+        return
+    with _totales_lock:
+        if evento.entidad in _totales:
+            _totales[evento.entidad][0] = max(_totales[evento.entidad][0] + delta, 0)
+
+
+def _filas_estimadas(db: Session, tabla) -> Optional[int]:
+    """
+    Filas de la tabla según las estadísticas del planificador, sin recorrerla:
+    pg_class.reltuples en Postgres y sqlite_stat1 (tras ANALYZE) en SQLite.
+    None si no hay estadísticas.
+    """
+    dialecto = db.get_bind().dialect.name
+    if dialecto == "postgresql":
+        filas = db.scalar(text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:t)"),
+                          {"t": tabla.name})
+    elif dialecto == "sqlite":
+        existe = db.scalar(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"))
+        stat = db.scalar(text("SELECT stat FROM sqlite_stat1 WHERE tbl = :t LIMIT 1"),
+                         {"t": tabla.name}) if existe else None
+        filas = int(stat.split()[0]) if stat else None
+    else:
+        return None
+    # reltuples = -1 si la tabla nunca se analizó (Postgres 14+)
+    return filas if filas is not None and filas >= 0 else None
+
+
+def _filas_plan(db: Session, stmt) -> Optional[int]:
+    """Filas que el planificador de Postgres espera para la consulta (EXPLAIN)."""
+    if db.get_bind().dialect.name != "postgresql":
+        return None
+    compilado = stmt.compile(dialect=db.get_bind().dialect, compile_kwargs={"render_postcompile": True})
+    plan = db.connection().exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compilado}", compilado.params).scalar()
+    plan = json.loads(plan) if isinstance(plan, str) else plan
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def contar(db: Session, entidad: str, *condiciones) -> Tuple[int, bool]:
+    """
+    Total de filas de la entidad (con filtros opcionales) para la paginación.
+    Devuelve (total, es_estimacion).
+
+    - Sin filtros: total mantenido en memoria. Se lee con COUNT(*) si la
+      tabla es pequeña o con las estadísticas del planificador si pasa de
+      CONTEO_UMBRAL, y se ajusta con los eventos de alta/baja.
+    - Con filtros: COUNT acotado a CONTEO_UMBRAL + 1 filas; si se alcanza el
+      límite se usa la estimación del plan (Postgres) o el propio límite.
+    """
+    modelo = modelo_de(entidad)
+    tabla = modelo.__table__
+
+    if condiciones:
+        acotado = select(tabla.c.id).where(*condiciones).limit(CONTEO_UMBRAL + 1).subquery()
+        total = db.scalar(select(func.count()).select_from(acotado))
+        if total <= CONTEO_UMBRAL:
+            return total, False
+        estimado = _filas_plan(db, select(tabla.c.id).where(*condiciones))
+        return max(estimado or 0, total), True
+
+    with _totales_lock:
+        cacheado = _totales.get(entidad)
+    vigente = cacheado is not None and time.monotonic() - cacheado[2] < CONTEO_TTL_SEGUNDOS
+    metricas.registrar_cache("totales", vigente)
+    if vigente:
+        return cacheado[0], cacheado[1]
+
+    estimado = _filas_estimadas(db, tabla)
+    if estimado is not None and estimado > CONTEO_UMBRAL:
+        total, es_estimacion = estimado, True
+    else:
+        total, es_estimacion = db.scalar(select(func.count()).select_from(tabla)), False
+    with _totales_lock:
+        _totales[entidad] = [total, es_estimacion, time.monotonic()]
+    return total, es_estimacion
+
+
+def invalidar_totales():
+    """Fuerza a releer los totales de la base en la próxima petición."""
+    with _totales_lock:
+        _totales.clear()
+
+
 # --------------------- OPERACIONES DE ESTADÍSTICAS (CORREGIDAS) ---------------------
 
 def get_autos_count(db: Session) -> int:
@@ -1,12 +1,23 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker, declarative_base, Session
+from sqlalchemy.pool import QueuePool
 from dotenv import load_dotenv
+import math
 import os
 import sys
+import time
+import threading
 import logging
+from contextvars import ContextVar
+from http.cookies import SimpleCookie
+from typing import Optional
+
+from logging_config import configurar_logging
+from monitoreo_sql import instrumentar_engine
+import metricas
 
 # Configuración de Logging para ver si esto es el punto de falla
-logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+configurar_logging()
 logger = logging.getLogger("DB_FATAL_FIX")
 
 load_dotenv()
@@ -19,50 +30,298 @@ if not SQLALCHEMY_DATABASE_URL:
     # Usar SQLite como fallback si falla, pero el despliegue de Render fallará
     SQLALCHEMY_DATABASE_URL = "sqlite:///./default.db"
 
-# Render a veces usa 'postgres://' en lugar de 'postgresql://'
+def _normalizar_url(url: str) -> str:
+    """Render a veces usa 'postgres://' en lugar de 'postgresql://'."""
+    if url.startswith("postgres://"):
+        return url.replace("postgres://", "postgresql+psycopg://", 1)
+    return url
+
+
 if SQLALCHEMY_DATABASE_URL.startswith("postgres://"):
-    SQLALCHEMY_DATABASE_URL = SQLALCHEMY_DATABASE_URL.replace("postgres://", "postgresql+psycopg://", 1)
+    SQLALCHEMY_DATABASE_URL = _normalizar_url(SQLALCHEMY_DATABASE_URL)
     logger.info("URL corregida a postgresql://")
 
 # --- 2. CONFIGURACIÓN DEL ENGINE (EL PUNTO DE CRASH MÁS COMÚN) ---
 
-connect_args = {}
-pool_settings = {}
 Base = declarative_base() # Definir Base aquí para que sea consistente
 
+
+def _opciones_engine(url: str):
+    """Devuelve (connect_args, pool_settings) según el tipo de base de datos."""
+    connect_args = {}
+    pool_settings = {}
+    if url.startswith("postgresql"):
+        # CONFIGURACIÓN OBLIGATORIA PARA RENDER (SSL, Memoria, Robustez)
+        pool_settings = {
+            "pool_recycle": 300,        # Reciclar la conexión cada 5 minutos
+            "pool_pre_ping": True,      # Probar antes de usar
+            "pool_size": 5              # Pool pequeño para ahorrar memoria
+        }
+        # 🔑 CLAVE: Forzar el SSL, la ausencia de este argumento MATA la conexión.
+        # Se respeta un sslmode explícito en la URL (p. ej. Postgres local para benchmarks).
+        if "sslmode=" not in url:
+            connect_args = {"sslmode": "require"}
+    elif url.startswith("sqlite"):
+        # Conexión local con SQLite
+        connect_args = {"check_same_thread": False}
+    return connect_args, pool_settings
+
+
+class QueuePoolMedido(QueuePool):
+    """QueuePool que mide cuánto espera cada checkout por una conexión libre."""
+
+    def _do_get(self):
+        inicio = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            metricas.observar_espera_pool(time.perf_counter() - inicio)
+
+
+def _usa_queue_pool(url: str) -> bool:
+    # SQLite en memoria usa SingletonThreadPool/StaticPool; el resto usa QueuePool
+    return not (url.startswith("sqlite") and (":memory:" in url or url.rstrip("/") == "sqlite:"))
+
+
+def crear_engine(url: str):
+    """Crea un engine de SQLAlchemy instrumentado con la configuración adecuada para la URL."""
+    connect_args, pool_settings = _opciones_engine(url)
+    if _usa_queue_pool(url):
+        pool_settings["poolclass"] = QueuePoolMedido
+    nuevo_engine = create_engine(url, connect_args=connect_args, **pool_settings)
+    instrumentar_engine(nuevo_engine)
+    return nuevo_engine
+
+
 if SQLALCHEMY_DATABASE_URL.startswith("postgresql"):
-    # CONFIGURACIÓN OBLIGATORIA PARA RENDER (SSL, Memoria, Robustez)
-    pool_settings = {
-        "pool_recycle": 300,        # Reciclar la conexión cada 5 minutos
-        "pool_pre_ping": True,      # Probar antes de usar
-        "pool_size": 5              # Pool pequeño para ahorrar memoria
-    }
-    connect_args = {
-        # 🔑 CLAVE: Forzar el SSL, la ausencia de este argumento MATA la conexión
-        "sslmode": "require",
-    }
     logger.info("✅ PostgreSQL detectado. Aplicando SSL y pool settings.")
 elif SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
-    # Conexión local con SQLite
-    connect_args = {"check_same_thread": False}
     logger.info("⚠️ SQLite detectado. Modo desarrollo local.")
 
 
 # --- 3. CREACIÓN DEL MOTOR ---
 try:
-    engine = create_engine(
-        SQLALCHEMY_DATABASE_URL,
-        connect_args=connect_args,
-        **pool_settings
-    )
+    engine = crear_engine(SQLALCHEMY_DATABASE_URL)
     logger.info("✅ Engine de SQLAlchemy creado exitosamente.")
 except Exception as e:
-    logger.critical(f"❌ FATAL CRASH: Fallo al crear el Engine de DB: {e}", exc_info=True)
+    logger.critical("❌ FATAL CRASH: Fallo al crear el Engine de DB: %s", e, exc_info=True)
     # Re-lanzar o terminar para que Render lo registre
     sys.exit(1)
 
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# --- 4. RÉPLICAS DE LECTURA (OPCIONAL) ---
+# DATABASE_READ_URL admite una o varias URLs separadas por comas. Si no está
+# definida, todas las consultas van al primario como siempre.
+
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("DATABASE_REPLICA_MAX_LAG", "5"))
+REPLICA_LAG_CHECK_SECONDS = float(os.getenv("DATABASE_REPLICA_LAG_CHECK", "5"))
+READ_YOUR_WRITES_SECONDS = float(os.getenv("DATABASE_READ_YOUR_WRITES", "2"))
+
+
+COOKIE_ULTIMA_ESCRITURA = "ultima_escritura"
+
+
+class ClienteLecturas:
+    """Momento (time.time()) de la última escritura del cliente de la petición en curso."""
+
+    def __init__(self, ultima_escritura: float = 0.0):
+        self.ultima_escritura = ultima_escritura
+
+
+_cliente_actual: ContextVar[Optional[ClienteLecturas]] = ContextVar("cliente_lecturas", default=None)
+
+
+def iniciar_cliente(ultima_escritura: float = 0.0):
+    """Abre el contexto del cliente de la petición actual. Devuelve el token del contexto."""
+    return _cliente_actual.set(ClienteLecturas(ultima_escritura))
+
+
+def finalizar_cliente(token):
+    _cliente_actual.reset(token)
+
+
+def cliente_actual() -> Optional[ClienteLecturas]:
+    return _cliente_actual.get()
+
+
+class EnrutadorReplicas:
+    """
+    Elige el engine de cada consulta: escrituras al primario y lecturas a la
+    primera réplica sana (round-robin) cuyo retraso no supere el máximo.
+    Tras una escritura, las lecturas de ese mismo cliente (el de la petición
+    en curso, ver LecturasPropiasMiddleware) vuelven al primario durante una
+    ventana corta para que vea sus propios cambios; el resto sigue en réplicas.
+    """
+
+    def __init__(self, primario, replicas, max_lag=REPLICA_MAX_LAG_SECONDS,
+                 intervalo_lag=REPLICA_LAG_CHECK_SECONDS, ventana_escritura=READ_YOUR_WRITES_SECONDS):
+        self.primario = primario
+        self.replicas = list(replicas)
+        self.max_lag = max_lag
+        self.intervalo_lag = intervalo_lag
+        self.ventana_escritura = ventana_escritura
+        self._lags = {}  # índice de réplica -> (lag_en_segundos, momento_de_medición)
+        self._siguiente = 0
+        self._lock = threading.Lock()
+
+    def registrar_escritura(self):
+        cliente = cliente_actual()
+        if cliente is not None:
+            cliente.ultima_escritura = time.time()
+
+    def _escritura_reciente(self) -> bool:
+        cliente = cliente_actual()
+        return cliente is not None and time.time() - cliente.ultima_escritura < self.ventana_escritura
+
+    def medir_lag(self, replica) -> float:
+        """Retraso de replicación en segundos (0 si el motor no replica)."""
+        with replica.connect() as conn:
+            if replica.dialect.name == "postgresql":
+                # Si ya aplicó todo lo recibido no hay retraso, aunque la última
+                # transacción sea antigua (primario sin escrituras)
+                lag = conn.execute(text(
+                    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                    "ELSE EXTRACT(EPOCH FROM (now() - pg_last_xact_replay_timestamp())) END"
+                )).scalar()
+                return float(lag) if lag is not None else 0.0
+            conn.execute(text("SELECT 1"))
+            return 0.0
+
+    def _lag(self, indice: int) -> float:
+        ahora = time.monotonic()
+        lag, medido = self._lags.get(indice, (None, 0.0))
+        if lag is None or ahora - medido > self.intervalo_lag:
+            try:
+                lag = self.medir_lag(self.replicas[indice])
+            except Exception as e:
+                logger.warning("⚠️ Réplica %s no disponible: %s", indice, e)
+                lag = float("inf")
+            self._lags[indice] = (lag, ahora)
+        return lag
+
+    def engine_lectura(self):
+        """Devuelve una réplica válida o el primario como respaldo."""
+        if not self.replicas:
+            return self.primario
+        if self._escritura_reciente():
+            return self.primario
+
+        with self._lock:
+            inicio = self._siguiente
+            self._siguiente = (self._siguiente + 1) % len(self.replicas)
+
+        for paso in range(len(self.replicas)):
+            indice = (inicio + paso) % len(self.replicas)
+            if self._lag(indice) <= self.max_lag:
+                return self.replicas[indice]
+
+        logger.warning("⚠️ Ninguna réplica dentro del retraso permitido. Leyendo del primario.")
+        return self.primario
+
+
+class LecturasPropiasMiddleware:
+    """
+    Middleware ASGI que lleva la última escritura de cada cliente en una
+    cookie: la lee al empezar la petición (contexto de ClienteLecturas) y la
+    renueva en la respuesta si la petición escribió. Así la ventana de
+    read-your-writes es de cada cliente y funciona entre workers.
+    """
+
+    def __init__(self, app, ventana=READ_YOUR_WRITES_SECONDS):
+        self.app = app
+        self.ventana = ventana
+
+    @staticmethod
+    def _leer_cookie(scope) -> float:
+        for nombre, valor in scope.get("headers", []):
+            if nombre == b"cookie":
+                galleta = SimpleCookie()
+                galleta.load(valor.decode("latin-1"))
+                if COOKIE_ULTIMA_ESCRITURA in galleta:
+                    try:
+                        return float(galleta[COOKIE_ULTIMA_ESCRITURA].value)
+                    except ValueError:
+                        return 0.0
+        return 0.0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        previa = self._leer_cookie(scope)
+        token = iniciar_cliente(previa)
+        cliente = cliente_actual()
+
+        async def send_con_cookie(message):
+            if message["type"] == "http.response.start" and cliente.ultima_escritura > previa:
+                cookie = (f"{COOKIE_ULTIMA_ESCRITURA}={cliente.ultima_escritura:.3f}; "
+                          f"Max-Age={max(math.ceil(self.ventana), 1)}; Path=/; HttpOnly; SameSite=Lax")
+                message = {**message, "headers": [*message.get("headers", []), (b"set-cookie", cookie.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_con_cookie)
+        finally:
+            finalizar_cliente(token)
+
+
+class RoutingSession(Session):
+    """Sesión que envía los SELECT a réplicas y todo lo demás al primario."""
+
+    def __init__(self, *args, enrutador=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.enrutador = enrutador
+        self.escribio = False
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self.enrutador is None:
+            return super().get_bind(mapper=mapper, clause=clause, **kw)
+
+        es_lectura = (
+            clause is not None
+            and getattr(clause, "is_select", False)
+            and getattr(clause, "_for_update_arg", None) is None
+        )
+        if es_lectura and not self._flushing and not self.escribio:
+            return self.enrutador.engine_lectura()
+
+        # Lo que no sea una lectura pura se considera escritura (read-your-writes)
+        if self._flushing or (clause is not None and not es_lectura):
+            self.escribio = True
+            self.enrutador.registrar_escritura()
+        return self.enrutador.primario
+
+
+def crear_sessionmaker(primario, replicas=()):
+    """Crea la fábrica de sesiones, con enrutado a réplicas si las hay."""
+    if not replicas:
+        return sessionmaker(autocommit=False, autoflush=False, bind=primario)
+    enrutador = EnrutadorReplicas(primario, replicas)
+    return sessionmaker(
+        autocommit=False, autoflush=False, bind=primario,
+        class_=RoutingSession, enrutador=enrutador
+    )
+
+
+SQLALCHEMY_READ_URLS = [
+    _normalizar_url(url.strip())
+    for url in os.getenv("DATABASE_READ_URL", "").split(",")
+    if url.strip()
+]
+
+read_engines = []
+for read_url in SQLALCHEMY_READ_URLS:
+    try:
+        read_engines.append(crear_engine(read_url))
+    except Exception as e:
+        logger.error("❌ No se pudo crear el engine de la réplica: %s", e, exc_info=True)
+
+if read_engines:
+    logger.info("✅ %s réplica(s) de lectura configuradas.", len(read_engines))
+
+
+SessionLocal = crear_sessionmaker(engine, read_engines)
 
 def get_db():
     db = SessionLocal()
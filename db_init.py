@@ -3,7 +3,8 @@
 import os
 import sys
 import logging
-from sqlalchemy import inspect
+from datetime import datetime
+from sqlalchemy import inspect, select, update, insert, func, text, bindparam
 from sqlalchemy.orm import Session
 from database import engine, Base, SessionLocal
 
@@ -12,9 +13,12 @@ from models_sql import (
     AutoElectricoSQL, AutoEliminadoSQL,
     CargaSQL, CargaEliminadaSQL,
     EstacionSQL, EstacionEliminadaSQL,
-    UsuarioSQL  # IMPORTANTE: Incluir el modelo de Usuario
+    UsuarioSQL,  # IMPORTANTE: Incluir el modelo de Usuario
+    VersionCatalogoSQL, IntervaloHorarioSQL
 )
 from modelos import AutoElectrico, CargaBase, EstacionBase
+import horarios
+import invalidacion
 
 logging.basicConfig(
     level=logging.INFO,
@@ -59,6 +63,143 @@ def crear_tablas():
         return False
 
 
+# ------------------ MIGRACIÓN DE ESQUEMA (FEED DE CAMBIOS) ------------------
+
+TABLAS_VERSIONADAS = [
+    ("autos", AutoElectricoSQL, AutoEliminadoSQL),
+    ("cargas", CargaSQL, CargaEliminadaSQL),
+    ("estaciones", EstacionSQL, EstacionEliminadaSQL),
+]
+
+
+def _referencias(columna, dialecto: str) -> str:
+    """
+    Cláusula REFERENCES de una columna añadida con ALTER TABLE, para que las
+    bases migradas tengan la misma clave foránea que las nuevas. Postgres y
+    SQLite la aceptan en ADD COLUMN (SQLite solo si la columna admite NULL).
+    """
+    if dialecto not in ("postgresql", "sqlite"):
+        return ""
+    clausulas = []
+    for fk in columna.foreign_keys:
+        clausula = f" REFERENCES {fk.column.table.name}({fk.column.name})"
+        if fk.ondelete:
+            clausula += f" ON DELETE {fk.ondelete}"
+        clausulas.append(clausula)
+    return "".join(clausulas)
+
+
+def migrar_esquema(engine_destino=None):
+    """
+    create_all no modifica tablas existentes: añade las columnas e índices que
+    falten (created_at, updated_at, version, id_original...) en bases ya desplegadas.
+    En Postgres (re)crea los triggers de aviso de cambios (invalidacion.py).
+    """
+    engine_destino = engine_destino or engine
+    inspector = inspect(engine_destino)
+    with engine_destino.begin() as conn:
+        for tabla in Base.metadata.sorted_tables:
+            if not inspector.has_table(tabla.name):
+                continue
+            existentes = {c["name"] for c in inspector.get_columns(tabla.name)}
+            for columna in tabla.columns:
+                if columna.name not in existentes:
+                    tipo = columna.type.compile(dialect=engine_destino.dialect)
+                    referencias = _referencias(columna, engine_destino.dialect.name)
+                    conn.execute(text(f"ALTER TABLE {tabla.name} ADD COLUMN {columna.name} {tipo}{referencias}"))
+                    logger.info("➕ Columna %s.%s añadida", tabla.name, columna.name)
+            indices = {i["name"] for i in inspector.get_indexes(tabla.name)}
+            for indice in tabla.indexes:
+                if indice.name not in indices:
+                    indice.create(bind=conn)
+                    logger.info("➕ Índice %s creado", indice.name)
+        if engine_destino.dialect.name == "postgresql":
+            invalidacion.instalar_triggers(conn)
+
+
+def rellenar_versiones(engine_destino=None):
+    """
+    Asigna versión (y fechas) a las filas que no la tienen, p. ej. datos previos
+    a la migración o cargas masivas por CSV, y deja el contador por encima.
+    """
+    engine_destino = engine_destino or engine
+    ahora = datetime.utcnow()
+    contador = VersionCatalogoSQL.__table__
+    with engine_destino.begin() as conn:
+        for entidad, Modelo, Historial in TABLAS_VERSIONADAS:
+            vivas, lapidas = Modelo.__table__, Historial.__table__
+
+            def maxima_version():
+                return max(
+                    conn.scalar(select(func.coalesce(func.max(vivas.c.version), 0))),
+                    conn.scalar(select(func.coalesce(func.max(lapidas.c.version), 0))),
+                )
+
+            conn.execute(update(vivas).where(vivas.c.version.is_(None)).values(version=maxima_version() + vivas.c.id))
+            conn.execute(update(vivas).where(vivas.c.created_at.is_(None)).values(created_at=ahora, updated_at=ahora))
+            conn.execute(update(lapidas).where(lapidas.c.version.is_(None)).values(version=maxima_version() + lapidas.c.id))
+
+            tope = maxima_version()
+            resultado = conn.execute(update(contador).where(contador.c.entidad == entidad).values(valor=tope))
+            if not resultado.rowcount:
+                conn.execute(insert(contador).values(entidad=entidad, valor=tope))
+
+
+def rellenar_horarios(engine_destino=None, lote: int = 5000):
+    """
+    Interpreta el horario de las estaciones que aún no tienen intervalos en
+    horarios_estaciones (datos previos, datos de prueba o cargas masivas).
+    Los horarios que no se entienden se avisan y quedan fuera de open_at.
+    """
+    engine_destino = engine_destino or engine
+    estaciones, intervalos = EstacionSQL.__table__, IntervaloHorarioSQL.__table__
+    sin_intervalos = (
+        select(estaciones.c.id, estaciones.c.horario_apertura)
+        .where(~select(intervalos.c.id).where(intervalos.c.estacion_id == estaciones.c.id).exists())
+        .order_by(estaciones.c.id)
+        .limit(lote)
+    )
+    ultimo, no_validos = 0, set()
+    with engine_destino.begin() as conn:
+        while True:
+            filas = conn.execute(sin_intervalos.where(estaciones.c.id > ultimo)).all()
+            if not filas:
+                break
+            nuevas = []
+            for estacion_id, horario in filas:
+                tramos = horarios.intervalos(horario)
+                if not tramos:
+                    no_validos.add(horario)
+                nuevas += [{"estacion_id": estacion_id, "inicio": inicio, "fin": fin} for inicio, fin in tramos]
+            if nuevas:
+                conn.execute(insert(intervalos), nuevas)
+            ultimo = filas[-1][0]
+    if no_validos:
+        logger.warning("⚠️ Horarios no interpretables, sin filtro open_at: %s", ", ".join(sorted(no_validos)))
+
+
+def enlazar_cargas(engine_destino=None, lote: int = 5000):
+    """
+    Rellena cargas.auto_id en las cargas sin enlazar, emparejando modelo_auto
+    con la marca y el modelo de los autos (crud.emparejar_cargas) en lote.
+    """
+    from crud import emparejar_cargas
+
+    engine_destino = engine_destino or engine
+    autos, cargas = AutoElectricoSQL.__table__, CargaSQL.__table__
+    with engine_destino.begin() as conn:
+        filas_autos = conn.execute(select(autos.c.id, autos.c.marca, autos.c.modelo, autos.c.anio)).mappings().all()
+        sin_enlace = conn.execute(
+            select(cargas.c.id, cargas.c.modelo_auto).where(cargas.c.auto_id.is_(None))
+        ).mappings().all()
+        enlaces = emparejar_cargas(filas_autos, sin_enlace)
+        stmt = update(cargas).where(cargas.c.id == bindparam("b_id")).values(auto_id=bindparam("b_auto_id"))
+        pares = [{"b_id": carga_id, "b_auto_id": auto_id} for carga_id, auto_id in enlaces.items()]
+        for inicio in range(0, len(pares), lote):
+            conn.execute(stmt, pares[inicio:inicio + lote])
+    logger.info("🔗 Cargas enlazadas con su auto: %d de %d sin enlace", len(enlaces), len(sin_enlace))
+
+
 def is_db_empty(db: Session) -> bool:
     """Verifica si alguna de las tablas principales está vacía."""
     inspector = inspect(engine)
@@ -237,6 +378,8 @@ if __name__ == "__main__":
         logger.error("❌ Error al crear tablas. Abortando.")
         sys.exit(1)
 
+    migrar_esquema()
+
     db = SessionLocal()
     try:
         insertar_datos_de_prueba(db)
@@ -251,6 +394,10 @@ if __name__ == "__main__":
     except Exception as e:
         logger.error(f"❌ Error al ejecutar migración CSV: {e}", exc_info=True)
 
+    rellenar_versiones()
+    rellenar_horarios()
+    enlazar_cargas()
+
     db_session = SessionLocal()
     try:
         listar_datos_para_verificacion(db_session)
@@ -0,0 +1,91 @@
+"""
+distribuciones.py - Histogramas y percentiles de las columnas numéricas
+
+Cada entidad tiene una instantánea por columnas (un array NumPy por campo
+numérico) que se lee con una sola consulta y se descarta cuando crud publica
+una escritura de esa entidad (eventos.py); la siguiente petición la vuelve a
+leer, y si la escritura llega durante la lectura lo leído no se guarda
+(eventos.CacheEventos). Así las estadísticas no recorren filas en cada
+petición y los cálculos (histograma, percentiles) son vectoriales. Cada
+DISTRIBUCIONES_TTL_SEGUNDOS se relee por si algún cambio no llegó como
+evento. Con snapshot_catalogo activo las columnas salen de esa copia en
+lugar de la consulta.
+"""
+
+import os
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import eventos
+import models_sql
+import snapshot_catalogo
+
+DISTRIBUCIONES_TTL_SEGUNDOS = float(os.getenv("DISTRIBUCIONES_TTL_SEGUNDOS", "300"))
+
+CAMPOS_NUMERICOS = {
+    "autos": ("autonomia_km", "capacidad_bateria_kwh"),
+    "cargas": ("autonomia_km", "consumo_kwh_100km", "tiempo_carga_horas"),
+    "estaciones": ("potencia_kw", "coste_por_kwh"),
+}
+_MODELOS = {
+    "autos": models_sql.AutoElectricoSQL,
+    "cargas": models_sql.CargaSQL,
+    "estaciones": models_sql.EstacionSQL,
+}
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+def _leer(entidad: str, db: Session) -> Dict[str, np.ndarray]:
+    campos = CAMPOS_NUMERICOS[entidad]
+    copia = snapshot_catalogo.tabla(db, entidad)
+    if copia is not None:
+        return {campo: copia.numericos(campo) for campo in campos}
+    tabla = _MODELOS[entidad].__table__
+    filas = db.execute(select(*(tabla.c[c] for c in campos))).all()
+    matriz = np.array(filas, dtype=np.float64).reshape(len(filas), len(campos))
+    columnas = {}
+    for i, campo in enumerate(campos):
+        valores = matriz[:, i]
+        columnas[campo] = valores[~np.isnan(valores)]
+    return columnas
+
+
+# entidad -> {campo: np.ndarray}; sin función de aplicar, cualquier escritura la descarta
+_instantaneas = eventos.CacheEventos("distribuciones", _leer, ttl=DISTRIBUCIONES_TTL_SEGUNDOS)
+
+
+def invalidar(entidad: Optional[str] = None):
+    _instantaneas.invalidar(entidad)
+
+
+def instantanea(db: Session, entidad: str) -> Dict[str, np.ndarray]:
+    """Columnas numéricas de la entidad como arrays float64 (sin NULL)."""
+    return _instantaneas.obtener(entidad, db)
+
+
+def distribucion(valores: np.ndarray, bins: int = 20, percentiles: Iterable[float] = PERCENTILES) -> dict:
+    """Resumen, percentiles (interpolación lineal, como percentile_cont) e histograma."""
+    percentiles = list(percentiles)
+    if valores.size == 0:
+        return {"n": 0, "min": None, "max": None, "media": None, "desviacion": None,
+                "percentiles": {f"p{p:g}": None for p in percentiles},
+                "histograma": {"bordes": [], "conteos": []}}
+    conteos, bordes = np.histogram(valores, bins=bins)
+    return {
+        "n": int(valores.size),
+        "min": float(valores.min()),
+        "max": float(valores.max()),
+        "media": round(float(valores.mean()), 4),
+        "desviacion": round(float(valores.std()), 4),
+        "percentiles": {f"p{p:g}": round(float(v), 4) for p, v in zip(percentiles, np.percentile(valores, percentiles))},
+        "histograma": {"bordes": np.round(bordes, 4).tolist(), "conteos": conteos.tolist()},
+    }
+
+
+def get_distribucion(db: Session, entidad: str, campo: str, bins: int = 20,
+                     percentiles: Iterable[float] = PERCENTILES) -> dict:
+    return {"entidad": entidad, "campo": campo,
+            **distribucion(instantanea(db, entidad)[campo], bins, percentiles)}
@@ -0,0 +1,297 @@
+"""
+eventos.py - Bus de eventos en proceso para los cambios del catálogo
+
+crud.py publica un evento (create/update/delete) después de cada escritura
+confirmada. Lo consumen:
+
+- Suscriptores asyncio (el endpoint SSE /api/eventos). Cada uno tiene su
+  propio buffer que combina eventos de la misma fila (create+update = create,
+  create+delete = nada, el último update gana). Si un cliente lento acumula
+  más de EVENTOS_MAX_PENDIENTES filas distintas se descarta su buffer y recibe
+  un único evento 'reset' (recargar todo), así un cliente lento nunca frena
+  a los demás ni hace crecer la memoria.
+- Oyentes síncronos (cachés e índices en memoria) registrados con escuchar();
+  CacheEventos reúne el ciclo de vida común de esas copias.
+
+Los eventos son por proceso: con varios workers cada uno ve solo sus
+escrituras. Las de otros procesos llegan como un evento 'reset' de la entidad
+(sin id ni datos) publicado por invalidacion.py: las cachés la descartan.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+import metricas
+
+logger = logging.getLogger("eventos")
+
+EVENTOS_MAX_PENDIENTES = int(os.getenv("EVENTOS_MAX_PENDIENTES", "500"))
+# Eventos recientes que se conservan para reanudar con Last-Event-ID
+EVENTOS_HISTORIAL = int(os.getenv("EVENTOS_HISTORIAL", "1000"))
+
+ENTIDADES = ("autos", "cargas", "estaciones")
+
+
+class Evento:
+    __slots__ = ("secuencia", "entidad", "accion", "id", "datos")
+
+    def __init__(self, secuencia: int, entidad: Optional[str], accion: str, id: Optional[int], datos=None):
+        self.secuencia = secuencia
+        self.entidad = entidad
+        self.accion = accion
+        self.id = id
+        self.datos = datos
+
+    def a_dict(self) -> dict:
+        return {"entidad": self.entidad, "accion": self.accion, "id": self.id, "datos": self.datos}
+
+    def sse(self) -> str:
+        datos = json.dumps(self.a_dict(), ensure_ascii=False, default=str)
+        return f"id: {self.secuencia}\nevent: {self.accion}\ndata: {datos}\n\n"
+
+
+def _combinar(previo: Evento, nuevo: Evento) -> Optional[Evento]:
+    """Une dos eventos pendientes de la misma fila en uno (o ninguno)."""
+    if previo.accion == "create":
+        if nuevo.accion == "delete":
+            return None
+        return Evento(nuevo.secuencia, nuevo.entidad, "create", nuevo.id, nuevo.datos)
+    return nuevo
+
+
+class Suscriptor:
+
+    def __init__(self, entidades: Iterable[str], loop, max_pendientes: int):
+        self.entidades = set(entidades)
+        self.loop = loop
+        self.max_pendientes = max_pendientes
+        self.desbordado = False
+        self._pendientes = OrderedDict()
+        self._senal = asyncio.Event()
+
+    def interesa(self, evento: Evento) -> bool:
+        return not self.entidades or evento.entidad in self.entidades
+
+    def _recibir(self, evento: Evento):
+        """Se ejecuta siempre en el loop del suscriptor."""
+        if self.desbordado:
+            return
+        clave = (evento.entidad, evento.id)
+        previo = self._pendientes.pop(clave, None)
+        if previo is not None:
+            evento = _combinar(previo, evento)
+        if evento is not None:
+            self._pendientes[clave] = evento
+        if len(self._pendientes) > self.max_pendientes:
+            self._desbordar()
+        self._senal.set()
+
+    def _desbordar(self):
+        self._pendientes.clear()
+        self.desbordado = True
+        self._senal.set()
+
+    async def siguientes(self, espera: float) -> List[Evento]:
+        """Eventos acumulados; lista vacía si no llegó nada en `espera` segundos."""
+        try:
+            await asyncio.wait_for(self._senal.wait(), espera)
+        except asyncio.TimeoutError:
+            return []
+        self._senal.clear()
+        if self.desbordado:
+            self.desbordado = False
+            return [Evento(0, None, "reset", None)]
+        eventos = list(self._pendientes.values())
+        self._pendientes.clear()
+        return eventos
+
+
+class BusEventos:
+
+    def __init__(self, max_pendientes: int = EVENTOS_MAX_PENDIENTES, historial: int = EVENTOS_HISTORIAL):
+        self.max_pendientes = max_pendientes
+        self._suscriptores = set()
+        self._oyentes = []
+        self._historial = deque(maxlen=historial)
+        self._secuencia = itertools.count(1)
+        self._ultima = 0
+        self._lock = threading.Lock()
+
+    def escuchar(self, funcion: Callable[[Evento], None]):
+        """Registra un oyente síncrono; se llama en el hilo que publica."""
+        self._oyentes.append(funcion)
+        return funcion
+
+    def dejar_de_escuchar(self, funcion: Callable[[Evento], None]):
+        if funcion in self._oyentes:
+            self._oyentes.remove(funcion)
+
+    def publicar(self, entidad: str, accion: str, id: int, datos=None) -> Evento:
+        with self._lock:
+            evento = Evento(next(self._secuencia), entidad, accion, id, datos)
+            self._ultima = evento.secuencia
+            self._historial.append(evento)
+            suscriptores = list(self._suscriptores)
+
+        for oyente in self._oyentes:
+            try:
+                oyente(evento)
+            except Exception as e:
+                logger.error("Error en oyente de eventos %s: %s", oyente, e, exc_info=True)
+
+        for suscriptor in suscriptores:
+            if suscriptor.interesa(evento):
+                try:
+                    suscriptor.loop.call_soon_threadsafe(suscriptor._recibir, evento)
+                except RuntimeError:
+                    # El loop del suscriptor ya se cerró
+                    self.cancelar(suscriptor)
+        return evento
+
+    def suscribir(self, entidades: Iterable[str] = (), desde: Optional[int] = None) -> Suscriptor:
+        """
+        Crea un suscriptor en el loop actual. Con `desde` (Last-Event-ID) se
+        reenvían los eventos posteriores si siguen en el historial; si no, 'reset'.
+        """
+        suscriptor = Suscriptor(entidades, asyncio.get_running_loop(), self.max_pendientes)
+        with self._lock:
+            self._suscriptores.add(suscriptor)
+            historial = list(self._historial)
+            ultima = self._ultima
+
+        if desde is not None and desde != ultima:
+            primera = historial[0].secuencia if historial else ultima + 1
+            if desde > ultima or desde < primera - 1:
+                # Otro proceso o fuera del historial: el cliente debe recargar
+                suscriptor._desbordar()
+            else:
+                for evento in historial:
+                    if evento.secuencia > desde and suscriptor.interesa(evento):
+                        suscriptor._recibir(evento)
+        return suscriptor
+
+    def cancelar(self, suscriptor: Suscriptor):
+        with self._lock:
+            self._suscriptores.discard(suscriptor)
+
+    @property
+    def suscriptores(self) -> int:
+        return len(self._suscriptores)
+
+
+# Bus de la aplicación
+bus = BusEventos()
+
+
+def publicar(entidad: str, accion: str, id: int, datos=None) -> Evento:
+    return bus.publicar(entidad, accion, id, datos)
+
+
+# --------------------- Cachés mantenidas con eventos ---------------------
+
+class CacheEventos:
+    """
+    Copias en memoria derivadas de la base (índices, matrices, columnas...)
+    que se mantienen al día con los eventos del bus.
+
+    - `construir(clave, *args)` crea la copia de una clave bajo demanda, una
+      sola vez a la vez por clave; pasados `ttl` segundos se vuelve a crear
+      para recoger lo que no llegó como evento.
+    - Los eventos de las entidades de la clave (`entidades(clave)`) se
+      aplican con `aplicar(copia, evento)`. Sin `aplicar`, cualquier evento
+      descarta la copia. Un 'reset' (escrituras de otro proceso) la descarta
+      siempre.
+    - Los eventos que llegan mientras se construye se guardan y se aplican
+      al terminar. Si alguno la descarta, la copia se usa en esa consulta
+      pero no se guarda.
+    - Cada consulta cuenta como acierto o fallo en /metrics con `nombre`.
+    """
+
+    def __init__(self, nombre: str, construir: Callable[..., Any], aplicar: Optional[Callable[[Any, Evento], None]] = None,
+                 ttl: float = 300.0, entidades: Callable[[Hashable], Iterable[str]] = lambda clave: (clave,)):
+        self.nombre = nombre
+        self.construir = construir
+        self.aplicar = aplicar
+        self.ttl = ttl
+        self.entidades = entidades
+        # clave -> (copia, construida_en)
+        self._copias: Dict[Hashable, Tuple[Any, float]] = {}
+        # clave -> eventos recibidos mientras se construye
+        self._pendientes: Dict[Hashable, list] = {}
+        self._construccion: Dict[Hashable, threading.Lock] = {}
+        self._lock = threading.Lock()
+        bus.escuchar(self._al_cambiar)
+
+    def _descarta(self, evento: Evento) -> bool:
+        return self.aplicar is None or evento.accion == "reset"
+
+    def _al_cambiar(self, evento: Evento):
+        with self._lock:
+            for clave, recibidos in self._pendientes.items():
+                if evento.entidad in self.entidades(clave):
+                    recibidos.append(evento)
+            claves = [c for c in self._copias if evento.entidad in self.entidades(c)]
+            if self._descarta(evento):
+                for clave in claves:
+                    del self._copias[clave]
+                return
+            copias = [self._copias[c][0] for c in claves]
+        for copia in copias:
+            if copia is not None:
+                self.aplicar(copia, evento)
+
+    def _vigente(self, clave: Hashable) -> Optional[tuple]:
+        with self._lock:
+            actual = self._copias.get(clave)
+        if actual is not None and time.monotonic() - actual[1] < self.ttl:
+            return actual
+        return None
+
+    def obtener(self, clave: Hashable, *args):
+        """Copia de la clave; la construye con `construir(clave, *args)` si no existe o caducó."""
+        vigente = self._vigente(clave)
+        metricas.registrar_cache(self.nombre, vigente is not None)
+        if vigente is not None:
+            return vigente[0]
+        with self._lock:
+            candado = self._construccion.setdefault(clave, threading.Lock())
+        with candado:
+            vigente = self._vigente(clave)
+            if vigente is not None:
+                return vigente[0]
+            with self._lock:
+                self._pendientes[clave] = []
+            try:
+                nueva = self.construir(clave, *args)
+            except Exception:
+                with self._lock:
+                    self._pendientes.pop(clave, None)
+                raise
+            # Bajo el mismo lock que el oyente: ningún evento queda entre el búfer y la copia
+            with self._lock:
+                recibidos = self._pendientes.pop(clave)
+                for evento in recibidos:
+                    if nueva is not None and not self._descarta(evento):
+                        self.aplicar(nueva, evento)
+                if not any(self._descarta(evento) for evento in recibidos):
+                    self._copias[clave] = (nueva, time.monotonic())
+            return nueva
+
+    def actuales(self) -> Dict[Hashable, Any]:
+        """Copias guardadas ahora mismo, sin construir ninguna."""
+        with self._lock:
+            return {clave: copia for clave, (copia, _) in self._copias.items()}
+
+    def invalidar(self, entidad: Optional[str] = None):
+        """Descarta las copias (todas o las que dependen de una entidad)."""
+        with self._lock:
+            for clave in list(self._copias):
+                if entidad is None or entidad in self.entidades(clave):
+                    del self._copias[clave]
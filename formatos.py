@@ -0,0 +1,98 @@
+"""
+formatos.py - Negociación del formato de respuesta (JSON / MessagePack)
+
+Los listados, el feed de cambios y las estadísticas devuelven MessagePack si
+el cliente lo prefiere en la cabecera Accept (application/msgpack,
+application/x-msgpack o application/vnd.msgpack); si no, JSON.
+
+Con layout=columns las listas de filas se envían por columnas, un array por
+campo ({"id": [1, 2], "nombre": ["A", "B"]}), que evita repetir las claves
+en cada fila y reduce aún más el tamaño.
+
+msgpack es opcional (pip install msgpack): sin él se responde JSON, o 406 si
+el cliente no acepta JSON.
+"""
+
+import json
+from datetime import date, datetime
+from typing import List, Optional
+
+from fastapi import HTTPException, Request, Response
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - depende del entorno
+    msgpack = None
+
+MSGPACK = "application/msgpack"
+TIPOS_MSGPACK = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+_TIPOS_JSON = ("application/json", "application/*", "*/*")
+
+
+def _por_defecto(valor):
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    raise TypeError(f"Tipo no serializable: {type(valor).__name__}")
+
+
+def _calidades(accept: str) -> dict:
+    """Cabecera Accept -> {tipo: q}."""
+    calidades = {}
+    for parte in accept.split(","):
+        tipo, *parametros = (p.strip() for p in parte.split(";"))
+        if not tipo:
+            continue
+        q = 1.0
+        for parametro in parametros:
+            nombre, _, valor = parametro.partition("=")
+            if nombre.strip() == "q":
+                try:
+                    q = float(valor)
+                except ValueError:
+                    q = 0.0
+        calidades[tipo.lower()] = max(q, calidades.get(tipo.lower(), 0.0))
+    return calidades
+
+
+def pide_msgpack(request: Request) -> bool:
+    """True si el cliente prefiere MessagePack a JSON."""
+    accept = request.headers.get("accept")
+    if not accept or "msgpack" not in accept:
+        return False
+    calidades = _calidades(accept)
+    q_msgpack = max(calidades.get(t, 0.0) for t in TIPOS_MSGPACK)
+    q_json = max(calidades.get(t, 0.0) for t in _TIPOS_JSON)
+    if q_msgpack <= q_json:
+        return False
+    if msgpack is None:
+        if q_json > 0:
+            return False
+        raise HTTPException(status_code=406, detail="MessagePack no disponible en el servidor; use JSON")
+    return True
+
+
+def a_columnas(filas: List[dict]) -> dict:
+    """[{a: 1, b: 2}, {a: 3, b: 4}] -> {a: [1, 3], b: [2, 4]}"""
+    if not filas:
+        return {}
+    return {campo: [fila[campo] for fila in filas] for campo in filas[0]}
+
+
+def codificar_json(datos) -> bytes:
+    # Mismas opciones que JSONResponse, más fechas en ISO 8601
+    return json.dumps(datos, ensure_ascii=False, allow_nan=False, separators=(",", ":"),
+                      default=_por_defecto).encode("utf-8")
+
+
+def codificar_msgpack(datos) -> bytes:
+    return msgpack.packb(datos, default=_por_defecto, use_bin_type=True)
+
+
+def responder(request: Request, datos, columnas: bool = False, headers: Optional[dict] = None) -> Response:
+    """Serializa `datos` (diccionarios/listas) en el formato negociado."""
+    if columnas:
+        datos = a_columnas(datos)
+    headers = {**(headers or {}), "Vary": "Accept"}
+    if pide_msgpack(request):
+        return Response(codificar_msgpack(datos), media_type=MSGPACK, headers=headers)
+    return Response(codificar_json(datos), media_type="application/json", headers=headers)
@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+"""
+Generador de datos sintéticos del catálogo a escala (miles a millones de filas).
+
+Produce autos, cargas, estaciones y filas de historial (eliminados) realistas
+y válidos según modelos.AutoElectrico, CargaBase y EstacionBase, con
+distribuciones sesgadas de marcas, conectores y operadores. Todo se genera en
+streaming por lotes con una semilla fija, así que el mismo comando produce
+siempre los mismos datos sin cargar nada completo en memoria.
+
+Uso:
+    python generar_datos.py --autos 1000000 --destino db
+    python generar_datos.py --autos 100000 --destino csv --directorio datos_sinteticos
+    python generar_datos.py --autos 1000000 --destino parquet --directorio datos_sinteticos
+"""
+
+import argparse
+import csv
+import itertools
+import logging
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List
+
+from sqlalchemy import insert
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+logger = logging.getLogger("generar_datos")
+
+LOTE_POR_DEFECTO = 10000
+
+# ------------------ CATÁLOGOS BASE ------------------
+
+# marca -> [(modelo, (bateria_min, bateria_max), eficiencia_km_por_kwh)]
+MODELOS_POR_MARCA = {
+    "Tesla": [("Model 3", (57, 82), 6.8), ("Model Y", (60, 82), 6.2), ("Model S", (95, 100), 6.3),
+              ("Model X", (95, 100), 5.4)],
+    "BYD": [("Dolphin", (44, 60), 7.0), ("Atto 3", (50, 60), 6.4), ("Seal", (61, 82), 6.9), ("Han", (76, 85), 6.0)],
+    "Hyundai": [("Kona Electric", (39, 65), 7.0), ("Ioniq 5", (58, 77), 6.1), ("Ioniq 6", (53, 77), 7.2)],
+    "Kia": [("EV6", (58, 77), 6.3), ("Niro EV", (64, 65), 6.6), ("EV9", (76, 99), 5.0)],
+    "Nissan": [("Leaf", (40, 62), 6.5), ("Ariya", (63, 87), 5.9)],
+    "Chevrolet": [("Bolt EV", (60, 66), 6.4), ("Bolt EUV", (65, 66), 6.1), ("Equinox EV", (85, 85), 5.6)],
+    "Renault": [("Zoe", (41, 52), 7.3), ("Megane E-Tech", (40, 60), 7.0), ("Kwid E-Tech", (26, 27), 7.6)],
+    "Volkswagen": [("ID.3", (45, 77), 6.9), ("ID.4", (52, 77), 6.1)],
+    "BMW": [("i3", (33, 42), 7.0), ("i4", (70, 84), 6.5), ("iX", (71, 105), 5.6)],
+    "Ford": [("Mustang Mach-E", (70, 91), 5.8), ("F-150 Lightning", (98, 131), 3.9)],
+}
+
+# Pesos tipo Zipf: pocas marcas concentran la mayoría del catálogo
+MARCAS = list(MODELOS_POR_MARCA)
+PESOS_MARCAS = [1 / (rango ** 1.1) for rango in range(1, len(MARCAS) + 1)]
+
+CONECTORES = ["CCS", "Tipo 2", "CHAdeMO", "Tesla", "Tipo 1"]
+PESOS_CONECTORES = [45, 30, 10, 10, 5]
+POTENCIAS_POR_CONECTOR = {
+    "CCS": [50.0, 100.0, 150.0, 350.0], "Tipo 2": [7.4, 11.0, 22.0], "CHAdeMO": [50.0, 100.0],
+    "Tesla": [150.0, 250.0], "Tipo 1": [3.7, 7.4],
+}
+OPERADORES = ["Celsia", "Terpel", "EPM", "Enel", "Tesla", "OPAIN", "Codensa", "Primax"]
+PESOS_OPERADORES = [30, 25, 15, 10, 8, 4, 4, 4]
+HORARIOS = ["24/7", "06:00-22:00", "09:00-21:00", "L-V 9:00-17:00", "L-D 8:00-20:00", "L-S 07:00-22:00"]
+PESOS_HORARIOS = [40, 15, 20, 10, 10, 5]
+CIUDADES = ["Bogotá", "Medellín", "Cali", "Barranquilla", "Cartagena", "Bucaramanga", "Pereira", "Manizales"]
+PESOS_CIUDADES = [40, 20, 12, 8, 6, 5, 5, 4]
+COORDENADAS_CIUDADES = {
+    "Bogotá": (4.711, -74.072), "Medellín": (6.244, -75.581), "Cali": (3.452, -76.532),
+    "Barranquilla": (10.964, -74.796), "Cartagena": (10.391, -75.479), "Bucaramanga": (7.119, -73.123),
+    "Pereira": (4.813, -75.696), "Manizales": (5.070, -75.517),
+}
+VIAS = ["Calle", "Carrera", "Avenida", "Diagonal", "Transversal"]
+TIPOS_AUTONOMIA = ["urbana", "mixta", "autopista", "WLTP", "EPA"]
+SUFIJOS_ESTACION = ["Centro", "Norte", "Sur", "Plaza", "Terminal", "Express", "Aeropuerto", "Parque"]
+
+
+# ------------------ GENERADORES DE FILAS ------------------
+
+def _modelo_unico(base: str, i: int) -> str:
+    # create_auto rechaza (modelo, anio) repetidos: un sufijo hexadecimal lo evita
+    return f"{base} {i:x}"[:30]
+
+
+def generar_autos(n: int, rnd: random.Random) -> Iterator[dict]:
+    for i in range(n):
+        marca = rnd.choices(MARCAS, weights=PESOS_MARCAS)[0]
+        modelo, (bat_min, bat_max), eficiencia = rnd.choice(MODELOS_POR_MARCA[marca])
+        bateria = round(rnd.uniform(bat_min, bat_max), 1)
+        yield {
+            "marca": marca,
+            "modelo": _modelo_unico(modelo, i),
+            "anio": min(2025, max(2011, int(rnd.triangular(2011, 2025, 2023)))),
+            "capacidad_bateria_kwh": bateria,
+            "autonomia_km": round(bateria * eficiencia * rnd.uniform(0.9, 1.05), 1),
+            "disponible": rnd.random() < 0.8,
+            "url_imagen": None,
+        }
+
+
+def generar_cargas(n: int, rnd: random.Random) -> Iterator[dict]:
+    for i in range(n):
+        marca = rnd.choices(MARCAS, weights=PESOS_MARCAS)[0]
+        modelo, (bat_min, bat_max), eficiencia = rnd.choice(MODELOS_POR_MARCA[marca])
+        bateria = rnd.uniform(bat_min, bat_max)
+        autonomia = bateria * eficiencia * rnd.uniform(0.85, 1.05)
+        potencia_domestica = rnd.choice([3.7, 7.4, 11.0])
+        tiempo = bateria / potencia_domestica
+        yield {
+            "modelo_auto": f"{marca} {modelo}"[:50],
+            "tipo_autonomia": rnd.choice(TIPOS_AUTONOMIA),
+            "autonomia_km": round(autonomia, 1),
+            "consumo_kwh_100km": round(bateria / autonomia * 100, 1),
+            "tiempo_carga_horas": round(tiempo, 1),
+            "dificultad_carga": "baja" if tiempo < 6 else ("media" if tiempo < 10 else "alta"),
+            "requiere_instalacion_domestica": potencia_domestica > 3.7,
+            "url_imagen": None,
+        }
+
+
+def generar_estaciones(n: int, rnd: random.Random) -> Iterator[dict]:
+    for i in range(n):
+        conector = rnd.choices(CONECTORES, weights=PESOS_CONECTORES)[0]
+        operador = "Tesla" if conector == "Tesla" else rnd.choices(OPERADORES, weights=PESOS_OPERADORES)[0]
+        ciudad = rnd.choices(CIUDADES, weights=PESOS_CIUDADES)[0]
+        potencia = rnd.choice(POTENCIAS_POR_CONECTOR[conector])
+        latitud, longitud = COORDENADAS_CIUDADES[ciudad]
+        yield {
+            "nombre": f"{operador} {rnd.choice(SUFIJOS_ESTACION)} {i}"[:50],
+            "ubicacion": f"{rnd.choice(VIAS)} {rnd.randint(1, 200)} # {rnd.randint(1, 120)}-{rnd.randint(1, 99)}, {ciudad}",
+            "tipo_conector": conector,
+            "potencia_kw": potencia,
+            "num_conectores": rnd.choice([1, 2, 2, 4, 4, 6, 8, 12]),
+            "acceso_publico": rnd.random() < 0.85,
+            "horario_apertura": rnd.choices(HORARIOS, weights=PESOS_HORARIOS)[0],
+            # La carga rápida es más cara por kWh
+            "coste_por_kwh": round(0.12 + potencia / 1000 + rnd.uniform(0, 0.15), 2),
+            "operador": operador,
+            "url_imagen": None,
+            # Hasta ~9 km alrededor del centro de la ciudad
+            "latitud": round(latitud + rnd.uniform(-0.08, 0.08), 6),
+            "longitud": round(longitud + rnd.uniform(-0.08, 0.08), 6),
+        }
+
+
+# ------------------ VALIDACIÓN ------------------
+
+def _validadores():
+    from modelos import AutoElectrico, CargaBase, EstacionBase
+    return {"autos": AutoElectrico, "cargas": CargaBase, "estaciones": EstacionBase}
+
+
+def validar(entidad: str, filas: List[dict]):
+    """Valida filas con los modelos Pydantic del API (lanza ValidationError si alguna no cumple)."""
+    modelo = _validadores().get(entidad.replace("_eliminados", ""))
+    for fila in filas:
+        modelo(**fila)
+
+
+# ------------------ PLAN DE GENERACIÓN ------------------
+
+def plan(autos: int, cargas: int, estaciones: int, fraccion_historial: float) -> Dict[str, tuple]:
+    """entidad -> (función generadora, número de filas). El historial usa los mismos generadores."""
+    return {
+        "autos": (generar_autos, autos),
+        "cargas": (generar_cargas, cargas),
+        "estaciones": (generar_estaciones, estaciones),
+        "autos_eliminados": (generar_autos, int(autos * fraccion_historial)),
+        "cargas_eliminados": (generar_cargas, int(cargas * fraccion_historial)),
+        "estaciones_eliminados": (generar_estaciones, int(estaciones * fraccion_historial)),
+    }
+
+
+def lotes(filas: Iterator[dict], tamano: int) -> Iterator[List[dict]]:
+    while True:
+        lote = list(itertools.islice(filas, tamano))
+        if not lote:
+            return
+        yield lote
+
+
+def _semilla_entidad(semilla: int, entidad: str) -> int:
+    # Cada entidad tiene su propio flujo para que cambiar un tamaño no altere las demás
+    return semilla * 1000 + sorted(plan(0, 0, 0, 0)).index(entidad)
+
+
+def generar(entidad: str, generador: Callable, n: int, semilla: int, tamano_lote: int,
+            validar_todo: bool) -> Iterator[List[dict]]:
+    rnd = random.Random(_semilla_entidad(semilla, entidad))
+    for numero, lote in enumerate(lotes(generador(n, rnd), tamano_lote)):
+        if validar_todo or numero == 0:
+            validar(entidad, lote)
+        yield lote
+
+
+# ------------------ DESTINOS ------------------
+
+def _tablas():
+    import models_sql as models
+    return {
+        "autos": models.AutoElectricoSQL.__table__,
+        "cargas": models.CargaSQL.__table__,
+        "estaciones": models.EstacionSQL.__table__,
+        "autos_eliminados": models.AutoEliminadoSQL.__table__,
+        "cargas_eliminados": models.CargaEliminadaSQL.__table__,
+        "estaciones_eliminados": models.EstacionEliminadaSQL.__table__,
+    }
+
+
+def escribir_db(engine, entidad: str, lotes_filas: Iterator[List[dict]]) -> int:
+    """Inserta en la base con executemany, una transacción por lote."""
+    tabla = _tablas()[entidad]
+    total = 0
+    for lote in lotes_filas:
+        with engine.begin() as conn:
+            conn.execute(insert(tabla), lote)
+        total += len(lote)
+    return total
+
+
+def escribir_csv(directorio: Path, entidad: str, lotes_filas: Iterator[List[dict]]) -> int:
+    """CSV con columna id, compatible con migrate_csv_to_db."""
+    directorio.mkdir(parents=True, exist_ok=True)
+    total = 0
+    with open(directorio / f"{entidad}.csv", "w", newline="", encoding="utf-8") as archivo:
+        escritor = None
+        for lote in lotes_filas:
+            if escritor is None:
+                escritor = csv.DictWriter(archivo, fieldnames=["id", *lote[0].keys()])
+                escritor.writeheader()
+            for fila in lote:
+                total += 1
+                escritor.writerow({"id": total, **fila})
+    return total
+
+
+def escribir_parquet(directorio: Path, entidad: str, lotes_filas: Iterator[List[dict]]) -> int:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("❌ El destino parquet requiere pyarrow (pip install pyarrow)")
+
+    directorio.mkdir(parents=True, exist_ok=True)
+    total = 0
+    escritor = None
+    try:
+        for lote in lotes_filas:
+            ids = list(range(total + 1, total + len(lote) + 1))
+            tabla = pa.Table.from_pylist([{"id": i, **fila} for i, fila in zip(ids, lote)])
+            if escritor is None:
+                escritor = pq.ParquetWriter(directorio / f"{entidad}.parquet", tabla.schema)
+            escritor.write_table(tabla)
+            total += len(lote)
+    finally:
+        if escritor is not None:
+            escritor.close()
+    return total
+
+
+def rellenar_versiones(engine):
+    """
+    Las inserciones masivas no asignan versión del feed de cambios, intervalos
+    de horario de las estaciones ni el auto de cada carga; se completan al final.
+    """
+    from db_init import rellenar_versiones as rellenar, rellenar_horarios, enlazar_cargas
+    rellenar(engine)
+    rellenar_horarios(engine)
+    enlazar_cargas(engine)
+
+
+def poblar_db(engine, autos: int, cargas: int = None, estaciones: int = None, fraccion_historial: float = 0.05,
+              semilla: int = 42, tamano_lote: int = LOTE_POR_DEFECTO, validar_todo: bool = False) -> Dict[str, int]:
+    """Llena una base ya creada. Pensado para benchmarks y pruebas de carga."""
+    cargas = autos if cargas is None else cargas
+    estaciones = autos if estaciones is None else estaciones
+    totales = {}
+    for entidad, (generador, n) in plan(autos, cargas, estaciones, fraccion_historial).items():
+        totales[entidad] = escribir_db(engine, entidad, generar(entidad, generador, n, semilla, tamano_lote, validar_todo))
+    rellenar_versiones(engine)
+    return totales
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--autos", type=int, default=100000)
+    parser.add_argument("--cargas", type=int, help="Por defecto, igual que --autos")
+    parser.add_argument("--estaciones", type=int, help="Por defecto, igual que --autos")
+    parser.add_argument("--historial", type=float, default=0.05, help="Fracción de filas de historial (eliminados)")
+    parser.add_argument("--destino", choices=["db", "csv", "parquet"], default="db")
+    parser.add_argument("--directorio", default="datos_sinteticos", help="Salida para csv/parquet")
+    parser.add_argument("--url", help="Base de datos destino (por defecto DATABASE_URL)")
+    parser.add_argument("--crear-tablas", action="store_true", help="Crear las tablas antes de insertar")
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--lote", type=int, default=LOTE_POR_DEFECTO)
+    parser.add_argument("--validar", action="store_true", help="Validar todas las filas (por defecto solo el primer lote)")
+    args = parser.parse_args()
+
+    cargas = args.autos if args.cargas is None else args.cargas
+    estaciones = args.autos if args.estaciones is None else args.estaciones
+
+    engine = None
+    if args.destino == "db":
+        import models_sql
+        from database import crear_engine, engine as engine_por_defecto
+        engine = crear_engine(args.url) if args.url else engine_por_defecto
+        if args.crear_tablas:
+            models_sql.Base.metadata.create_all(bind=engine)
+
+    directorio = Path(args.directorio)
+    for entidad, (generador, n) in plan(args.autos, cargas, estaciones, args.historial).items():
+        inicio = time.perf_counter()
+        lotes_filas = generar(entidad, generador, n, args.semilla, args.lote, args.validar)
+        if args.destino == "db":
+            total = escribir_db(engine, entidad, lotes_filas)
+        elif args.destino == "csv":
+            total = escribir_csv(directorio, entidad, lotes_filas)
+        else:
+            total = escribir_parquet(directorio, entidad, lotes_filas)
+        duracion = time.perf_counter() - inicio
+        logger.info("✅ %s: %d filas en %.1fs (%.0f filas/s)", entidad, total, duracion, total / max(duracion, 1e-9))
+    if args.destino == "db":
+        rellenar_versiones(engine)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,9 @@
 import os
 
-# 🚨 CORRECCIÓN CRÍTICA: 1 worker es el MÁXIMO seguro para 512MB de RAM
-workers = 1
+# 🚨 CORRECCIÓN CRÍTICA: 1 worker es el MÁXIMO seguro para 512MB de RAM.
+# Con más memoria se puede subir con WEB_CONCURRENCY: las cachés en memoria de
+# cada worker se invalidan con las escrituras de los demás (invalidacion.py).
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
 
 # Clase de worker recomendada para FastAPI con Uvicorn
 worker_class = "uvicorn.workers.UvicornWorker"
@@ -19,4 +21,4 @@ loglevel = "info"
 accesslog = "-"
 errorlog = "-"
 
-print("INFO: Gunicorn configurado para 1 worker, en modo Uvicorn. OOM Prevenido.")
\ No newline at end of file
+print(f"INFO: Gunicorn configurado para {workers} worker(s), en modo Uvicorn.")
\ No newline at end of file
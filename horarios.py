@@ -0,0 +1,129 @@
+"""
+horarios.py - Interpretación de los horarios de apertura de las estaciones
+
+`horario_apertura` es texto libre ("24/7", "09:00-21:00", "L-V 9:00-17:00",
+"L-V 8:00-20:00; S 9:00-14:00"). Se interpreta una sola vez al escribir la
+estación y se guarda como intervalos [inicio, fin) en minutos de la semana
+(lunes 00:00 = 0) en la tabla horarios_estaciones (ver crud.abierta_en), así
+"¿qué estaciones están abiertas a las 22:30?" es una consulta indexada y no
+un parseo de cada fila en cada petición.
+
+Días: L M X J V S D, sueltos (L,X,V) o en rango (L-V, V-L). Sin días, todos.
+Un horario que termina antes de empezar (22:00-06:00) cruza la medianoche.
+"""
+
+import os
+import re
+from datetime import datetime
+from functools import lru_cache
+from typing import List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+# Zona horaria de las estaciones para open_at=now y las horas sin fecha
+HORARIO_ZONA = os.getenv("HORARIO_ZONA", "America/Bogota")
+
+DIAS = "LMXJVSD"
+MINUTOS_DIA = 24 * 60
+MINUTOS_SEMANA = 7 * MINUTOS_DIA
+
+_SIEMPRE = {"24/7", "24h", "24 h", "24 horas"}
+_HORA = r"(\d{1,2}):(\d{2})"
+_SEGMENTO = re.compile(rf"^(?:(?P<dias>[{DIAS}][{DIAS},\-\s]*?)\s+)?{_HORA}\s*-\s*{_HORA}$", re.IGNORECASE)
+_INSTANTE = re.compile(rf"^(?:(?P<dia>[{DIAS}])\s+)?{_HORA}$", re.IGNORECASE)
+
+Intervalos = List[Tuple[int, int]]
+
+
+def _minutos(horas: str, minutos: str, es_fin: bool = False) -> int:
+    horas, minutos = int(horas), int(minutos)
+    if minutos > 59 or horas > 24 or (horas == 24 and (minutos or not es_fin)):
+        raise ValueError(f"Hora no válida: {horas}:{minutos:02d}")
+    return horas * 60 + minutos
+
+
+def _dias(texto: Optional[str]) -> List[int]:
+    if not texto:
+        return list(range(7))
+    dias = []
+    for parte in texto.upper().replace(" ", "").split(","):
+        if not parte:
+            continue
+        extremos = parte.split("-")
+        if len(extremos) == 1 and len(parte) == 1:
+            dias.append(DIAS.index(parte))
+        elif len(extremos) == 2 and all(len(e) == 1 for e in extremos):
+            desde, hasta = DIAS.index(extremos[0]), DIAS.index(extremos[1])
+            dias.extend((desde + i) % 7 for i in range((hasta - desde) % 7 + 1))
+        else:
+            raise ValueError(f"Días no válidos: {texto}")
+    return dias
+
+
+def _unir(intervalos: Intervalos) -> Intervalos:
+    unidos = []
+    for inicio, fin in sorted(intervalos):
+        if unidos and inicio <= unidos[-1][1]:
+            unidos[-1] = (unidos[-1][0], max(unidos[-1][1], fin))
+        else:
+            unidos.append((inicio, fin))
+    return unidos
+
+
+def parsear(texto: str) -> Intervalos:
+    """
+    Intervalos [inicio, fin) en minutos de la semana, ordenados y sin solapes.
+    ValueError si el texto no se entiende.
+    """
+    texto = " ".join(texto.split())
+    if texto.lower() in _SIEMPRE:
+        return [(0, MINUTOS_SEMANA)]
+
+    intervalos = []
+    for segmento in texto.split(";"):
+        coincidencia = _SEGMENTO.match(segmento.strip())
+        if not coincidencia:
+            raise ValueError(f"Horario no válido: {texto!r}")
+        apertura = _minutos(*coincidencia.group(2, 3))
+        cierre = _minutos(*coincidencia.group(4, 5), es_fin=True)
+        duracion = (cierre - apertura) % MINUTOS_DIA or MINUTOS_DIA
+        for dia in _dias(coincidencia.group("dias")):
+            inicio = dia * MINUTOS_DIA + apertura
+            fin = inicio + duracion
+            if fin > MINUTOS_SEMANA:
+                intervalos += [(inicio, MINUTOS_SEMANA), (0, fin - MINUTOS_SEMANA)]
+            else:
+                intervalos.append((inicio, fin))
+    return _unir(intervalos)
+
+
+@lru_cache(maxsize=1024)
+def intervalos(texto: str) -> Tuple[Tuple[int, int], ...]:
+    """parsear() memorizado; () si el horario no se entiende."""
+    try:
+        return tuple(parsear(texto))
+    except ValueError:
+        return ()
+
+
+def minuto_semana(momento: datetime) -> int:
+    return momento.weekday() * MINUTOS_DIA + momento.hour * 60 + momento.minute
+
+
+def parsear_instante(valor: str, ahora: Optional[datetime] = None) -> int:
+    """
+    Minuto de la semana de un parámetro open_at: "now", "22:30" (hoy),
+    "S 22:30" (día de la semana) o fecha ISO ("2024-05-04T22:30").
+    """
+    ahora = ahora or datetime.now(ZoneInfo(HORARIO_ZONA))
+    valor = valor.strip()
+    if valor.lower() in ("now", "ahora"):
+        return minuto_semana(ahora)
+    coincidencia = _INSTANTE.match(valor)
+    if coincidencia:
+        dia = coincidencia.group("dia")
+        dia = DIAS.index(dia.upper()) if dia else ahora.weekday()
+        return dia * MINUTOS_DIA + _minutos(*coincidencia.group(2, 3))
+    momento = datetime.fromisoformat(valor)
+    if momento.tzinfo is not None:
+        momento = momento.astimezone(ZoneInfo(HORARIO_ZONA))
+    return minuto_semana(momento)
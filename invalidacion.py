@@ -0,0 +1,251 @@
+"""
+invalidacion.py - Aviso entre procesos de que el catálogo cambió
+
+Las cachés en memoria (totales de crud, busqueda, distribuciones,
+matriz_carga, snapshot_catalogo) se mantienen con los eventos de eventos.py,
+que son por proceso. Este módulo detecta las escrituras de otros workers o
+instancias (y de las cargas masivas de db_init) y publica en el bus local un
+evento 'reset' de la entidad: cada caché descarta su copia y la reconstruye
+en la próxima consulta, y los clientes SSE reciben el 'reset'.
+
+- PostgreSQL: un trigger por sentencia en cada tabla hace
+  pg_notify(CANAL, 'entidad:origen'); el aviso se entrega al confirmar la
+  transacción. El origen es el ajuste de sesión catalogo.origen, que cada
+  proceso fija en sus conexiones con un token propio. Un hilo escucha con
+  LISTEN en una conexión aparte y descarta los avisos con su token.
+- Otros motores (SQLite): un hilo consulta cada INVALIDACION_INTERVALO_MS la
+  versión de cada entidad (versiones_catalogo en Postgres, MAX(version) de
+  filas vivas y lápidas en SQLite; ver crud._siguiente_version). Cada
+  escritura sube la versión en uno y crud registra las suyas con propia(),
+  así que si la versión avanzó más que las escrituras propias otro proceso
+  escribió.
+
+INVALIDACION=auto (por defecto) elige según el motor; "sondeo" fuerza la
+consulta periódica y "no" lo desactiva.
+"""
+
+import logging
+import os
+import select
+import threading
+import uuid
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event, func, select as sql_select, text
+from sqlalchemy.engine import Connection, Engine
+
+import eventos
+import models_sql
+
+logger = logging.getLogger("invalidacion")
+
+INVALIDACION = os.getenv("INVALIDACION", "auto").lower()
+INVALIDACION_INTERVALO_MS = float(os.getenv("INVALIDACION_INTERVALO_MS", "200"))
+CANAL = "catalogo_cambios"
+AJUSTE_ORIGEN = "catalogo.origen"
+
+_TABLAS = {
+    "autos": (models_sql.AutoElectricoSQL, models_sql.AutoEliminadoSQL),
+    "cargas": (models_sql.CargaSQL, models_sql.CargaEliminadaSQL),
+    "estaciones": (models_sql.EstacionSQL, models_sql.EstacionEliminadaSQL),
+}
+
+
+# --------------------- Triggers (PostgreSQL) ---------------------
+
+def instalar_triggers(conn: Connection):
+    """Crea (o recrea) la función y los triggers de aviso; es idempotente."""
+    conn.execute(text(f"""
+        CREATE OR REPLACE FUNCTION avisar_cambio_catalogo() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('{CANAL}', TG_ARGV[0] || ':' || coalesce(current_setting('{AJUSTE_ORIGEN}', true), ''));
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """))
+    for entidad, (modelo, _) in _TABLAS.items():
+        tabla = modelo.__tablename__
+        conn.execute(text(f"DROP TRIGGER IF EXISTS avisar_cambio ON {tabla}"))
+        conn.execute(text(
+            f"CREATE TRIGGER avisar_cambio AFTER INSERT OR UPDATE OR DELETE ON {tabla} "
+            f"FOR EACH STATEMENT EXECUTE FUNCTION avisar_cambio_catalogo('{entidad}')"
+        ))
+
+
+# --------------------- Versiones (sondeo) ---------------------
+
+def versiones_actuales(conn: Connection) -> Dict[str, int]:
+    """Versión actual de cada entidad, con una sola consulta."""
+    if conn.dialect.name == "postgresql":
+        contador = models_sql.VersionCatalogoSQL.__table__
+        return {entidad: valor for entidad, valor in conn.execute(sql_select(contador.c.entidad, contador.c.valor))}
+    maximas = []
+    for vivas, lapidas in _TABLAS.values():
+        maximas += [
+            sql_select(func.coalesce(func.max(vivas.__table__.c.version), 0)).scalar_subquery(),
+            sql_select(func.coalesce(func.max(lapidas.__table__.c.version), 0)).scalar_subquery(),
+        ]
+    fila = conn.execute(sql_select(*maximas)).one()
+    return {entidad: max(fila[2 * i], fila[2 * i + 1]) for i, entidad in enumerate(_TABLAS)}
+
+
+class Vigilante:
+    """Hilo que publica 'reset' de las entidades escritas por otros procesos."""
+
+    def __init__(self, intervalo_ms: float = INVALIDACION_INTERVALO_MS):
+        self.intervalo = intervalo_ms / 1000
+        self._propias: Dict[str, set] = {entidad: set() for entidad in _TABLAS}
+        self._vistas: Dict[str, int] = {}
+        self.origen = uuid.uuid4().hex
+        self._engine: Optional[Engine] = None
+        self._parar = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    # ---- escrituras propias ----
+
+    def propia(self, entidad: str, version: Optional[int]):
+        """crud registra la versión de cada escritura confirmada de este proceso."""
+        if version is None:
+            return
+        with self._lock:
+            if version > self._vistas.get(entidad, 0):
+                self._propias[entidad].add(version)
+
+    def _al_conectar(self, conexion_dbapi, registro):
+        # Marca la sesión con el token del proceso para reconocer nuestros avisos
+        cursor = conexion_dbapi.cursor()
+        cursor.execute("SELECT set_config(%s, %s, false)", (AJUSTE_ORIGEN, self.origen))
+        cursor.close()
+        conexion_dbapi.commit()
+
+    def revisar(self, versiones: Dict[str, int]) -> List[str]:
+        """
+        Entidades con escrituras ajenas desde la revisión anterior. Las
+        versiones crecen de uno en uno: hay escrituras ajenas si el salto es
+        mayor que las versiones propias dentro de él. La primera vez solo
+        toma las versiones como punto de partida.
+        """
+        cambiadas = []
+        with self._lock:
+            for entidad, version in versiones.items():
+                anterior = self._vistas.get(entidad)
+                self._vistas[entidad] = version
+                propias = self._propias.setdefault(entidad, set())
+                nuevas = {v for v in propias if anterior is not None and anterior < v <= version}
+                if anterior is not None and version - anterior > len(nuevas):
+                    cambiadas.append(entidad)
+                propias.difference_update({v for v in propias if v <= version})
+        return cambiadas
+
+    def _avisar(self, entidades: Iterable[str]):
+        for entidad in entidades:
+            logger.debug("Cambios de otro proceso en %s", entidad)
+            eventos.publicar(entidad, "reset", None)
+
+    # ---- hilos ----
+
+    def _sondear(self):
+        fallando = False
+        while not self._parar.is_set():
+            try:
+                with self._engine.connect() as conn:
+                    versiones = versiones_actuales(conn)
+                self._avisar(self.revisar(versiones))
+                fallando = False
+            except Exception as e:
+                # Se avisa una vez por racha de errores, no en cada intento
+                if not fallando:
+                    logger.warning("No se pudieron leer las versiones del catálogo: %s", e)
+                fallando = True
+            self._parar.wait(self.intervalo)
+
+    def _conectar_listen(self) -> Tuple[object, object, list]:
+        proxy = self._engine.raw_connection()
+        proxy.detach()
+        conexion = proxy.driver_connection
+        conexion.autocommit = True
+        recibidos = []
+        if hasattr(conexion, "add_notify_handler"):
+            # psycopg 3: los avisos llegan al handler al procesar la conexión
+            conexion.add_notify_handler(recibidos.append)
+        cursor = conexion.cursor()
+        cursor.execute(f"LISTEN {CANAL}")
+        cursor.close()
+        return proxy, conexion, recibidos
+
+    def ajenas(self, avisos: Iterable[str]) -> List[str]:
+        """Entidades de los avisos ('entidad:origen') enviados por otros procesos."""
+        entidades = set()
+        for aviso in avisos:
+            entidad, _, origen = aviso.partition(":")
+            if origen != self.origen and entidad in _TABLAS:
+                entidades.add(entidad)
+        return sorted(entidades)
+
+    def _avisos(self, conexion, recibidos: list) -> List[str]:
+        """Espera hasta `intervalo` y devuelve el payload de los avisos recibidos."""
+        if not select.select([conexion], [], [], self.intervalo)[0]:
+            return []
+        if hasattr(conexion, "add_notify_handler"):
+            conexion.execute("SELECT 1")
+            avisos, recibidos[:] = list(recibidos), []
+        else:
+            # psycopg2
+            conexion.poll()
+            avisos, conexion.notifies[:] = list(conexion.notifies), []
+        return [aviso.payload for aviso in avisos]
+
+    def _escuchar(self):
+        primera = True
+        while not self._parar.is_set():
+            proxy = None
+            try:
+                proxy, conexion, recibidos = self._conectar_listen()
+                if not primera:
+                    # Los avisos enviados mientras no había conexión se perdieron
+                    self._avisar(_TABLAS)
+                primera = False
+                while not self._parar.is_set():
+                    self._avisar(self.ajenas(self._avisos(conexion, recibidos)))
+            except Exception as e:
+                logger.warning("LISTEN %s interrumpido, reconectando: %s", CANAL, e)
+                self._parar.wait(1.0)
+            finally:
+                if proxy is not None:
+                    try:
+                        proxy.close()
+                    except Exception:
+                        pass
+
+    def iniciar(self, engine: Engine, modo: str = INVALIDACION):
+        if modo == "no" or self._hilo is not None:
+            return
+        self._engine = engine
+        self._parar.clear()
+        if modo == "auto" and engine.dialect.name == "postgresql":
+            event.listen(engine, "connect", self._al_conectar)
+            # Conexiones nuevas para que todas las del pool lleven el token
+            engine.dispose()
+            objetivo, modo = self._escuchar, f"LISTEN {CANAL}"
+        else:
+            objetivo, modo = self._sondear, f"sondeo cada {self.intervalo * 1000:g} ms"
+        self._hilo = threading.Thread(target=objetivo, name="invalidacion", daemon=True)
+        self._hilo.start()
+        logger.info("Invalidación entre procesos activa (%s)", modo)
+
+    def detener(self):
+        self._parar.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout=5)
+            self._hilo = None
+        if self._engine is not None and event.contains(self._engine, "connect", self._al_conectar):
+            event.remove(self._engine, "connect", self._al_conectar)
+
+
+# Vigilante de la aplicación
+vigilante = Vigilante()
+
+
+def propia(entidad: str, version: Optional[int]):
+    vigilante.propia(entidad, version)
@@ -0,0 +1,154 @@
+"""
+logging_config.py - Configuración de logging no bloqueante
+
+Los módulos solo encolan registros (QueueHandler); un hilo QueueListener los
+formatea y escribe en stdout, así el formateo y la escritura quedan fuera del
+camino de cada petición. La salida es JSON (una línea por registro) o texto.
+
+Variables de entorno:
+    LOG_LEVEL         Nivel raíz (INFO por defecto)
+    LOG_LEVELS        Niveles por logger: "auth_utils=WARNING,FastAPI=DEBUG"
+    LOG_FORMAT        json (por defecto) o texto
+    LOG_DEBUG_SAMPLE  Fracción de registros DEBUG que se conservan (1.0 = todos)
+    LOG_QUEUE_SIZE    Tamaño máximo de la cola; si se llena se descartan registros
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+FORMATO_TEXTO = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Atributos estándar de LogRecord; el resto llega por extra={...} y se incluye en el JSON
+_ATRIBUTOS_ESTANDAR = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener = None
+_handler_cola = None
+_lock = threading.Lock()
+
+
+class FormateadorJSON(logging.Formatter):
+    """Un objeto JSON por línea con los campos del registro y los extra."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        datos = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "nivel": record.levelname,
+            "logger": record.name,
+            "mensaje": record.getMessage(),
+        }
+        for clave, valor in record.__dict__.items():
+            if clave not in _ATRIBUTOS_ESTANDAR and not clave.startswith("_"):
+                datos[clave] = valor
+        if record.exc_info:
+            datos["excepcion"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            datos["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(datos, ensure_ascii=False, default=str)
+
+
+class MuestreoDebug(logging.Filter):
+    """Conserva uno de cada N registros DEBUG por logger; los demás niveles pasan siempre."""
+
+    def __init__(self, fraccion: float):
+        super().__init__()
+        self.cada = 0 if fraccion <= 0 else max(1, round(1 / fraccion))
+        self._contadores = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+        if self.cada == 0:
+            return False
+        n = self._contadores.get(record.name, 0)
+        self._contadores[record.name] = n + 1
+        return n % self.cada == 0
+
+
+class ColaHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler que no formatea en el hilo que registra: el mensaje con sus
+    argumentos (%-style) se interpola en el hilo del listener. Si la cola está
+    llena el registro se descarta y se cuenta, en lugar de bloquear la petición.
+    """
+
+    def __init__(self, cola):
+        super().__init__(cola)
+        self.descartados = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # La cola es en memoria (no multiprocessing): no hace falta serializar nada
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+
+def _niveles_por_logger(valor: str) -> dict:
+    niveles = {}
+    for par in filter(None, (p.strip() for p in valor.split(","))):
+        nombre, _, nivel = par.partition("=")
+        if nombre.strip() and nivel.strip():
+            niveles[nombre.strip()] = nivel.strip().upper()
+    return niveles
+
+
+def configurar_logging(stream=None, formato: str = None, nivel: str = None, muestreo: float = None) -> ColaHandler:
+    """
+    Instala el QueueHandler en el logger raíz y arranca el listener. Es
+    idempotente: las llamadas siguientes solo devuelven el handler existente.
+    """
+    global _listener, _handler_cola
+    with _lock:
+        if _handler_cola is not None:
+            return _handler_cola
+
+        formato = (formato or os.getenv("LOG_FORMAT", "json")).lower()
+        salida = logging.StreamHandler(stream or sys.stdout)
+        salida.setFormatter(FormateadorJSON() if formato == "json" else logging.Formatter(FORMATO_TEXTO))
+
+        cola = queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+        _handler_cola = ColaHandler(cola)
+        if muestreo is None:
+            muestreo = float(os.getenv("LOG_DEBUG_SAMPLE", "1.0"))
+        _handler_cola.addFilter(MuestreoDebug(muestreo))
+
+        # Ningún formato usa hilo ni proceso: no calcularlos en cada registro
+        # (sección "Optimization" de la documentación de logging)
+        logging.logThreads = False
+        logging.logProcesses = False
+        logging.logMultiprocessing = False
+
+        raiz = logging.getLogger()
+        for handler in list(raiz.handlers):
+            raiz.removeHandler(handler)
+        raiz.addHandler(_handler_cola)
+        raiz.setLevel((nivel or os.getenv("LOG_LEVEL", "INFO")).upper())
+        for nombre, nivel_logger in _niveles_por_logger(os.getenv("LOG_LEVELS", "")).items():
+            logging.getLogger(nombre).setLevel(nivel_logger)
+
+        _listener = logging.handlers.QueueListener(cola, salida, respect_handler_level=True)
+        _listener.start()
+        atexit.register(detener_logging)
+        return _handler_cola
+
+
+def detener_logging():
+    """Vacía la cola y detiene el hilo del listener (se llama también al salir)."""
+    global _listener, _handler_cola
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+        if _handler_cola is not None:
+            logging.getLogger().removeHandler(_handler_cola)
+            _handler_cola = None
@@ -1,15 +1,15 @@
 # main.py - VERSIÓN CORREGIDA CON SISTEMA DE SESIÓN FUNCIONAL
 
-from fastapi import FastAPI, HTTPException, Depends, Request, File, UploadFile, Form, status, Response, Cookie
-from fastapi.responses import JSONResponse, HTMLResponse, RedirectResponse
+from fastapi import FastAPI, HTTPException, Depends, Request, File, UploadFile, Form, status, Response, Cookie, Header, Query
+from fastapi.responses import JSONResponse, HTMLResponse, RedirectResponse, PlainTextResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from fastapi.security import OAuth2PasswordRequestForm
-from typing import List, Optional
+from typing import List, Optional, Literal, Sequence
+from functools import partial
+from contextlib import asynccontextmanager
 import os
 import logging
-import sys
-import traceback
 from sqlalchemy.orm import Session
 from pathlib import Path
 from sqlalchemy import func
@@ -23,39 +23,66 @@ from modelos import (
     UsuarioRegistro, UsuarioLogin, CambioPassword, UsuarioRespuesta
 )
 
-from database import get_db, engine, Base
+from logging_config import configurar_logging
+from database import get_db, engine, Base, read_engines, LecturasPropiasMiddleware
 import models_sql
 import crud
+import metricas
+import monitoreo_sql
+import tareas
+import eventos
+import formatos
+import busqueda
+import distribuciones
+import horarios
+import matriz_carga
+import snapshot_catalogo
+import invalidacion
 import crud_usuarios as user_crud
 from auth_utils import get_password_hash, verify_password
 
-# Configuración de Logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    stream=sys.stdout
-)
+# Configuración de Logging (cola + hilo escritor, ver logging_config.py)
+configurar_logging()
 logger = logging.getLogger("FastAPI")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Arranca y detiene la cola de tareas en segundo plano y el aviso de cambios entre workers."""
+    await tareas.cola.iniciar()
+    invalidacion.vigilante.iniciar(engine)
+    yield
+    invalidacion.vigilante.detener()
+    await tareas.cola.detener()
+
+
 # Inicialización de FastAPI
 app = FastAPI(
     title="Electric Cars Database API",
     description="API RESTful para la gestión de datos de autos y estaciones de carga eléctricas.",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 
 # Manejador global de excepciones
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
-    logger.error(f"Error global capturado: {exc}")
-    logger.error(f"Traceback: {traceback.format_exc()}")
+    # El traceback se formatea en el hilo del listener, no en la petición
+    logger.error("Error global capturado: %s", exc, exc_info=exc)
     return JSONResponse(
         status_code=500,
         content={"detail": f"Error interno del servidor: {str(exc)}"}
     )
 
 
+# Métricas por petición e instrumentación SQL (middleware ASGI puro)
+app.add_middleware(metricas.MetricasMiddleware)
+
+# Ventana de read-your-writes por cliente (cookie), solo con réplicas de lectura
+if read_engines:
+    app.add_middleware(LecturasPropiasMiddleware)
+
+
 # Configuración de directorios
 templates = Jinja2Templates(directory="templates")
 UPLOAD_DIRECTORY = Path("static/images")
@@ -83,7 +110,7 @@ def get_current_user_from_cookie(request: Request, db: Session = Depends(get_db)
             return user
         return None
     except Exception as e:
-        logger.error(f"Error al obtener usuario desde cookie: {e}")
+        logger.error("Error al obtener usuario desde cookie: %s", e)
         return None
 
 
@@ -99,7 +126,7 @@ async def welcome_page(request: Request, db: Session = Depends(get_db)):
             "logged_in": current_user is not None
         })
     except Exception as e:
-        logger.error(f"Error en welcome_page: {e}", exc_info=True)
+        logger.error("Error en welcome_page: %s", e, exc_info=True)
         raise
 
 
@@ -125,7 +152,7 @@ async def index_page(request: Request, db: Session = Depends(get_db)):
             "logged_in": current_user is not None
         })
     except Exception as e:
-        logger.error(f"Error en index_page: {e}", exc_info=True)
+        logger.error("Error en index_page: %s", e, exc_info=True)
         raise
 
 
@@ -215,21 +242,21 @@ async def register_user(
     }
 
     try:
-        logger.info(f"Intento de registro para: {correo}")
+        logger.info("Intento de registro para: %s", correo)
 
         existing_user = user_crud.get_user_by_cedula(db, cedula)
         if existing_user:
-            logger.warning(f"Cédula ya registrada: {cedula}")
+            logger.warning("Cédula ya registrada: %s", cedula)
             raise HTTPException(status_code=400, detail="La cédula ya está registrada.")
 
         existing_email = user_crud.get_user_by_correo(db, correo)
         if existing_email:
-            logger.warning(f"Correo ya registrado: {correo}")
+            logger.warning("Correo ya registrado: %s", correo)
             raise HTTPException(status_code=400, detail="El correo ya está registrado.")
 
         new_user = UsuarioRegistro(**user_data)
         created_user = user_crud.create_user(db, new_user)
-        logger.info(f"Usuario registrado exitosamente: {created_user.cedula}")
+        logger.info("Usuario registrado exitosamente: %s", created_user.cedula)
 
         return RedirectResponse(
             url="/login?success_message=Registro%20exitoso.%20Ahora%20puedes%20iniciar%20sesión.",
@@ -237,14 +264,14 @@ async def register_user(
         )
 
     except HTTPException as e:
-        logger.error(f"HTTPException en registro: {e.detail}")
+        logger.error("HTTPException en registro: %s", e.detail)
         return templates.TemplateResponse(
             "register.html",
             {"request": request, "error_message": e.detail, "form_data": user_data},
             status_code=e.status_code
         )
     except Exception as e:
-        logger.error(f"Error inesperado en registro: {e}", exc_info=True)
+        logger.error("Error inesperado en registro: %s", e, exc_info=True)
         return templates.TemplateResponse(
             "register.html",
             {
@@ -265,12 +292,12 @@ async def login_for_access_token(
 ):
     """Endpoint para iniciar sesión"""
     try:
-        logger.info(f"Intento de login para: {username}")
+        logger.info("Intento de login para: %s", username)
 
         user = user_crud.get_user_by_cedula_or_correo(db, username)
 
         if not user:
-            logger.warning(f"Usuario no encontrado: {username}")
+            logger.warning("Usuario no encontrado: %s", username)
             return templates.TemplateResponse(
                 "login.html",
                 {
@@ -280,11 +307,11 @@ async def login_for_access_token(
                 status_code=401
             )
 
-        logger.debug(f"Verificando contraseña para usuario: {user.cedula}")
+        logger.debug("Verificando contraseña para usuario: %s", user.cedula)
         password_valid = verify_password(password, user.hashed_password)
 
         if not password_valid:
-            logger.warning(f"Contraseña incorrecta para: {username}")
+            logger.warning("Contraseña incorrecta para: %s", username)
             return templates.TemplateResponse(
                 "login.html",
                 {
@@ -295,7 +322,7 @@ async def login_for_access_token(
             )
 
         if not user.activo:
-            logger.warning(f"Usuario inactivo intentó login: {username}")
+            logger.warning("Usuario inactivo intentó login: %s", username)
             return templates.TemplateResponse(
                 "login.html",
                 {
@@ -305,7 +332,7 @@ async def login_for_access_token(
                 status_code=403
             )
 
-        logger.info(f"Login exitoso para: {user.cedula}")
+        logger.info("Login exitoso para: %s", user.cedula)
 
         response = RedirectResponse(url="/index", status_code=status.HTTP_302_FOUND)
 
@@ -320,7 +347,7 @@ async def login_for_access_token(
         return response
 
     except Exception as e:
-        logger.error(f"Error crítico en login: {e}", exc_info=True)
+        logger.error("Error crítico en login: %s", e, exc_info=True)
         return templates.TemplateResponse(
             "login.html",
             {
@@ -363,7 +390,7 @@ async def handle_change_password(
     }
 
     try:
-        logger.info(f"Intento de cambio de contraseña para: {identificador}")
+        logger.info("Intento de cambio de contraseña para: %s", identificador)
 
         pass_change = CambioPassword(**form_data)
 
@@ -378,7 +405,7 @@ async def handle_change_password(
                 raise HTTPException(status_code=401, detail="Contraseña anterior incorrecta.")
 
         user_crud.update_user_password(db, user.id, pass_change.password_nueva)
-        logger.info(f"Contraseña actualizada para: {identificador}")
+        logger.info("Contraseña actualizada para: %s", identificador)
 
         return RedirectResponse(
             url="/login?success_message=Contraseña%20actualizada%20exitosamente.",
@@ -386,14 +413,14 @@ async def handle_change_password(
         )
 
     except HTTPException as e:
-        logger.error(f"HTTPException en cambio de contraseña: {e.detail}")
+        logger.error("HTTPException en cambio de contraseña: %s", e.detail)
         return templates.TemplateResponse(
             "change_password.html",
             {"request": request, "error_message": e.detail, "form_data": form_data},
             status_code=e.status_code
         )
     except Exception as e:
-        logger.error(f"Error en cambio de contraseña: {e}", exc_info=True)
+        logger.error("Error en cambio de contraseña: %s", e, exc_info=True)
         return templates.TemplateResponse(
             "change_password.html",
             {"request": request, "error_message": f"Error: {str(e)}", "form_data": form_data},
@@ -502,16 +529,275 @@ async def deleted_stations_page(request: Request, db: Session = Depends(get_db))
     })
 
 
+# --------------------- LECTURA POR LOTES DE IDS ---------------------
+
+MAX_IDS_POR_PETICION = int(os.getenv("MAX_IDS_POR_PETICION", "500"))
+_DESCRIPCION_IDS = "Ids separados por comas (1,2,3); los que no existen se indican en X-Missing-Ids"
+
+
+def _parsear_ids(ids: str) -> List[int]:
+    try:
+        lista = [int(parte) for parte in ids.split(",") if parte.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids debe ser una lista de enteros separados por comas")
+    if not lista:
+        raise HTTPException(status_code=400, detail="ids no puede estar vacío")
+    if len(lista) > MAX_IDS_POR_PETICION:
+        raise HTTPException(status_code=400, detail=f"Máximo {MAX_IDS_POR_PETICION} ids por petición")
+    return lista
+
+
+def _leer_por_ids(db: Session, entidad: str, ids: str, response: Response, historial: bool = False,
+                  campos: Optional[List[str]] = None):
+    """Una sola consulta IN para todos los ids; el orden de la respuesta es el pedido."""
+    tabla = None if historial else snapshot_catalogo.tabla(db, entidad)
+    if tabla is not None:
+        filas, faltantes = tabla.por_ids(_parsear_ids(ids), campos=campos)
+    else:
+        filas, faltantes = crud.get_por_ids(db, entidad, _parsear_ids(ids), historial=historial, campos=campos)
+    if faltantes:
+        response.headers["X-Missing-Ids"] = ",".join(map(str, faltantes))
+    return filas
+
+
+@app.get("/api/historial/{entidad}", tags=["Historial"])
+async def read_historial_por_ids(
+        entidad: Literal["autos", "cargas", "estaciones"],
+        request: Request,
+        response: Response,
+        ids: str = Query(..., description=_DESCRIPCION_IDS),
+        db: Session = Depends(get_db)
+):
+    """Registros eliminados por id de historial."""
+    filas = _leer_por_ids(db, entidad, ids, response, historial=True)
+    return formatos.responder(request, filas, headers=dict(response.headers))
+
+
+def _leer_uno(db: Session, entidad: str, obj_id: int, leer):
+    """Detalle por id desde snapshot_catalogo si está activo; si no, con `leer` (crud)."""
+    tabla = snapshot_catalogo.tabla(db, entidad)
+    return tabla.obtener(obj_id) if tabla is not None else leer(db, obj_id)
+
+
+# --------------------- PROYECCIÓN DE COLUMNAS Y FORMATO ---------------------
+
+_DESCRIPCION_FIELDS = "Columnas a devolver separadas por comas (id se incluye siempre)"
+_DESCRIPCION_LAYOUT = "rows (lista de objetos) o columns (un array por campo)"
+Layout = Literal["rows", "columns"]
+
+
+def _parsear_campos(fields: Optional[str], esquema) -> Optional[List[str]]:
+    if fields is None:
+        return None
+    campos = [c.strip() for c in fields.split(",") if c.strip()]
+    desconocidos = [c for c in campos if c not in esquema.model_fields]
+    if not campos or desconocidos:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Campos no válidos: {', '.join(desconocidos) or '(vacío)'}. "
+                   f"Disponibles: {', '.join(esquema.model_fields)}",
+        )
+    return campos
+
+
+def _listar(db: Session, entidad: str, request: Request, response: Response, skip: int, limit: int,
+            ids: Optional[str], fields: Optional[str], layout: str, esquema, listar_completo,
+            condiciones: Sequence = ()):
+    """
+    Listado común de autos/cargas/estaciones. Con `fields`, layout=columns o
+    Accept: application/msgpack las filas se leen como diccionarios (solo las
+    columnas necesarias) y se serializan en formatos.responder, sin pasar por
+    el response_model completo. Los listados paginados llevan el total en
+    X-Total-Count y X-Total-Is-Estimate (ver crud.contar). `condiciones`
+    filtra el listado paginado (listar_completo ya debe aplicarlas). Sin
+    condiciones, si está activo, se sirve desde snapshot_catalogo.
+    """
+    campos = _parsear_campos(fields, esquema)
+    if campos is None and (layout == "columns" or formatos.pide_msgpack(request)):
+        campos = list(esquema.model_fields)
+    if ids is not None and condiciones:
+        raise HTTPException(status_code=400, detail="ids no se puede combinar con otros filtros")
+
+    tabla = None if condiciones else snapshot_catalogo.tabla(db, entidad)
+    if ids is None:
+        total, es_estimacion = (len(tabla), False) if tabla is not None else crud.contar(db, entidad, *condiciones)
+        response.headers["X-Total-Count"] = str(total)
+        response.headers["X-Total-Is-Estimate"] = "true" if es_estimacion else "false"
+
+    if ids is not None:
+        filas = _leer_por_ids(db, entidad, ids, response, campos=campos)
+    elif tabla is not None:
+        filas = tabla.pagina(skip, limit, campos)
+    elif campos is not None:
+        filas = crud.get_parcial(db, entidad, campos, skip=skip, limit=limit, condiciones=condiciones)
+    else:
+        filas = listar_completo(db, skip=skip, limit=limit)
+    if campos is None:
+        return filas
+    return formatos.responder(request, filas, columnas=layout == "columns", headers=dict(response.headers))
+
+
+# --------------------- AUTOCOMPLETADO Y BÚSQUEDA APROXIMADA ---------------------
+
+@app.get("/api/suggest", tags=["Búsqueda"])
+async def suggest(
+        entity: Literal["autos", "cargas", "estaciones"],
+        q: str = Query(..., min_length=1, max_length=50),
+        limit: int = Query(10, ge=1, le=50),
+        db: Session = Depends(get_db)
+):
+    """Sugerencias por prefijo desde el índice en memoria (busqueda.py), ordenadas por frecuencia."""
+    return busqueda.sugerir(db, entity, q, limite=limit)
+
+
+_DESCRIPCION_FUZZY = "Búsqueda tolerante a erratas (índice de trigramas), ordenada por parecido"
+
+
+def _buscar_aproximado(db: Session, entidad: str, texto: str, limite: int, condiciones: Sequence = ()):
+    ids = [id for id, _ in busqueda.buscar_aproximado(db, entidad, texto, limite=limite)]
+    return crud.get_por_ids(db, entidad, ids, condiciones=condiciones)[0] if ids else []
+
+
+# --------------------- HORARIOS DE APERTURA ---------------------
+
+_DESCRIPCION_OPEN_AT = ("Solo estaciones abiertas en ese momento: now, HH:MM (hoy), "
+                        "día y hora (S 22:30; L M X J V S D) o fecha ISO")
+
+
+def _minuto_open_at(open_at: Optional[str]) -> Optional[int]:
+    """Minuto de la semana pedido en open_at (None si no se pide)."""
+    if open_at is None:
+        return None
+    try:
+        return horarios.parsear_instante(open_at)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"open_at no válido: {open_at}")
+
+
+# --------------------- FACETAS ---------------------
+
+_ESQUEMAS = {"autos": AutoElectricoConID, "cargas": CargaConID, "estaciones": EstacionConID}
+
+
+def _parsear_filtros(entidad: str, parametros) -> dict:
+    """?marca=Tesla,Kia&disponible=true -> {"marca": ["Tesla", "Kia"], "disponible": [True]}"""
+    tabla = crud.modelo_de(entidad).__table__
+    filtros = {}
+    for faceta in crud.FACETAS[entidad]:
+        if faceta not in parametros:
+            continue
+        tipo = tabla.c[faceta].type.python_type
+        valores = []
+        for valor in parametros[faceta].split(","):
+            valor = valor.strip()
+            try:
+                if tipo is bool:
+                    if valor.lower() not in ("true", "false"):
+                        raise ValueError(valor)
+                    valores.append(valor.lower() == "true")
+                else:
+                    valores.append(tipo(valor))
+            except ValueError:
+                raise HTTPException(status_code=400, detail=f"Valor no válido para {faceta}: {valor}")
+        filtros[faceta] = valores
+    return filtros
+
+
+@app.get("/api/{entidad}/facets", tags=["Facetas"])
+async def read_facetas(
+        entidad: Literal["autos", "cargas", "estaciones"],
+        request: Request,
+        skip: int = Query(0, ge=0),
+        limit: int = Query(20, ge=0, le=500),
+        db: Session = Depends(get_db)
+):
+    """
+    Resultados y conteos de todas las facetas para el filtro actual en una
+    sola petición. Filtros por facetas como parámetros (valores separados
+    por comas): autos: marca, anio, disponible; cargas: dificultad_carga,
+    requiere_instalacion_domestica; estaciones: tipo_conector, operador, acceso_publico.
+    """
+    filtros = _parsear_filtros(entidad, request.query_params)
+    campos = list(_ESQUEMAS[entidad].model_fields)
+    tabla = snapshot_catalogo.tabla(db, entidad)
+    if tabla is not None:
+        datos = tabla.facetas(filtros, crud.FACETAS[entidad], campos, skip=skip, limit=limit)
+    else:
+        datos = crud.get_facetas(db, entidad, filtros, campos, skip=skip, limit=limit)
+    return formatos.responder(request, datos)
+
+
+# --------------------- FEED DE CAMBIOS ---------------------
+
+@app.get("/api/{entidad}/changes", tags=["Cambios"])
+async def read_cambios(
+        entidad: Literal["autos", "cargas", "estaciones"],
+        request: Request,
+        since: int = Query(0, ge=0, description="Token devuelto por la llamada anterior (0 = desde el inicio)"),
+        limit: int = Query(500, ge=1, le=5000),
+        db: Session = Depends(get_db)
+):
+    """Cambios (upserts y borrados) posteriores a `since`, para sincronizar réplicas del catálogo."""
+    return formatos.responder(request, crud.get_cambios(db, entidad, desde=since, limite=limit))
+
+
+# --------------------- REFRESCO EN SEGUNDO PLANO ---------------------
+
+# Entidades con un refresco ya encolado: varias escrituras seguidas encolan uno solo
+_refrescos_pendientes = set()
+
+
+@tareas.cola.registrar("refrescar_distribuciones", persistente=False)
+def _refrescar_distribuciones(entidad: str):
+    """
+    Una escritura descarta la instantánea de distribuciones de su entidad; se
+    vuelve a leer aquí para que la próxima petición de estadísticas no pague la
+    consulta. No se persiste: si se pierde, esa petición la lee como antes.
+    """
+    _refrescos_pendientes.discard(entidad)
+    with tareas.cola.session_factory() as db:
+        distribuciones.instantanea(db, entidad)
+
+
+async def _encolar_refresco(entidad: str):
+    if entidad in _refrescos_pendientes:
+        return
+    _refrescos_pendientes.add(entidad)
+    try:
+        await tareas.cola.encolar("refrescar_distribuciones", entidad=entidad)
+    except tareas.ColaLlena:
+        _refrescos_pendientes.discard(entidad)
+        logger.warning("Cola de tareas llena, sin refresco de distribuciones de %s", entidad)
+    except Exception as e:
+        # Sin cola iniciada el refresco corre en línea; la escritura ya está hecha
+        _refrescos_pendientes.discard(entidad)
+        logger.error("Error al refrescar distribuciones de %s: %s", entidad, e, exc_info=True)
+
+
 # --------------------- API ENDPOINTS AUTOS ---------------------
 
 @app.get("/api/autos", response_model=List[AutoElectricoConID], tags=["Autos"])
-async def read_autos(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return crud.get_autos(db, skip=skip, limit=limit)
+async def read_autos(
+        request: Request,
+        response: Response,
+        skip: int = 0,
+        limit: int = 100,
+        ids: Optional[str] = Query(None, description=_DESCRIPCION_IDS),
+        fields: Optional[str] = Query(None, description=_DESCRIPCION_FIELDS),
+        layout: Layout = Query("rows", description=_DESCRIPCION_LAYOUT),
+        db: Session = Depends(get_db)
+):
+    return _listar(db, "autos", request, response, skip, limit, ids, fields, layout, AutoElectricoConID, crud.get_autos)
 
 
 @app.get("/api/autos/search/", response_model=List[AutoElectricoConID], tags=["Autos"])
-async def search_autos(modelo: str, db: Session = Depends(get_db)):
-    autos = crud.get_auto_by_modelo(db, modelo)
+async def search_autos(
+        modelo: str,
+        fuzzy: bool = Query(False, description=_DESCRIPCION_FUZZY),
+        limit: int = Query(20, ge=1, le=100, description="Máximo de resultados con fuzzy=true"),
+        db: Session = Depends(get_db)
+):
+    autos = _buscar_aproximado(db, "autos", modelo, limit) if fuzzy else crud.get_auto_by_modelo(db, modelo)
     if not autos:
         raise HTTPException(status_code=404, detail="No se encontraron autos")
     return autos
@@ -519,18 +805,103 @@ async def search_autos(modelo: str, db: Session = Depends(get_db)):
 
 @app.get("/api/autos/{auto_id}", response_model=AutoElectricoConID, tags=["Autos"])
 async def read_auto(auto_id: int, db: Session = Depends(get_db)):
-    db_auto = crud.get_auto(db, auto_id=auto_id)
+    db_auto = _leer_uno(db, "autos", auto_id, crud.get_auto)
     if db_auto is None:
         raise HTTPException(status_code=404, detail="Auto no encontrado")
     return db_auto
 
 
+_CAMPOS_ESTACION_CARGA = ["nombre", "ubicacion", "tipo_conector", "potencia_kw", "coste_por_kwh"]
+
+
+@app.get("/api/autos/{auto_id}/estaciones", tags=["Autos"])
+async def read_estaciones_para_auto(
+        auto_id: int,
+        request: Request,
+        sort: Literal["cost", "time"] = Query("cost", description="cost (más barata) o time (más rápida)"),
+        k: int = Query(10, ge=1, le=100),
+        db: Session = Depends(get_db)
+):
+    """
+    Las k estaciones donde cargar el auto (del 10 % al 80 % por defecto) sale
+    más barato o más rápido, con el tiempo y el coste estimados (matriz_carga.py).
+    """
+    mejores = matriz_carga.mejores_estaciones(db, auto_id, k, "coste" if sort == "cost" else "tiempo")
+    if mejores is None:
+        raise HTTPException(status_code=404, detail="Auto no encontrado")
+    filas, _ = crud.get_por_ids(db, "estaciones", [m["estacion_id"] for m in mejores], campos=_CAMPOS_ESTACION_CARGA)
+    estaciones = {fila["id"]: fila for fila in filas}
+    resultados = [{**m, "estacion": estaciones[m["estacion_id"]]} for m in mejores if m["estacion_id"] in estaciones]
+    return formatos.responder(request, resultados)
+
+
+@app.get("/api/autos/{auto_id}/full", tags=["Autos"])
+async def read_auto_completo(auto_id: int, request: Request, db: Session = Depends(get_db)):
+    """
+    El auto, sus perfiles de carga (enlazados por cargas.auto_id) y un resumen
+    de las estaciones con conector compatible, con la más barata y la más
+    rápida. Auto y cargas salen de una sola consulta; el resumen, de matriz_carga.
+    """
+    completo = crud.get_auto_completo(db, auto_id, list(AutoElectricoConID.model_fields), list(CargaConID.model_fields))
+    if completo is None:
+        raise HTTPException(status_code=404, detail="Auto no encontrado")
+    conectores = matriz_carga.conectores_de_marca(completo["auto"]["marca"])
+    matriz = matriz_carga.matriz(db)
+    solo = {nombre: 0.0 for nombre in matriz_carga.PESOS_POR_DEFECTO}
+    mas_barata = matriz.recomendar(auto_id, 1, pesos={**solo, "coste": 1.0}, conectores=conectores)
+    mas_rapida = matriz.recomendar(auto_id, 1, pesos={**solo, "potencia": 1.0}, conectores=conectores)
+    completo["estaciones"] = {
+        "conectores": list(conectores),
+        **matriz.resumen_estaciones(conectores),
+        "mas_barata": mas_barata[0] if mas_barata else None,
+        "mas_rapida": mas_rapida[0] if mas_rapida else None,
+    }
+    return formatos.responder(request, completo)
+
+
+@app.get("/api/autos/{auto_id}/recommended_stations", tags=["Autos"])
+async def read_estaciones_recomendadas(
+        auto_id: int,
+        request: Request,
+        lat: Optional[float] = Query(None, ge=-90, le=90),
+        lon: Optional[float] = Query(None, ge=-180, le=180),
+        k: int = Query(10, ge=1, le=50),
+        w_cost: float = Query(matriz_carga.PESOS_POR_DEFECTO["coste"], ge=0),
+        w_power: float = Query(matriz_carga.PESOS_POR_DEFECTO["potencia"], ge=0),
+        w_distance: float = Query(matriz_carga.PESOS_POR_DEFECTO["distancia"], ge=0),
+        w_public: float = Query(matriz_carga.PESOS_POR_DEFECTO["publica"], ge=0),
+        connectors: Optional[str] = Query(None, description="Conectores aceptados separados por comas "
+                                                             "(por defecto, los de la marca del auto)"),
+        db: Session = Depends(get_db)
+):
+    """
+    Las k mejores estaciones para el auto según coste, potencia efectiva,
+    distancia a (lat, lon) y acceso público, con pesos ajustables, entre las
+    de conector compatible. Se puntúa en memoria (matriz_carga.recomendar).
+    """
+    if (lat is None) != (lon is None):
+        raise HTTPException(status_code=400, detail="lat y lon se indican juntos")
+    pesos = {"coste": w_cost, "potencia": w_power, "distancia": w_distance, "publica": w_public}
+    conectores = [c.strip() for c in connectors.split(",") if c.strip()] if connectors else None
+    recomendadas = matriz_carga.recomendar_estaciones(db, auto_id, k, latitud=lat, longitud=lon,
+                                                      pesos=pesos, conectores=conectores)
+    if recomendadas is None:
+        raise HTTPException(status_code=404, detail="Auto no encontrado")
+    filas, _ = crud.get_por_ids(db, "estaciones", [r["estacion_id"] for r in recomendadas],
+                                campos=_CAMPOS_ESTACION_CARGA + ["acceso_publico"])
+    estaciones = {fila["id"]: fila for fila in filas}
+    resultados = [{**r, "estacion": estaciones[r["estacion_id"]]} for r in recomendadas if r["estacion_id"] in estaciones]
+    return formatos.responder(request, resultados)
+
+
 @app.post("/api/autos", response_model=AutoElectricoConID, status_code=201, tags=["Autos"])
 async def create_auto_endpoint(auto: AutoElectrico, db: Session = Depends(get_db)):
     try:
-        return crud.create_auto(db, auto)
+        db_auto = crud.create_auto(db, auto)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    await _encolar_refresco("autos")
+    return db_auto
 
 
 @app.put("/api/autos/{auto_id}", response_model=AutoElectricoConID, tags=["Autos"])
@@ -538,6 +909,7 @@ async def update_auto_endpoint(auto_id: int, auto: AutoActualizado, db: Session
     db_auto = crud.update_auto(db, auto_id, auto)
     if db_auto is None:
         raise HTTPException(status_code=404, detail="Auto no encontrado")
+    await _encolar_refresco("autos")
     return db_auto
 
 
@@ -546,19 +918,34 @@ async def delete_auto_endpoint(auto_id: int, db: Session = Depends(get_db)):
     success = crud.delete_auto(db, auto_id)
     if not success:
         raise HTTPException(status_code=404, detail="Auto no encontrado")
+    await _encolar_refresco("autos")
     return Response(status_code=204)
 
 
 # --------------------- API ENDPOINTS CARGAS ---------------------
 
 @app.get("/api/cargas", response_model=List[CargaConID], tags=["Cargas"])
-async def read_cargas(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return crud.get_cargas(db, skip=skip, limit=limit)
+async def read_cargas(
+        request: Request,
+        response: Response,
+        skip: int = 0,
+        limit: int = 100,
+        ids: Optional[str] = Query(None, description=_DESCRIPCION_IDS),
+        fields: Optional[str] = Query(None, description=_DESCRIPCION_FIELDS),
+        layout: Layout = Query("rows", description=_DESCRIPCION_LAYOUT),
+        db: Session = Depends(get_db)
+):
+    return _listar(db, "cargas", request, response, skip, limit, ids, fields, layout, CargaConID, crud.get_cargas)
 
 
 @app.get("/api/cargas/search/", response_model=List[CargaConID], tags=["Cargas"])
-async def search_cargas(modelo_auto: str, db: Session = Depends(get_db)):
-    cargas = crud.get_carga_by_modelo(db, modelo_auto)
+async def search_cargas(
+        modelo_auto: str,
+        fuzzy: bool = Query(False, description=_DESCRIPCION_FUZZY),
+        limit: int = Query(20, ge=1, le=100, description="Máximo de resultados con fuzzy=true"),
+        db: Session = Depends(get_db)
+):
+    cargas = _buscar_aproximado(db, "cargas", modelo_auto, limit) if fuzzy else crud.get_carga_by_modelo(db, modelo_auto)
     if not cargas:
         raise HTTPException(status_code=404, detail="No se encontraron cargas")
     return cargas
@@ -566,7 +953,7 @@ async def search_cargas(modelo_auto: str, db: Session = Depends(get_db)):
 
 @app.get("/api/cargas/{carga_id}", response_model=CargaConID, tags=["Cargas"])
 async def read_carga(carga_id: int, db: Session = Depends(get_db)):
-    db_carga = crud.get_carga(db, carga_id=carga_id)
+    db_carga = _leer_uno(db, "cargas", carga_id, crud.get_carga)
     if db_carga is None:
         raise HTTPException(status_code=404, detail="Carga no encontrada")
     return db_carga
@@ -574,14 +961,24 @@ async def read_carga(carga_id: int, db: Session = Depends(get_db)):
 
 @app.post("/api/cargas", response_model=CargaConID, status_code=201, tags=["Cargas"])
 async def create_carga_endpoint(carga: CargaBase, db: Session = Depends(get_db)):
-    return crud.create_carga(db, carga)
+    _verificar_auto_de_carga(db, carga.auto_id)
+    db_carga = crud.create_carga(db, carga)
+    await _encolar_refresco("cargas")
+    return db_carga
+
+
+def _verificar_auto_de_carga(db: Session, auto_id: Optional[int]):
+    if auto_id is not None and crud.get_auto(db, auto_id) is None:
+        raise HTTPException(status_code=400, detail=f"El auto {auto_id} no existe")
 
 
 @app.put("/api/cargas/{carga_id}", response_model=CargaConID, tags=["Cargas"])
 async def update_carga_endpoint(carga_id: int, carga: CargaActualizada, db: Session = Depends(get_db)):
+    _verificar_auto_de_carga(db, carga.auto_id)
     db_carga = crud.update_carga(db, carga_id, carga)
     if db_carga is None:
         raise HTTPException(status_code=404, detail="Carga no encontrada")
+    await _encolar_refresco("cargas")
     return db_carga
 
 
@@ -590,19 +987,44 @@ async def delete_carga_endpoint(carga_id: int, db: Session = Depends(get_db)):
     success = crud.delete_carga(db, carga_id)
     if not success:
         raise HTTPException(status_code=404, detail="Carga no encontrada")
+    await _encolar_refresco("cargas")
     return Response(status_code=204)
 
 
 # --------------------- API ENDPOINTS ESTACIONES ---------------------
 
 @app.get("/api/estaciones", response_model=List[EstacionConID], tags=["Estaciones"])
-async def read_estaciones(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return crud.get_estaciones(db, skip=skip, limit=limit)
+async def read_estaciones(
+        request: Request,
+        response: Response,
+        skip: int = 0,
+        limit: int = 100,
+        ids: Optional[str] = Query(None, description=_DESCRIPCION_IDS),
+        fields: Optional[str] = Query(None, description=_DESCRIPCION_FIELDS),
+        layout: Layout = Query("rows", description=_DESCRIPCION_LAYOUT),
+        open_at: Optional[str] = Query(None, description=_DESCRIPCION_OPEN_AT),
+        db: Session = Depends(get_db)
+):
+    minuto = _minuto_open_at(open_at)
+    condiciones = [crud.abierta_en(minuto)] if minuto is not None else []
+    return _listar(db, "estaciones", request, response, skip, limit, ids, fields, layout, EstacionConID,
+                   partial(crud.get_estaciones, condiciones=condiciones), condiciones)
 
 
 @app.get("/api/estaciones/search/", response_model=List[EstacionConID], tags=["Estaciones"])
-async def search_estaciones(nombre: str, db: Session = Depends(get_db)):
-    estaciones = crud.get_estacion_by_nombre(db, nombre)
+async def search_estaciones(
+        nombre: str,
+        fuzzy: bool = Query(False, description=_DESCRIPCION_FUZZY),
+        limit: int = Query(20, ge=1, le=100, description="Máximo de resultados con fuzzy=true"),
+        open_at: Optional[str] = Query(None, description=_DESCRIPCION_OPEN_AT),
+        db: Session = Depends(get_db)
+):
+    minuto = _minuto_open_at(open_at)
+    condiciones = [crud.abierta_en(minuto)] if minuto is not None else []
+    if fuzzy:
+        estaciones = _buscar_aproximado(db, "estaciones", nombre, limit, condiciones)
+    else:
+        estaciones = crud.get_estacion_by_nombre(db, nombre, condiciones)
     if not estaciones:
         raise HTTPException(status_code=404, detail="No se encontraron estaciones")
     return estaciones
@@ -610,7 +1032,7 @@ async def search_estaciones(nombre: str, db: Session = Depends(get_db)):
 
 @app.get("/api/estaciones/{estacion_id}", response_model=EstacionConID, tags=["Estaciones"])
 async def read_estacion(estacion_id: int, db: Session = Depends(get_db)):
-    db_estacion = crud.get_estacion(db, estacion_id=estacion_id)
+    db_estacion = _leer_uno(db, "estaciones", estacion_id, crud.get_estacion)
     if db_estacion is None:
         raise HTTPException(status_code=404, detail="Estación no encontrada")
     return db_estacion
@@ -618,7 +1040,9 @@ async def read_estacion(estacion_id: int, db: Session = Depends(get_db)):
 
 @app.post("/api/estaciones", response_model=EstacionConID, status_code=201, tags=["Estaciones"])
 async def create_estacion_endpoint(estacion: EstacionBase, db: Session = Depends(get_db)):
-    return crud.create_estacion(db, estacion)
+    db_estacion = crud.create_estacion(db, estacion)
+    await _encolar_refresco("estaciones")
+    return db_estacion
 
 
 @app.put("/api/estaciones/{estacion_id}", response_model=EstacionConID, tags=["Estaciones"])
@@ -626,6 +1050,7 @@ async def update_estacion_endpoint(estacion_id: int, estacion: EstacionActualiza
     db_estacion = crud.update_estacion(db, estacion_id, estacion)
     if db_estacion is None:
         raise HTTPException(status_code=404, detail="Estación no encontrada")
+    await _encolar_refresco("estaciones")
     return db_estacion
 
 
@@ -634,6 +1059,7 @@ async def delete_estacion_endpoint(estacion_id: int, db: Session = Depends(get_d
     success = crud.delete_estacion(db, estacion_id)
     if not success:
         raise HTTPException(status_code=404, detail="Estación no encontrada")
+    await _encolar_refresco("estaciones")
     return Response(status_code=204)
 
 
@@ -657,6 +1083,7 @@ async def upload_image(file: UploadFile = File(...)):
         unique_filename = f"{uuid.uuid4()}{suffix}"
         file_path = UPLOAD_DIRECTORY / unique_filename
 
+        # La URL solo se devuelve con el archivo ya escrito
         with open(file_path, "wb") as f:
             f.write(buffer)
 
@@ -665,43 +1092,148 @@ async def upload_image(file: UploadFile = File(...)):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error al subir imagen: {e}", exc_info=True)
+        logger.error("Error al subir imagen: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 
 # --------------------- ESTADÍSTICAS ---------------------
 
 @app.get("/api/statistics/cars_by_brand", tags=["Estadísticas"])
-async def get_cars_by_brand_stats(db: Session = Depends(get_db)):
-    stats = db.query(
+async def get_cars_by_brand_stats(
+        request: Request,
+        layout: Layout = Query("rows", description=_DESCRIPCION_LAYOUT),
+        db: Session = Depends(get_db)
+):
+    tabla = snapshot_catalogo.tabla(db, "autos")
+    stats = tabla.conteos("marca") if tabla is not None else db.query(
         models_sql.AutoElectricoSQL.marca,
         func.count(models_sql.AutoElectricoSQL.id)
     ).group_by(models_sql.AutoElectricoSQL.marca).all()
-    return [{"marca": brand, "count": count} for brand, count in stats]
+    datos = [{"marca": brand, "count": count} for brand, count in stats]
+    return formatos.responder(request, datos, columnas=layout == "columns")
 
 
 @app.get("/api/statistics/station_power_by_connector_type", tags=["Estadísticas"])
-async def get_station_power_by_connector_type_stats(db: Session = Depends(get_db)):
-    stats = db.query(
+async def get_station_power_by_connector_type_stats(
+        request: Request,
+        layout: Layout = Query("rows", description=_DESCRIPCION_LAYOUT),
+        db: Session = Depends(get_db)
+):
+    tabla = snapshot_catalogo.tabla(db, "estaciones")
+    stats = tabla.medias("tipo_conector", "potencia_kw") if tabla is not None else db.query(
         models_sql.EstacionSQL.tipo_conector,
         func.avg(models_sql.EstacionSQL.potencia_kw)
     ).group_by(models_sql.EstacionSQL.tipo_conector).all()
-    return [
+    datos = [
         {"tipo_conector": ct, "avg_potencia_kw": round(ap, 2) if ap else 0}
         for ct, ap in stats
     ]
+    return formatos.responder(request, datos, columnas=layout == "columns")
 
 
 @app.get("/api/statistics/charge_difficulty_distribution", tags=["Estadísticas"])
-async def get_charge_difficulty_distribution(db: Session = Depends(get_db)):
-    stats = db.query(
+async def get_charge_difficulty_distribution(
+        request: Request,
+        layout: Layout = Query("rows", description=_DESCRIPCION_LAYOUT),
+        db: Session = Depends(get_db)
+):
+    tabla = snapshot_catalogo.tabla(db, "cargas")
+    stats = tabla.conteos("dificultad_carga") if tabla is not None else db.query(
         models_sql.CargaSQL.dificultad_carga,
         func.count(models_sql.CargaSQL.id)
     ).group_by(models_sql.CargaSQL.dificultad_carga).all()
-    return [
+    datos = [
         {"dificultad": diff.capitalize(), "count": count}
         for diff, count in stats
     ]
+    return formatos.responder(request, datos, columnas=layout == "columns")
+
+
+@app.get("/api/statistics/distribution", tags=["Estadísticas"])
+async def get_distribution_stats(
+        entity: Literal["autos", "cargas", "estaciones"],
+        field: str,
+        request: Request,
+        bins: int = Query(20, ge=1, le=200),
+        percentiles: str = Query("5,25,50,75,95", description="Percentiles separados por comas (0-100)"),
+        db: Session = Depends(get_db)
+):
+    """Histograma, percentiles y resumen de una columna numérica (ver distribuciones.py)."""
+    if field not in distribuciones.CAMPOS_NUMERICOS[entity]:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Campo no válido para {entity}. Disponibles: {', '.join(distribuciones.CAMPOS_NUMERICOS[entity])}",
+        )
+    try:
+        lista = [float(p) for p in percentiles.split(",") if p.strip()]
+    except ValueError:
+        lista = []
+    if not lista or any(not 0 <= p <= 100 for p in lista):
+        raise HTTPException(status_code=400, detail="percentiles debe ser una lista de números entre 0 y 100")
+    return formatos.responder(request, distribuciones.get_distribucion(db, entity, field, bins, lista))
+
+
+# --------------------- EVENTOS EN VIVO (SSE) ---------------------
+
+EVENTOS_HEARTBEAT_SECONDS = float(os.getenv("EVENTOS_HEARTBEAT_SECONDS", "15"))
+
+
+@app.get("/api/eventos", tags=["Eventos"])
+async def stream_eventos(
+        request: Request,
+        entidades: Optional[str] = None,
+        last_event_id: Optional[int] = Header(None)
+):
+    """
+    Server-Sent Events con los cambios del catálogo (create/update/delete por fila).
+    `entidades` filtra por autos, cargas y/o estaciones (separadas por comas).
+    Un evento 'reset' indica que el cliente debe recargar la lista completa.
+    """
+    filtro = [e.strip() for e in entidades.split(",") if e.strip()] if entidades else []
+    desconocidas = set(filtro) - set(eventos.ENTIDADES)
+    if desconocidas:
+        raise HTTPException(status_code=400, detail=f"Entidades desconocidas: {', '.join(sorted(desconocidas))}")
+
+    suscriptor = eventos.bus.suscribir(filtro, desde=last_event_id)
+
+    async def flujo():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                lote = await suscriptor.siguientes(EVENTOS_HEARTBEAT_SECONDS)
+                if not lote:
+                    # Comentario SSE: mantiene viva la conexión a través de proxies
+                    yield ": ping\n\n"
+                    continue
+                yield "".join(evento.sse() for evento in lote)
+        finally:
+            eventos.bus.cancelar(suscriptor)
+
+    return StreamingResponse(
+        flujo(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# --------------------- MONITOREO ---------------------
+
+@app.get("/api/monitoreo/sql", tags=["Monitoreo"])
+async def get_sql_stats(top: int = 10):
+    """Consultas por ruta, tiempo en DB y sentencias más lentas desde el arranque."""
+    return monitoreo_sql.resumen(top)
+
+
+@app.get("/api/monitoreo/tareas", tags=["Monitoreo"])
+async def get_estado_tareas():
+    """Estado de la cola de tareas en segundo plano."""
+    return tareas.cola.estado()
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Métricas en formato de texto de Prometheus."""
+    return PlainTextResponse(metricas.exponer(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 # --------------------- HEALTH CHECK ---------------------
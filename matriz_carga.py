@@ -0,0 +1,482 @@
+"""
+matriz_carga.py - Tiempo y coste de cargar cada auto en cada estación
+
+Para un auto y una estación:
+
+- energía = capacidad_bateria_kwh × FRACCION_CARGA (por defecto del 10 % al 80 %)
+- potencia = potencia_kw de la estación; en estaciones AC (≤ POTENCIA_AC_MAX_KW)
+  se limita a la potencia AC del auto, que se deduce de sus cargas
+  (capacidad / tiempo_carga_horas de las cargas con ese auto_id) cuando existen
+- tiempo = energía / (potencia × EFICIENCIA_CARGA)
+- coste = energía / EFICIENCIA_CARGA × coste_por_kwh (lo que se factura de la red)
+
+Autos y estaciones se guardan en memoria como columnas NumPy y la matriz
+autos × estaciones se calcula por difusión (broadcasting) en bloques de filas,
+sin materializarla entera (10k × 50k serían 4 GB en float64). El top-k de un
+auto es una fila y np.argpartition.
+
+recomendar() puntúa las estaciones para un auto y una ubicación combinando
+coste, potencia efectiva, distancia y acceso público con pesos elegidos por
+el cliente, sobre las estaciones con un conector compatible. El catálogo no
+guarda el conector de cada auto, así que la compatibilidad es una heurística
+por marca (CONECTORES_POR_MARCA): solo Tesla y Nissan tienen entrada propia y
+cualquier otra marca se supone CCS / Tipo 2 (CONECTORES_POR_DEFECTO). Un auto
+con CHAdeMO o Tipo 1 de otra marca, o un Tesla sin adaptador CCS, recibe
+recomendaciones equivocadas; el parámetro connectors= de la petición la
+sustituye.
+
+Los rasgos de cada estación (conector codificado, coordenadas en radianes...)
+están precalculados en las mismas columnas. Las columnas se construyen con
+una consulta por tabla y después se mantienen con los eventos de crud
+(eventos.py); cada MATRIZ_TTL_SEGUNDOS se reconstruyen para recoger
+escrituras de otros workers.
+"""
+
+import os
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import eventos
+import models_sql
+from busqueda import normalizar
+
+MATRIZ_TTL_SEGUNDOS = float(os.getenv("MATRIZ_TTL_SEGUNDOS", "300"))
+FRACCION_CARGA = float(os.getenv("FRACCION_CARGA", "0.7"))
+EFICIENCIA_CARGA = float(os.getenv("EFICIENCIA_CARGA", "0.9"))
+POTENCIA_AC_MAX_KW = 22.0
+# Elementos (autos × estaciones) por bloque al recorrer la matriz completa
+ELEMENTOS_POR_BLOQUE = 4_000_000
+# Resultados top-k que se guardan entre cambios
+MAX_RESULTADOS_GUARDADOS = 10000
+
+CRITERIOS = ("coste", "tiempo")
+
+# Heurística por marca, no datos del auto (ver el docstring del módulo)
+CONECTORES_POR_MARCA = {
+    "tesla": ("Tesla", "CCS", "Tipo 2"),
+    "nissan": ("CHAdeMO", "Tipo 1", "Tipo 2"),
+}
+CONECTORES_POR_DEFECTO = ("CCS", "Tipo 2")
+PESOS_POR_DEFECTO = {"coste": 0.4, "potencia": 0.2, "distancia": 0.3, "publica": 0.1}
+# A esta distancia la puntuación por cercanía vale la mitad
+DISTANCIA_REFERENCIA_KM = float(os.getenv("DISTANCIA_REFERENCIA_KM", "10"))
+RADIO_TIERRA_KM = 6371.0
+
+# Conectores de las estaciones cargadas -> código; solo crece con los datos
+_codigos_conector: Dict[str, int] = {}
+_lock_codigos = threading.Lock()
+
+
+class _Columnas:
+    """
+    Filas por id guardadas como arrays NumPy paralelos, con altas al final
+    (capacidad que se duplica) y bajas intercambiando con la última fila.
+    """
+
+    def __init__(self, nombres: Iterable[str]):
+        self.nombres = tuple(nombres)
+        self.ids = np.empty(0, dtype=np.int64)
+        self.valores = {nombre: np.empty(0, dtype=np.float64) for nombre in self.nombres}
+        self.posicion: Dict[int, int] = {}
+        self.n = 0
+
+    def cargar(self, ids: List[int], columnas: Dict[str, List[float]]):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.valores = {nombre: np.asarray(columnas[nombre], dtype=np.float64) for nombre in self.nombres}
+        self.posicion = {id: i for i, id in enumerate(ids)}
+        self.n = len(ids)
+
+    def _crecer(self):
+        capacidad = max(2 * len(self.ids), 16)
+        self.ids = np.resize(self.ids, capacidad)
+        self.valores = {nombre: np.resize(v, capacidad) for nombre, v in self.valores.items()}
+
+    def upsert(self, id: int, **valores: float):
+        i = self.posicion.get(id)
+        if i is None:
+            if self.n == len(self.ids):
+                self._crecer()
+            i = self.posicion[id] = self.n
+            self.ids[i] = id
+            self.n += 1
+        for nombre, valor in valores.items():
+            self.valores[nombre][i] = valor
+
+    def eliminar(self, id: int):
+        i = self.posicion.pop(id, None)
+        if i is None:
+            return
+        ultima = self.n - 1
+        if i != ultima:
+            self.ids[i] = self.ids[ultima]
+            for v in self.valores.values():
+                v[i] = v[ultima]
+            self.posicion[int(self.ids[i])] = i
+        self.n = ultima
+
+    def __getitem__(self, nombre: str) -> np.ndarray:
+        return self.valores[nombre][:self.n]
+
+    def vigentes(self) -> np.ndarray:
+        return self.ids[:self.n]
+
+
+def _potencia_ac(capacidad: Optional[float], tiempo: Optional[float]) -> float:
+    return capacidad / tiempo if capacidad and tiempo else np.inf
+
+
+def codigo_conector(tipo: str) -> int:
+    """Código del conector de una estación; registra los nuevos."""
+    clave = normalizar(tipo)
+    codigo = _codigos_conector.get(clave)
+    if codigo is None:
+        with _lock_codigos:
+            codigo = _codigos_conector.setdefault(clave, len(_codigos_conector))
+    return codigo
+
+
+def codigo_conocido(tipo: str) -> Optional[int]:
+    """Código de un conector pedido en una consulta; None si ninguna estación lo tiene."""
+    return _codigos_conector.get(normalizar(tipo))
+
+
+def conectores_de_marca(marca: str) -> Tuple[str, ...]:
+    return CONECTORES_POR_MARCA.get(normalizar(marca), CONECTORES_POR_DEFECTO)
+
+
+def _rasgos_estacion(estacion) -> dict:
+    """Columnas precalculadas de una estación (fila o datos de un evento)."""
+    latitud, longitud = estacion.get("latitud"), estacion.get("longitud")
+    con_coordenadas = latitud is not None and longitud is not None
+    return {
+        "potencia": estacion["potencia_kw"],
+        "coste_kwh": estacion["coste_por_kwh"],
+        "conector": codigo_conector(estacion["tipo_conector"]),
+        "publica": 1.0 if estacion["acceso_publico"] else 0.0,
+        "latitud_rad": np.radians(latitud) if con_coordenadas else np.nan,
+        "longitud_rad": np.radians(longitud) if con_coordenadas else np.nan,
+    }
+
+
+def distancias_km(latitud: float, longitud: float, latitudes_rad: np.ndarray, longitudes_rad: np.ndarray) -> np.ndarray:
+    """Haversine de un punto a cada estación (NaN sin coordenadas)."""
+    lat, lon = np.radians(latitud), np.radians(longitud)
+    a = (np.sin((latitudes_rad - lat) / 2) ** 2
+         + np.cos(lat) * np.cos(latitudes_rad) * np.sin((longitudes_rad - lon) / 2) ** 2)
+    return 2 * RADIO_TIERRA_KM * np.arcsin(np.sqrt(a))
+
+
+def distancias_aproximadas_km(latitud: float, longitud: float, latitudes_rad: np.ndarray,
+                              longitudes_rad: np.ndarray) -> np.ndarray:
+    """
+    Proyección equirectangular: sin trigonometría por estación y con un error
+    por debajo del 1 % a escala de país, suficiente para ordenar. Las
+    distancias que se devuelven se recalculan con distancias_km.
+    """
+    lat, lon = np.radians(latitud), np.radians(longitud)
+    # En el sitio en vez de np.hypot (unas 3 veces más rápido)
+    x = longitudes_rad - lon
+    x *= np.cos(lat)
+    y = latitudes_rad - lat
+    x *= x
+    y *= y
+    x += y
+    np.sqrt(x, out=x)
+    x *= RADIO_TIERRA_KM
+    return x
+
+
+def calcular(capacidad: np.ndarray, potencia_ac: np.ndarray, potencia: np.ndarray,
+             coste_kwh: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Tiempo (horas) y coste de cada auto (filas: capacidad, potencia AC) en
+    cada estación (columnas: potencia, coste por kWh), por difusión.
+    """
+    potencia = potencia[None, :]
+    efectiva = np.where(potencia <= POTENCIA_AC_MAX_KW, np.minimum(potencia, potencia_ac[:, None]), potencia)
+    energia = (capacidad * FRACCION_CARGA)[:, None]
+    with np.errstate(divide="ignore"):
+        tiempo = energia / (efectiva * EFICIENCIA_CARGA)
+    coste = energia / EFICIENCIA_CARGA * coste_kwh[None, :]
+    return tiempo, coste
+
+
+class MatrizCarga:
+
+    def __init__(self):
+        self.autos = _Columnas(("capacidad", "potencia_ac"))
+        self.estaciones = _Columnas(("potencia", "coste_kwh", "conector", "publica", "latitud_rad", "longitud_rad"))
+        # Para recalcular la potencia AC cuando cambian las cargas de un auto (cargas.auto_id)
+        self._marca_auto: Dict[int, str] = {}
+        self._cargas: Dict[int, Dict[int, float]] = {}
+        self._auto_carga: Dict[int, int] = {}
+        self._top: Dict[Tuple[int, str, int], list] = {}
+        self._lock = threading.RLock()
+
+    # ---- mantenimiento ----
+
+    def _tiempo_auto(self, auto_id: int) -> Optional[float]:
+        tiempos = self._cargas.get(auto_id)
+        return min(tiempos.values()) if tiempos else None
+
+    def cargar(self, autos: Iterable[dict], cargas: Iterable[dict], estaciones: Iterable[dict]):
+        """Construcción inicial a partir de filas (id + columnas usadas)."""
+        cargas_por_auto, auto_carga = {}, {}
+        for carga in cargas:
+            if carga["auto_id"] is not None:
+                cargas_por_auto.setdefault(carga["auto_id"], {})[carga["id"]] = carga["tiempo_carga_horas"]
+                auto_carga[carga["id"]] = carga["auto_id"]
+        tiempos = {auto_id: min(t.values()) for auto_id, t in cargas_por_auto.items()}
+
+        ids, capacidades, potencias, marca_auto = [], [], [], {}
+        for auto in autos:
+            ids.append(auto["id"])
+            capacidades.append(auto["capacidad_bateria_kwh"])
+            potencias.append(_potencia_ac(auto["capacidad_bateria_kwh"], tiempos.get(auto["id"])))
+            marca_auto[auto["id"]] = auto["marca"]
+        columnas_autos = _Columnas(self.autos.nombres)
+        columnas_autos.cargar(ids, {"capacidad": capacidades, "potencia_ac": potencias})
+
+        ids, rasgos = [], {nombre: [] for nombre in self.estaciones.nombres}
+        for estacion in estaciones:
+            ids.append(estacion["id"])
+            for nombre, valor in _rasgos_estacion(estacion).items():
+                rasgos[nombre].append(valor)
+        columnas_estaciones = _Columnas(self.estaciones.nombres)
+        columnas_estaciones.cargar(ids, rasgos)
+
+        with self._lock:
+            self.autos, self.estaciones = columnas_autos, columnas_estaciones
+            self._marca_auto = marca_auto
+            self._cargas, self._auto_carga = cargas_por_auto, auto_carga
+            self._top.clear()
+
+    def _recalcular_auto(self, auto_id: int):
+        i = self.autos.posicion.get(auto_id)
+        if i is not None:
+            tiempo = self._tiempo_auto(auto_id)
+            self.autos.valores["potencia_ac"][i] = _potencia_ac(self.autos.valores["capacidad"][i], tiempo)
+            self._olvidar_auto(auto_id)
+
+    def _olvidar_auto(self, auto_id: int):
+        for clave in [c for c in self._top if c[0] == auto_id]:
+            del self._top[clave]
+
+    def aplicar(self, evento):
+        """Actualiza solo la fila afectada por un evento de crud."""
+        with self._lock:
+            if evento.entidad == "estaciones":
+                if evento.accion == "delete":
+                    self.estaciones.eliminar(evento.id)
+                elif evento.datos is not None:
+                    self.estaciones.upsert(evento.id, **_rasgos_estacion(evento.datos))
+                # Una estación puede entrar o salir del top-k de cualquier auto
+                self._top.clear()
+            elif evento.entidad == "autos":
+                self._olvidar_auto(evento.id)
+                if evento.accion == "delete":
+                    self.autos.eliminar(evento.id)
+                    self._marca_auto.pop(evento.id, None)
+                    # Sus cargas quedan con auto_id NULL (ON DELETE SET NULL)
+                    for carga_id in self._cargas.pop(evento.id, {}):
+                        self._auto_carga.pop(carga_id, None)
+                elif evento.datos is not None:
+                    capacidad = evento.datos["capacidad_bateria_kwh"]
+                    self.autos.upsert(evento.id, capacidad=capacidad,
+                                      potencia_ac=_potencia_ac(capacidad, self._tiempo_auto(evento.id)))
+                    self._marca_auto[evento.id] = evento.datos["marca"]
+            elif evento.entidad == "cargas":
+                afectados = set()
+                anterior = self._auto_carga.pop(evento.id, None)
+                if anterior is not None:
+                    self._cargas.get(anterior, {}).pop(evento.id, None)
+                    afectados.add(anterior)
+                auto_id = evento.datos.get("auto_id") if evento.datos is not None else None
+                if evento.accion != "delete" and auto_id is not None:
+                    self._cargas.setdefault(auto_id, {})[evento.id] = evento.datos["tiempo_carga_horas"]
+                    self._auto_carga[evento.id] = auto_id
+                    afectados.add(auto_id)
+                for auto_id in afectados:
+                    self._recalcular_auto(auto_id)
+
+    # ---- cálculo ----
+
+    def bloques(self, filas_por_bloque: Optional[int] = None) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Recorre la matriz completa por bloques de autos: (ids_autos, tiempo,
+        coste), con las columnas de estaciones en el orden de ids_estaciones().
+        Trabaja sobre una copia, así los eventos no esperan a que termine.
+        """
+        with self._lock:
+            ids = self.autos.vigentes().copy()
+            capacidad, potencia_ac = self.autos["capacidad"].copy(), self.autos["potencia_ac"].copy()
+            potencia, coste_kwh = self.estaciones["potencia"].copy(), self.estaciones["coste_kwh"].copy()
+        filas = filas_por_bloque or max(ELEMENTOS_POR_BLOQUE // max(len(potencia), 1), 1)
+        for inicio in range(0, len(ids), filas):
+            fin = inicio + filas
+            yield (ids[inicio:fin], *calcular(capacidad[inicio:fin], potencia_ac[inicio:fin], potencia, coste_kwh))
+
+    def ids_estaciones(self) -> np.ndarray:
+        with self._lock:
+            return self.estaciones.vigentes().copy()
+
+    def mejores(self, auto_id: int, k: int = 10, criterio: str = "coste") -> Optional[List[dict]]:
+        """
+        Las k estaciones más baratas o rápidas para el auto, ordenadas (None si
+        el auto no existe). El resultado se guarda hasta el próximo cambio.
+        """
+        clave = (auto_id, criterio, k)
+        with self._lock:
+            if clave in self._top:
+                return self._top[clave]
+            i = self.autos.posicion.get(auto_id)
+            if i is None:
+                return None
+            tiempo, coste = calcular(self.autos["capacidad"][i:i + 1], self.autos["potencia_ac"][i:i + 1],
+                                     self.estaciones["potencia"], self.estaciones["coste_kwh"])
+            tiempo, coste = tiempo[0], coste[0]
+            orden = coste if criterio == "coste" else tiempo
+            k_real = min(k, len(orden))
+            candidatos = np.argpartition(orden, k_real - 1)[:k_real] if k_real else np.empty(0, dtype=np.int64)
+            candidatos = candidatos[np.lexsort((tiempo[candidatos] if criterio == "coste" else coste[candidatos],
+                                                orden[candidatos]))]
+            energia = float(self.autos["capacidad"][i] * FRACCION_CARGA)
+            ids = self.estaciones.vigentes()
+            resultado = [
+                {"estacion_id": int(ids[j]), "energia_kwh": round(energia, 2),
+                 "tiempo_horas": round(float(tiempo[j]), 3), "coste": round(float(coste[j]), 2)}
+                for j in candidatos
+            ]
+            if len(self._top) >= MAX_RESULTADOS_GUARDADOS:
+                self._top.clear()
+            self._top[clave] = resultado
+            return resultado
+
+    def resumen_estaciones(self, conectores: Iterable[str]) -> dict:
+        """Estaciones por conector: cuántas, cuántas públicas, potencia máxima y coste mínimo por kWh."""
+        por_conector = []
+        with self._lock:
+            codigos = self.estaciones["conector"]
+            for tipo in conectores:
+                codigo = codigo_conocido(tipo)
+                mascara = codigos == codigo if codigo is not None else np.zeros(len(codigos), dtype=bool)
+                n = int(mascara.sum())
+                por_conector.append({
+                    "tipo_conector": tipo,
+                    "estaciones": n,
+                    "publicas": int(self.estaciones["publica"][mascara].sum()),
+                    "potencia_max_kw": float(self.estaciones["potencia"][mascara].max()) if n else None,
+                    "coste_min_kwh": float(self.estaciones["coste_kwh"][mascara].min()) if n else None,
+                })
+        return {"total": sum(c["estaciones"] for c in por_conector), "por_conector": por_conector}
+
+    def recomendar(self, auto_id: int, k: int = 10, latitud: Optional[float] = None,
+                   longitud: Optional[float] = None, pesos: Optional[Dict[str, float]] = None,
+                   conectores: Optional[Iterable[str]] = None) -> Optional[List[dict]]:
+        """
+        Las k estaciones con mejor puntuación para el auto (None si no existe).
+        Cada rasgo se lleva a [0, 1] (1 = mejor) y se suma con su peso:
+
+        - coste: (máx - coste) / (máx - mín) entre las compatibles
+        - potencia: potencia efectiva / la máxima (tiempo mínimo / tiempo)
+        - distancia: 1 / (1 + d / DISTANCIA_REFERENCIA_KM); 0 sin coordenadas
+          (si no se da ubicación el peso de la distancia no cuenta)
+        - publica: 1 si la estación es de acceso público
+
+        Solo entran las estaciones con un conector de `conectores` (por
+        defecto, los de la marca del auto).
+        """
+        pesos = {**PESOS_POR_DEFECTO, **(pesos or {})}
+        with self._lock:
+            i = self.autos.posicion.get(auto_id)
+            if i is None:
+                return None
+            conectores = tuple(conectores) if conectores else conectores_de_marca(self._marca_auto[auto_id])
+            tiempo, coste = calcular(self.autos["capacidad"][i:i + 1], self.autos["potencia_ac"][i:i + 1],
+                                     self.estaciones["potencia"], self.estaciones["coste_kwh"])
+            tiempo, coste = tiempo[0], coste[0]
+            # Tabla código de conector -> aceptado, en vez de np.isin
+            aceptados = np.zeros(len(_codigos_conector), dtype=bool)
+            aceptados[[c for c in map(codigo_conocido, conectores) if c is not None]] = True
+            compatibles = aceptados[self.estaciones["conector"].astype(np.intp)]
+            posiciones = np.flatnonzero(compatibles & np.isfinite(tiempo))
+            # Subconjuntos con indexado avanzado: copias, los eventos pueden seguir
+            ids = self.estaciones.vigentes()[posiciones]
+            publica = self.estaciones["publica"][posiciones]
+            latitudes = self.estaciones["latitud_rad"][posiciones]
+            longitudes = self.estaciones["longitud_rad"][posiciones]
+        if not len(posiciones):
+            return []
+
+        con_ubicacion = latitud is not None and longitud is not None
+        if con_ubicacion:
+            distancia = distancias_aproximadas_km(latitud, longitud, latitudes, longitudes)
+        else:
+            pesos["distancia"] = 0.0
+            distancia = np.full(len(posiciones), np.nan)
+        coste, tiempo = coste[posiciones], tiempo[posiciones]
+        rango = coste.max() - coste.min()
+        rasgos = {
+            "coste": (coste.max() - coste) / rango if rango > 0 else np.ones(len(posiciones)),
+            "potencia": tiempo.min() / tiempo,
+            "distancia": np.nan_to_num(1 / (1 + distancia / DISTANCIA_REFERENCIA_KM), nan=0.0),
+            "publica": publica,
+        }
+        puntaje = sum(pesos[nombre] * valores for nombre, valores in rasgos.items())
+
+        k_real = min(k, len(posiciones))
+        mejores = np.argpartition(-puntaje, k_real - 1)[:k_real]
+        mejores = mejores[np.argsort(-puntaje[mejores], kind="stable")]
+        if con_ubicacion:
+            distancia[mejores] = distancias_km(latitud, longitud, latitudes[mejores], longitudes[mejores])
+        return [
+            {"estacion_id": int(ids[j]), "puntaje": round(float(puntaje[j]), 4),
+             "distancia_km": None if np.isnan(distancia[j]) else round(float(distancia[j]), 2),
+             "tiempo_horas": round(float(tiempo[j]), 3), "coste": round(float(coste[j]), 2),
+             "rasgos": {nombre: round(float(valores[j]), 4) for nombre, valores in rasgos.items()}}
+            for j in mejores
+        ]
+
+
+# --------------------- Matriz de la aplicación ---------------------
+
+def _construir(clave, db: Session) -> MatrizCarga:
+    nueva = MatrizCarga()
+    autos = models_sql.AutoElectricoSQL.__table__
+    cargas = models_sql.CargaSQL.__table__
+    estaciones = models_sql.EstacionSQL.__table__
+    nueva.cargar(
+        db.execute(select(autos.c.id, autos.c.marca, autos.c.capacidad_bateria_kwh)).mappings(),
+        db.execute(select(cargas.c.id, cargas.c.auto_id, cargas.c.tiempo_carga_horas)).mappings(),
+        db.execute(select(estaciones.c.id, estaciones.c.potencia_kw, estaciones.c.coste_por_kwh,
+                          estaciones.c.tipo_conector, estaciones.c.acceso_publico,
+                          estaciones.c.latitud, estaciones.c.longitud)).mappings(),
+    )
+    return nueva
+
+
+# Una sola matriz (clave None) que depende de las tres entidades
+_matriz = eventos.CacheEventos("matriz_carga", _construir, MatrizCarga.aplicar, ttl=MATRIZ_TTL_SEGUNDOS,
+                               entidades=lambda clave: eventos.ENTIDADES)
+
+
+def matriz(db: Session) -> MatrizCarga:
+    """Matriz de la aplicación; la construye si no existe o caducó."""
+    return _matriz.obtener(None, db)
+
+
+def mejores_estaciones(db: Session, auto_id: int, k: int = 10, criterio: str = "coste") -> Optional[List[dict]]:
+    return matriz(db).mejores(auto_id, k, criterio)
+
+
+def recomendar_estaciones(db: Session, auto_id: int, k: int = 10, **opciones) -> Optional[List[dict]]:
+    return matriz(db).recomendar(auto_id, k, **opciones)
+
+
+def invalidar():
+    """Descarta la matriz para reconstruirla en la próxima consulta."""
+    _matriz.invalidar()
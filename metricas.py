@@ -0,0 +1,246 @@
+"""
+metricas.py - Métricas de la aplicación en formato de texto de Prometheus
+
+Contadores, medidores e histogramas mínimos (sin dependencias externas) y el
+middleware ASGI que mide cada petición: conteo por ruta, latencia, peticiones
+en curso, tamaño de respuesta y consultas SQL. También recoge la espera por
+conexiones del pool de la base de datos y los aciertos de las cachés.
+"""
+
+import time
+import threading
+from bisect import bisect_left
+
+import monitoreo_sql
+
+# Buckets por defecto (segundos), similares a los del cliente oficial
+BUCKETS_LATENCIA = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_BYTES = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+BUCKETS_CONSULTAS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _formatear_etiquetas(nombres, valores, extra=""):
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _formatear_numero(valor) -> str:
+    if valor == float("inf"):
+        return "+Inf"
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return repr(valor) if isinstance(valor, float) else str(valor)
+
+
+class _Metrica:
+    tipo = ""
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._lock = threading.Lock()
+        self._valores = {}
+
+    def reiniciar(self):
+        with self._lock:
+            self._valores = {}
+
+    def _cabecera(self):
+        return [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+
+
+class Contador(_Metrica):
+    """Valor que solo crece. Las etiquetas se pasan en orden posicional."""
+    tipo = "counter"
+
+    def inc(self, *etiquetas, valor: float = 1):
+        with self._lock:
+            self._valores[etiquetas] = self._valores.get(etiquetas, 0) + valor
+
+    def valor(self, *etiquetas) -> float:
+        return self._valores.get(etiquetas, 0)
+
+    def exponer(self):
+        lineas = self._cabecera()
+        with self._lock:
+            for etiquetas, valor in sorted(self._valores.items()):
+                lineas.append(f"{self.nombre}{_formatear_etiquetas(self.etiquetas, etiquetas)} {_formatear_numero(valor)}")
+        return lineas
+
+
+class Medidor(Contador):
+    """Valor que sube y baja (gauge)."""
+    tipo = "gauge"
+
+    def dec(self, *etiquetas, valor: float = 1):
+        self.inc(*etiquetas, valor=-valor)
+
+    def set(self, *etiquetas, valor: float):
+        with self._lock:
+            self._valores[etiquetas] = valor
+
+
+class Histograma(_Metrica):
+    """Distribución de observaciones en buckets acumulados."""
+    tipo = "histogram"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas=(), buckets=BUCKETS_LATENCIA):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.buckets = tuple(sorted(buckets))
+
+    def observar(self, valor: float, *etiquetas):
+        indice = bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._valores.get(etiquetas)
+            if serie is None:
+                # [conteos por bucket (+Inf al final), suma, total]
+                serie = self._valores[etiquetas] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            serie[0][indice] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def total(self, *etiquetas) -> int:
+        serie = self._valores.get(etiquetas)
+        return serie[2] if serie else 0
+
+    def exponer(self):
+        lineas = self._cabecera()
+        with self._lock:
+            series = [(etq, list(s[0]), s[1], s[2]) for etq, s in sorted(self._valores.items())]
+        for etiquetas, conteos, suma, total in series:
+            acumulado = 0
+            for limite, conteo in zip(self.buckets + (float("inf"),), conteos):
+                acumulado += conteo
+                le = f'le="{_formatear_numero(float(limite))}"'
+                lineas.append(f"{self.nombre}_bucket{_formatear_etiquetas(self.etiquetas, etiquetas, le)} {acumulado}")
+            lineas.append(f"{self.nombre}_sum{_formatear_etiquetas(self.etiquetas, etiquetas)} {_formatear_numero(suma)}")
+            lineas.append(f"{self.nombre}_count{_formatear_etiquetas(self.etiquetas, etiquetas)} {total}")
+        return lineas
+
+
+# --------------------- MÉTRICAS DE LA APLICACIÓN ---------------------
+
+peticiones_total = Contador(
+    "http_requests_total", "Peticiones HTTP atendidas.", ("method", "route", "status"))
+duracion_peticion = Histograma(
+    "http_request_duration_seconds", "Latencia de las peticiones HTTP.", ("method", "route"))
+peticiones_en_curso = Medidor(
+    "http_requests_in_flight", "Peticiones HTTP en curso.")
+tamano_respuesta = Histograma(
+    "http_response_size_bytes", "Tamaño del cuerpo de las respuestas.", ("route",), BUCKETS_BYTES)
+consultas_por_peticion = Histograma(
+    "db_queries_per_request", "Consultas SQL ejecutadas por petición.", ("route",), BUCKETS_CONSULTAS)
+tiempo_db_peticion = Histograma(
+    "db_time_per_request_seconds", "Tiempo en la base de datos por petición.", ("route",))
+espera_pool = Histograma(
+    "db_pool_checkout_wait_seconds", "Espera para obtener una conexión del pool.")
+accesos_cache = Contador(
+    "cache_requests_total", "Consultas a cachés internas por resultado.", ("cache", "result"))
+ratio_cache = Medidor(
+    "cache_hit_ratio", "Proporción de aciertos de cada caché.", ("cache",))
+
+REGISTRO = [
+    peticiones_total, duracion_peticion, peticiones_en_curso, tamano_respuesta,
+    consultas_por_peticion, tiempo_db_peticion, espera_pool, accesos_cache, ratio_cache,
+]
+
+
+def observar_espera_pool(segundos: float):
+    espera_pool.observar(segundos)
+
+
+def registrar_cache(nombre: str, acierto: bool):
+    """Registra un acceso a una caché interna (acierto o fallo)."""
+    accesos_cache.inc(nombre, "hit" if acierto else "miss")
+
+
+def _actualizar_ratios_cache():
+    caches = {etiquetas[0] for etiquetas in list(accesos_cache._valores)}
+    for cache in caches:
+        aciertos = accesos_cache.valor(cache, "hit")
+        total = aciertos + accesos_cache.valor(cache, "miss")
+        ratio_cache.set(cache, valor=round(aciertos / total, 4) if total else 0.0)
+
+
+def exponer() -> str:
+    """Todas las métricas en formato de texto de Prometheus (versión 0.0.4)."""
+    _actualizar_ratios_cache()
+    lineas = []
+    for metrica in REGISTRO:
+        lineas.extend(metrica.exponer())
+    return "\n".join(lineas) + "\n"
+
+
+def reiniciar():
+    for metrica in REGISTRO:
+        metrica.reiniciar()
+
+
+# --------------------- MIDDLEWARE ---------------------
+
+def ruta_de_scope(scope) -> str:
+    """Plantilla de la ruta atendida (p. ej. /api/autos/{auto_id}) para agrupar métricas."""
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    if scope.get("path", "").startswith("/static/"):
+        return "/static"
+    return "sin_ruta"
+
+
+class MetricasMiddleware:
+    """
+    Middleware ASGI puro (sin BaseHTTPMiddleware) para mantener el coste por
+    petición en unos pocos microsegundos. Abre también el contexto de
+    monitoreo_sql y añade la cabecera Server-Timing con el tiempo en DB.
+    """
+
+    def __init__(self, app, excluir=("/metrics",)):
+        self.app = app
+        self.excluir = set(excluir)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.excluir:
+            await self.app(scope, receive, send)
+            return
+
+        inicio = time.perf_counter()
+        token = monitoreo_sql.iniciar_peticion(scope["path"])
+        stats = monitoreo_sql.peticion_actual()
+        estado = {"status": 500, "bytes": 0}
+
+        async def send_medido(message):
+            if message["type"] == "http.response.start":
+                estado["status"] = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((
+                    b"server-timing",
+                    f'db;dur={stats.tiempo_db * 1000:.2f};desc="{stats.consultas} consultas"'.encode()
+                ))
+                message = {**message, "headers": headers}
+            elif message["type"] == "http.response.body":
+                estado["bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        peticiones_en_curso.inc()
+        try:
+            await self.app(scope, receive, send_medido)
+        finally:
+            peticiones_en_curso.dec()
+            ruta = ruta_de_scope(scope)
+            stats.ruta = ruta
+            monitoreo_sql.finalizar_peticion(token)
+
+            metodo = scope["method"]
+            peticiones_total.inc(metodo, ruta, str(estado["status"]))
+            duracion_peticion.observar(time.perf_counter() - inicio, metodo, ruta)
+            tamano_respuesta.observar(estado["bytes"], ruta)
+            consultas_por_peticion.observar(stats.consultas, ruta)
+            tiempo_db_peticion.observar(stats.tiempo_db, ruta)
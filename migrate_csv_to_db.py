@@ -25,6 +25,7 @@ try:
         AutoElectricoSQL, CargaSQL, EstacionSQL,
         AutoEliminadoSQL, CargaEliminadaSQL, EstacionEliminadaSQL
     )
+    from db_init import rellenar_versiones, rellenar_horarios, enlazar_cargas
 except ImportError as e:
     logger.error(f"❌ Error al importar dependencias de DB/Modelos: {e}")
     sys.exit(1)
@@ -71,7 +72,10 @@ def conversion_tipo_estacion(fila: pd.Series) -> dict:
         "horario_apertura": fila["horario_apertura"],
         "coste_por_kwh": float(fila["coste_por_kwh"]),
         "operador": fila["operador"],
-        "url_imagen": fila.get("url_imagen")
+        "url_imagen": fila.get("url_imagen"),
+        # Columnas opcionales: los CSV antiguos no traen coordenadas
+        "latitud": float(fila["latitud"]) if pd.notna(fila.get("latitud")) else None,
+        "longitud": float(fila["longitud"]) if pd.notna(fila.get("longitud")) else None,
     }
 
 
@@ -170,6 +174,11 @@ def main():
         # Si la migración falla, el log mostrará la razón, pero el build continuará.
         logger.error(f"❌ FALLA CRÍTICA EN MIGRACIÓN: {e}", exc_info=True)
 
+    # Las filas cargadas por CSV entran sin versión, horario interpretado ni enlace carga-auto
+    rellenar_versiones()
+    rellenar_horarios()
+    enlazar_cargas()
+
     logger.info("✨ Migración de CSV a DB completada.")
 
 
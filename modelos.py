@@ -42,6 +42,8 @@ class CargaBase(BaseModel):
     dificultad_carga: str = Field(..., max_length=10)
     requiere_instalacion_domestica: bool = Field(...)
     url_imagen: Optional[str] = Field(None, max_length=255)
+    # Auto al que corresponde; si no se indica se busca por modelo_auto (crud.auto_de_modelo)
+    auto_id: Optional[int] = Field(None, gt=0)
 
 
 class CargaConID(CargaBase):
@@ -60,6 +62,7 @@ class CargaActualizada(BaseModel):
     dificultad_carga: Optional[str] = Field(None, max_length=10)
     requiere_instalacion_domestica: Optional[bool] = None
     url_imagen: Optional[str] = Field(None, max_length=255)
+    auto_id: Optional[int] = Field(None, gt=0)
 
 
 # ------------------ Modelos para Estaciones de Carga ------------------
@@ -75,6 +78,8 @@ class EstacionBase(BaseModel):
     coste_por_kwh: float = Field(..., ge=0)
     operador: str = Field(..., max_length=50)
     url_imagen: Optional[str] = Field(None, max_length=255)
+    latitud: Optional[float] = Field(None, ge=-90, le=90)
+    longitud: Optional[float] = Field(None, ge=-180, le=180)
 
 
 class EstacionConID(EstacionBase):
@@ -95,6 +100,8 @@ class EstacionActualizada(BaseModel):
     coste_por_kwh: Optional[float] = Field(None, ge=0)
     operador: Optional[str] = Field(None, max_length=50)
     url_imagen: Optional[str] = Field(None, max_length=255)
+    latitud: Optional[float] = Field(None, ge=-90, le=90)
+    longitud: Optional[float] = Field(None, ge=-180, le=180)
 
 
 # ------------------ Modelos para Autenticación de Usuarios ------------------
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime
+from sqlalchemy import Column, Integer, BigInteger, String, Float, Boolean, DateTime, Text, ForeignKey, Index, event, insert
 from sqlalchemy.ext.declarative import declarative_base
 from pydantic import BaseModel, Field
 from typing import Optional
@@ -18,6 +18,10 @@ class AutoElectricoSQL(Base):
     autonomia_km = Column(Float, nullable=False)
     disponible = Column(Boolean, default=True)
     url_imagen = Column(String(255), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    # Token monotónico del feed de cambios (ver crud.get_cambios)
+    version = Column(BigInteger, nullable=True, index=True)
 
 class AutoEliminadoSQL(Base):
     __tablename__ = "autos_eliminados"
@@ -30,6 +34,10 @@ class AutoEliminadoSQL(Base):
     autonomia_km = Column(Float, nullable=False)
     disponible = Column(Boolean, default=True)
     url_imagen = Column(String(255), nullable=True)
+    # Lápida para el feed de cambios: id de la fila borrada y versión del borrado
+    id_original = Column(Integer, nullable=True, index=True)
+    version = Column(BigInteger, nullable=True, index=True)
+    eliminado_en = Column(DateTime, default=datetime.utcnow)
 
 
 class CargaSQL(Base):
@@ -44,6 +52,12 @@ class CargaSQL(Base):
     dificultad_carga = Column(String(10), nullable=False)
     requiere_instalacion_domestica = Column(Boolean, default=False)
     url_imagen = Column(String(255), nullable=True)
+    # Enlace normalizado con el auto (antes solo por el texto de modelo_auto)
+    auto_id = Column(Integer, ForeignKey("autos_electricos.id", ondelete="SET NULL"), nullable=True, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    # Token monotónico del feed de cambios (ver crud.get_cambios)
+    version = Column(BigInteger, nullable=True, index=True)
 
 
 class CargaEliminadaSQL(Base):
@@ -58,6 +72,11 @@ class CargaEliminadaSQL(Base):
     dificultad_carga = Column(String(10), nullable=False)
     requiere_instalacion_domestica = Column(Boolean, default=False)
     url_imagen = Column(String(255), nullable=True)
+    auto_id = Column(Integer, nullable=True)
+    # Lápida para el feed de cambios: id de la fila borrada y versión del borrado
+    id_original = Column(Integer, nullable=True, index=True)
+    version = Column(BigInteger, nullable=True, index=True)
+    eliminado_en = Column(DateTime, default=datetime.utcnow)
 
 
 class EstacionSQL(Base):
@@ -74,6 +93,12 @@ class EstacionSQL(Base):
     coste_por_kwh = Column(Float, nullable=False)
     operador = Column(String(50), nullable=False)
     url_imagen = Column(String(255), nullable=True)
+    latitud = Column(Float, nullable=True)
+    longitud = Column(Float, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    # Token monotónico del feed de cambios (ver crud.get_cambios)
+    version = Column(BigInteger, nullable=True, index=True)
 
 class EstacionEliminadaSQL(Base):
     __tablename__ = "estaciones_eliminadas"
@@ -89,6 +114,43 @@ class EstacionEliminadaSQL(Base):
     coste_por_kwh = Column(Float, nullable=False)
     operador = Column(String(50), nullable=False)
     url_imagen = Column(String(255), nullable=True)
+    latitud = Column(Float, nullable=True)
+    longitud = Column(Float, nullable=True)
+    # Lápida para el feed de cambios: id de la fila borrada y versión del borrado
+    id_original = Column(Integer, nullable=True, index=True)
+    version = Column(BigInteger, nullable=True, index=True)
+    eliminado_en = Column(DateTime, default=datetime.utcnow)
+
+
+class IntervaloHorarioSQL(Base):
+    """
+    Horario de apertura de una estación ya interpretado (horarios.py): un
+    intervalo [inicio, fin) en minutos de la semana por fila (lunes 00:00 = 0).
+    """
+    __tablename__ = "horarios_estaciones"
+
+    id = Column(Integer, primary_key=True)
+    estacion_id = Column(Integer, ForeignKey("estaciones_carga.id", ondelete="CASCADE"), nullable=False, index=True)
+    inicio = Column(Integer, nullable=False)
+    fin = Column(Integer, nullable=False)
+
+    __table_args__ = (Index("ix_horarios_estaciones_inicio_fin", "inicio", "fin"),)
+
+
+class VersionCatalogoSQL(Base):
+    """Contador de versiones por entidad (lo usa Postgres; en SQLite basta con MAX)."""
+    __tablename__ = "versiones_catalogo"
+
+    entidad = Column(String(20), primary_key=True)
+    valor = Column(BigInteger, nullable=False, default=0)
+
+
+@event.listens_for(VersionCatalogoSQL.__table__, "after_create")
+def _sembrar_versiones(tabla, connection, **kw):
+    connection.execute(insert(tabla), [
+        {"entidad": entidad, "valor": 0} for entidad in ("autos", "cargas", "estaciones")
+    ])
+
 
 # CORRECCIÓN CRÍTICA: UsuarioSQL debe estar al mismo nivel que las otras clases
 class UsuarioSQL(Base):
@@ -102,4 +164,20 @@ class UsuarioSQL(Base):
     celular = Column(String(20), nullable=True)
     hashed_password = Column(String(255), nullable=False)
     fecha_registro = Column(DateTime, default=datetime.utcnow)
-    activo = Column(Boolean, default=True)
\ No newline at end of file
+    activo = Column(Boolean, default=True)
+
+# ------------------ Cola de tareas en segundo plano ------------------
+
+class TareaSQL(Base):
+    """Tarea pendiente de la cola (tareas.py). Se borra al completarse."""
+    __tablename__ = "tareas_pendientes"
+
+    id = Column(Integer, primary_key=True, index=True)
+    tipo = Column(String(50), nullable=False)
+    payload = Column(Text, nullable=False)
+    estado = Column(String(20), nullable=False, default="pendiente", index=True)
+    intentos = Column(Integer, nullable=False, default=0)
+    ultimo_error = Column(Text, nullable=True)
+    propietario = Column(String(100), nullable=True)
+    creada_en = Column(DateTime, default=datetime.utcnow)
+    actualizada_en = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
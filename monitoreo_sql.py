@@ -0,0 +1,212 @@
+"""
+monitoreo_sql.py - Instrumentación de consultas SQL por petición
+
+Cuenta las consultas que ejecuta cada petición HTTP, el tiempo total pasado
+en la base de datos y las sentencias más lentas. Las peticiones que superan
+los umbrales se registran en el log con su SQL normalizado y los datos
+agregados quedan disponibles para el endpoint de monitoreo.
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+from collections import Counter
+from functools import lru_cache
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+
+logger = logging.getLogger("monitoreo_sql")
+
+# Umbrales configurables por variables de entorno
+SQL_SLOW_QUERY_MS = float(os.getenv("SQL_SLOW_QUERY_MS", "100"))
+SQL_SLOW_REQUEST_MS = float(os.getenv("SQL_SLOW_REQUEST_MS", "500"))
+SQL_MAX_QUERIES_PER_REQUEST = int(os.getenv("SQL_MAX_QUERIES_PER_REQUEST", "20"))
+SQL_N_PLUS_ONE_THRESHOLD = int(os.getenv("SQL_N_PLUS_ONE_THRESHOLD", "5"))
+
+# Límite de sentencias distintas que se guardan en los agregados globales
+MAX_SENTENCIAS_AGREGADAS = 500
+LENTAS_POR_PETICION = 3
+
+_RE_CADENA = re.compile(r"'(?:[^']|'')*'")
+_RE_NUMERO = re.compile(r"\b\d+(?:\.\d+)?\b")
+_RE_PARAMETRO = re.compile(r"%\([^)]+\)s|:\w+|\$\d+|\?")
+_RE_POSTCOMPILE = re.compile(r"\(?__\[POSTCOMPILE_\w+\]\)?")
+_RE_LISTA_IN = re.compile(r"IN \((?:\s*\?\s*,?)+\)", re.IGNORECASE)
+_RE_ESPACIOS = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=1024)
+def normalizar_sql(sql: str) -> str:
+    """Reemplaza literales y parámetros por '?' para agrupar sentencias iguales."""
+    sql = _RE_CADENA.sub("?", sql)
+    sql = _RE_POSTCOMPILE.sub("(?)", sql)
+    sql = _RE_PARAMETRO.sub("?", sql)
+    sql = _RE_NUMERO.sub("?", sql)
+    sql = _RE_LISTA_IN.sub("IN (?)", sql)
+    return _RE_ESPACIOS.sub(" ", sql).strip()
+
+
+class EstadisticasPeticion:
+    """Consultas ejecutadas durante una petición."""
+
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        self.inicio = time.perf_counter()
+        self.consultas = 0
+        self.tiempo_db = 0.0
+        self.sentencias = Counter()
+        self.lentas = []  # (duración_segundos, sql_normalizado)
+
+    def registrar(self, sql: str, duracion: float):
+        self.consultas += 1
+        self.tiempo_db += duracion
+        self.sentencias[sql] += 1
+        self.lentas.append((duracion, sql))
+        if len(self.lentas) > LENTAS_POR_PETICION:
+            self.lentas.sort(reverse=True)
+            self.lentas.pop()
+
+    def repetidas(self):
+        """Sentencias repetidas en la petición (posible patrón N+1)."""
+        return {sql: n for sql, n in self.sentencias.items() if n >= SQL_N_PLUS_ONE_THRESHOLD}
+
+
+class _Agregados:
+    """Acumulados globales por ruta y por sentencia normalizada."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reiniciar()
+
+    def reiniciar(self):
+        with self._lock:
+            self.rutas = {}
+            self.sentencias = {}
+
+    def acumular_peticion(self, stats: EstadisticasPeticion, duracion_total: float):
+        with self._lock:
+            ruta = self.rutas.setdefault(stats.ruta, {
+                "peticiones": 0, "consultas": 0, "tiempo_db_ms": 0.0,
+                "max_consultas": 0, "tiempo_total_ms": 0.0,
+            })
+            ruta["peticiones"] += 1
+            ruta["consultas"] += stats.consultas
+            ruta["tiempo_db_ms"] += stats.tiempo_db * 1000
+            ruta["tiempo_total_ms"] += duracion_total * 1000
+            ruta["max_consultas"] = max(ruta["max_consultas"], stats.consultas)
+
+    def acumular_sentencia(self, sql: str, duracion: float):
+        with self._lock:
+            datos = self.sentencias.get(sql)
+            if datos is None:
+                if len(self.sentencias) >= MAX_SENTENCIAS_AGREGADAS:
+                    return
+                datos = self.sentencias[sql] = {"ejecuciones": 0, "tiempo_total_ms": 0.0, "tiempo_max_ms": 0.0}
+            ms = duracion * 1000
+            datos["ejecuciones"] += 1
+            datos["tiempo_total_ms"] += ms
+            datos["tiempo_max_ms"] = max(datos["tiempo_max_ms"], ms)
+
+    def resumen(self, top: int = 10) -> dict:
+        with self._lock:
+            rutas = {
+                ruta: {
+                    **datos,
+                    "consultas_promedio": round(datos["consultas"] / datos["peticiones"], 2),
+                    "tiempo_db_promedio_ms": round(datos["tiempo_db_ms"] / datos["peticiones"], 3),
+                }
+                for ruta, datos in self.rutas.items()
+            }
+            mas_lentas = sorted(
+                self.sentencias.items(), key=lambda item: item[1]["tiempo_max_ms"], reverse=True
+            )[:top]
+            mas_costosas = sorted(
+                self.sentencias.items(), key=lambda item: item[1]["tiempo_total_ms"], reverse=True
+            )[:top]
+        return {
+            "rutas": rutas,
+            "sentencias_mas_lentas": [{"sql": sql, **datos} for sql, datos in mas_lentas],
+            "sentencias_mas_costosas": [{"sql": sql, **datos} for sql, datos in mas_costosas],
+        }
+
+
+agregados = _Agregados()
+_peticion_actual: ContextVar[Optional[EstadisticasPeticion]] = ContextVar("peticion_sql", default=None)
+
+
+def iniciar_peticion(ruta: str):
+    """Empieza a contar las consultas de la petición actual. Devuelve el token del contexto."""
+    return _peticion_actual.set(EstadisticasPeticion(ruta))
+
+
+def finalizar_peticion(token) -> Optional[EstadisticasPeticion]:
+    """Cierra la petición actual, acumula sus datos y registra las que superan umbrales."""
+    stats = _peticion_actual.get()
+    _peticion_actual.reset(token)
+    if stats is None:
+        return None
+
+    duracion = time.perf_counter() - stats.inicio
+    agregados.acumular_peticion(stats, duracion)
+
+    lenta = stats.tiempo_db * 1000 > SQL_SLOW_REQUEST_MS
+    demasiadas = stats.consultas > SQL_MAX_QUERIES_PER_REQUEST
+    if lenta or demasiadas:
+        detalle = "; ".join(f"{d * 1000:.1f}ms {sql}" for d, sql in sorted(stats.lentas, reverse=True))
+        logger.warning(
+            "Petición costosa en DB %s: %s consultas, %.1fms en DB. Más lentas: %s",
+            stats.ruta, stats.consultas, stats.tiempo_db * 1000, detalle
+        )
+    for sql, veces in stats.repetidas().items():
+        logger.warning("Posible N+1 en %s: %s ejecuciones de %s", stats.ruta, veces, sql)
+
+    return stats
+
+
+def peticion_actual() -> Optional[EstadisticasPeticion]:
+    return _peticion_actual.get()
+
+
+def resumen(top: int = 10) -> dict:
+    return agregados.resumen(top)
+
+
+# --------------------- EVENTOS DE SQLALCHEMY ---------------------
+
+def _antes_de_ejecutar(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("inicio_consultas", []).append(time.perf_counter())
+
+
+def _despues_de_ejecutar(conn, cursor, statement, parameters, context, executemany):
+    inicios = conn.info.get("inicio_consultas")
+    if not inicios:
+        return
+    duracion = time.perf_counter() - inicios.pop()
+    sql = normalizar_sql(statement)
+
+    agregados.acumular_sentencia(sql, duracion)
+    stats = _peticion_actual.get()
+    if stats is not None:
+        stats.registrar(sql, duracion)
+
+    if duracion * 1000 > SQL_SLOW_QUERY_MS:
+        logger.warning("Consulta lenta (%.1fms): %s", duracion * 1000, sql)
+
+
+def _al_fallar(contexto):
+    # Una sentencia que falla no llega a after_cursor_execute
+    conn = contexto.connection
+    if conn is not None and conn.info.get("inicio_consultas"):
+        conn.info["inicio_consultas"].pop()
+
+
+def instrumentar_engine(engine):
+    """Registra los eventos de medición en un engine (idempotente)."""
+    if not event.contains(engine, "before_cursor_execute", _antes_de_ejecutar):
+        event.listen(engine, "before_cursor_execute", _antes_de_ejecutar)
+        event.listen(engine, "after_cursor_execute", _despues_de_ejecutar)
+        event.listen(engine, "handle_error", _al_fallar)
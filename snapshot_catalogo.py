@@ -0,0 +1,418 @@
+"""
+snapshot_catalogo.py - Copia en memoria, por columnas, del catálogo
+
+Opcional: con SNAPSHOT_CATALOGO=true cada proceso guarda autos, cargas y
+estaciones como columnas con un índice id -> fila. Números y booleanos van
+en arrays NumPy (con una máscara de nulos si la columna admite NULL); los
+textos muy repetidos (marca, operador, tipo_conector...) se codifican como
+enteros sobre una lista de categorías, y el resto del texto va en listas.
+Los listados, el detalle, las facetas y las estadísticas se sirven desde
+aquí sin ir a la base.
+
+Se construye con una consulta por tabla (ordenada por id) la primera vez
+que se pide y después se mantiene con los eventos de crud (eventos.py): las
+altas van al final, los cambios se escriben en su fila y las bajas dejan un
+hueco que se recoge al compactar. Cada SNAPSHOT_TTL_SEGUNDOS se reconstruye
+para recoger escrituras de otros workers o de las cargas masivas (db_init).
+
+Antes de leer una tabla se estima su tamaño (filas × bytes por fila de una
+muestra); si el total de las copias superaría SNAPSHOT_MAX_MB esa entidad se
+sigue sirviendo desde la base y se vuelve a intentar al caducar el TTL.
+"""
+
+import logging
+import os
+import sys
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+import eventos
+import models_sql
+from modelos import AutoElectricoConID, CargaConID, EstacionConID
+
+logger = logging.getLogger("snapshot_catalogo")
+
+SNAPSHOT_CATALOGO = os.getenv("SNAPSHOT_CATALOGO", "false").lower() == "true"
+SNAPSHOT_TTL_SEGUNDOS = float(os.getenv("SNAPSHOT_TTL_SEGUNDOS", "600"))
+# Techo para las tres copias juntas; deja margen en la instancia de 512 MB
+SNAPSHOT_MAX_MB = float(os.getenv("SNAPSHOT_MAX_MB", "96"))
+# Filas que se leen para estimar los bytes por fila antes de copiar una tabla
+FILAS_MUESTRA = 1000
+# Entrada del índice id -> fila (clave, valor y hueco en el dict)
+BYTES_INDICE_POR_FILA = 100
+# Fracción de filas borradas a partir de la cual se compacta
+FRACCION_HUECOS = 0.25
+
+_ESQUEMAS = {"autos": AutoElectricoConID, "cargas": CargaConID, "estaciones": EstacionConID}
+_MODELOS = {
+    "autos": models_sql.AutoElectricoSQL,
+    "cargas": models_sql.CargaSQL,
+    "estaciones": models_sql.EstacionSQL,
+}
+# Textos con pocos valores distintos: se guardan como códigos enteros
+CATEGORICAS = {
+    "autos": ("marca",),
+    "cargas": ("tipo_autonomia", "dificultad_carga"),
+    "estaciones": ("tipo_conector", "operador"),
+}
+
+_DTYPES = {float: np.float64, int: np.int64, bool: np.bool_}
+
+
+def _en(columna: np.ndarray, valores: Sequence) -> np.ndarray:
+    """np.isin con comparaciones directas cuando hay pocos valores (evita ordenar)."""
+    if len(valores) > 8:
+        return np.isin(columna, valores)
+    coincide = np.zeros(len(columna), dtype=np.bool_)
+    for valor in valores:
+        coincide |= columna == valor
+    return coincide
+
+
+class TablaColumnar:
+    """
+    Filas de una entidad por columnas, en orden de id. Las bajas marcan la
+    fila como muerta y se compactan cuando los huecos pasan de FRACCION_HUECOS
+    (o antes de listar si un alta llegó con un id menor que el último).
+    """
+
+    def __init__(self, campos: Iterable[str], tipos: Dict[str, type], nulables: Iterable[str] = (),
+                 categoricas: Iterable[str] = ()):
+        self.campos = tuple(campos)
+        self.tipos = tipos
+        self.nulables = set(nulables)
+        self._categorias: Dict[str, list] = {c: [] for c in categoricas}
+        self._codigos: Dict[str, dict] = {c: {} for c in categoricas}
+        self._arrays: Dict[str, np.ndarray] = {}
+        self._nulos: Dict[str, np.ndarray] = {}
+        self._listas: Dict[str, list] = {}
+        self.vivas = np.empty(0, dtype=np.bool_)
+        self.posicion: Dict[int, int] = {}
+        self.n = 0
+        self.huecos = 0
+        self.ordenada = True
+        self._ultimo_id = 0
+        self.bytes_texto_por_fila = 0.0
+        self._lock = threading.RLock()
+        self.cargar(())
+
+    def _dtype(self, campo: str):
+        """dtype NumPy de la columna, o None si se guarda en una lista."""
+        if campo in self._categorias:
+            return np.int32
+        return _DTYPES.get(self.tipos[campo])
+
+    def _codigo(self, campo: str, valor) -> int:
+        if valor is None:
+            return -1
+        codigos = self._codigos[campo]
+        codigo = codigos.get(valor)
+        if codigo is None:
+            codigo = codigos[valor] = len(codigos)
+            self._categorias[campo].append(valor)
+        return codigo
+
+    def _columna(self, campo: str) -> np.ndarray:
+        return self._arrays[campo][:self.n]
+
+    def __len__(self):
+        return self.n - self.huecos
+
+    # ---- tamaño ----
+
+    def estimar_bytes_por_fila(self, muestra: Sequence[tuple]) -> float:
+        """Bytes por fila a partir de una muestra (tuplas en el orden de `campos`)."""
+        total = self.vivas.itemsize + BYTES_INDICE_POR_FILA
+        texto = 0.0
+        for j, campo in enumerate(self.campos):
+            dtype = self._dtype(campo)
+            if dtype is not None:
+                total += np.dtype(dtype).itemsize + (1 if campo in self.nulables else 0)
+                continue
+            # Puntero de la lista + el objeto (cada fila tiene su propio texto)
+            texto += 8
+            if muestra:
+                texto += sum(sys.getsizeof(fila[j]) for fila in muestra if fila[j] is not None) / len(muestra)
+        self.bytes_texto_por_fila = texto
+        return total + texto
+
+    def memoria(self) -> int:
+        """Bytes aproximados de la copia (arrays exactos, textos estimados)."""
+        arrays = sum(a.nbytes for a in self._arrays.values()) + sum(a.nbytes for a in self._nulos.values())
+        return int(arrays + self.vivas.nbytes + self.n * self.bytes_texto_por_fila
+                   + len(self.posicion) * BYTES_INDICE_POR_FILA)
+
+    # ---- mantenimiento ----
+
+    def cargar(self, filas: Sequence[tuple]):
+        """Construcción inicial desde tuplas en el orden de `campos`, ordenadas por id."""
+        n = len(filas)
+        columnas = list(zip(*filas)) if filas else [()] * len(self.campos)
+        with self._lock:
+            for campo, valores in zip(self.campos, columnas):
+                dtype = self._dtype(campo)
+                if dtype is None:
+                    self._listas[campo] = list(valores)
+                    continue
+                if campo in self._categorias:
+                    valores = [self._codigo(campo, v) for v in valores]
+                elif campo in self.nulables:
+                    self._nulos[campo] = np.fromiter((v is None for v in valores), dtype=np.bool_, count=n)
+                    valores = [0 if v is None else v for v in valores]
+                self._arrays[campo] = np.array(valores, dtype=dtype)
+            self.vivas = np.ones(n, dtype=np.bool_)
+            self.n, self.huecos, self.ordenada = n, 0, True
+            self.posicion = {id: i for i, id in enumerate(self._columna("id").tolist())}
+            self._ultimo_id = int(self._arrays["id"][-1]) if n else 0
+
+    def _crecer(self):
+        capacidad = max(2 * len(self.vivas), 16)
+        self._arrays = {campo: np.resize(a, capacidad) for campo, a in self._arrays.items()}
+        self._nulos = {campo: np.resize(a, capacidad) for campo, a in self._nulos.items()}
+        self.vivas = np.resize(self.vivas, capacidad)
+
+    def _escribir(self, i: int, datos: dict):
+        for campo in self.campos:
+            valor = datos.get(campo)
+            if campo in self._listas:
+                self._listas[campo][i] = valor
+            elif campo in self._categorias:
+                self._arrays[campo][i] = self._codigo(campo, valor)
+            else:
+                if campo in self._nulos:
+                    self._nulos[campo][i] = valor is None
+                self._arrays[campo][i] = 0 if valor is None else valor
+
+    def upsert(self, id: int, datos: dict):
+        with self._lock:
+            i = self.posicion.get(id)
+            if i is None:
+                if self.n == len(self.vivas):
+                    self._crecer()
+                i = self.posicion[id] = self.n
+                for lista in self._listas.values():
+                    lista.append(None)
+                self.vivas[i] = True
+                self.ordenada = self.ordenada and id > self._ultimo_id
+                self._ultimo_id = max(self._ultimo_id, id)
+                self.n += 1
+            self._escribir(i, {**datos, "id": id})
+
+    def eliminar(self, id: int):
+        with self._lock:
+            i = self.posicion.pop(id, None)
+            if i is None:
+                return
+            self.vivas[i] = False
+            for lista in self._listas.values():
+                lista[i] = None
+            self.huecos += 1
+            if self.huecos > FRACCION_HUECOS * self.n:
+                self._compactar()
+
+    def aplicar(self, evento):
+        if evento.accion == "delete":
+            self.eliminar(evento.id)
+        elif evento.datos is not None:
+            self.upsert(evento.id, evento.datos)
+
+    def _compactar(self):
+        """Quita los huecos y deja las filas en orden de id."""
+        orden = np.flatnonzero(self.vivas[:self.n])
+        if not self.ordenada:
+            orden = orden[np.argsort(self._columna("id")[orden], kind="stable")]
+        self._arrays = {campo: a[orden] for campo, a in self._arrays.items()}
+        self._nulos = {campo: a[orden] for campo, a in self._nulos.items()}
+        self._listas = {campo: [lista[i] for i in orden.tolist()] for campo, lista in self._listas.items()}
+        self.n, self.huecos, self.ordenada = len(orden), 0, True
+        self.vivas = np.ones(self.n, dtype=np.bool_)
+        self.posicion = {id: i for i, id in enumerate(self._columna("id").tolist())}
+
+    # ---- lectura ----
+
+    def _valores(self, campo: str, posiciones: np.ndarray) -> list:
+        if campo in self._listas:
+            lista = self._listas[campo]
+            return [lista[p] for p in posiciones.tolist()]
+        valores = self._arrays[campo][posiciones].tolist()
+        if campo in self._categorias:
+            categorias = self._categorias[campo]
+            return [categorias[c] if c >= 0 else None for c in valores]
+        if campo in self._nulos:
+            return [None if nulo else v for v, nulo in zip(valores, self._nulos[campo][posiciones].tolist())]
+        return valores
+
+    def _filas(self, posiciones: np.ndarray, campos: Optional[List[str]] = None) -> List[dict]:
+        """Filas como diccionarios; con `campos`, id primero y solo esas columnas (como crud)."""
+        campos = self.campos if campos is None else ["id"] + [c for c in dict.fromkeys(campos) if c != "id"]
+        columnas = [self._valores(campo, posiciones) for campo in campos]
+        return [dict(zip(campos, fila)) for fila in zip(*columnas)]
+
+    def _ordenar(self):
+        if not self.ordenada:
+            self._compactar()
+
+    def pagina(self, skip: int = 0, limit: int = 100, campos: Optional[List[str]] = None) -> List[dict]:
+        skip, limit = max(skip, 0), max(limit, 0)
+        with self._lock:
+            self._ordenar()
+            if self.huecos:
+                posiciones = np.flatnonzero(self.vivas[:self.n])[skip:skip + limit]
+            else:
+                posiciones = np.arange(min(skip, self.n), min(skip + limit, self.n))
+            return self._filas(posiciones, campos)
+
+    def obtener(self, id: int) -> Optional[dict]:
+        with self._lock:
+            i = self.posicion.get(id)
+            return self._filas(np.array([i]))[0] if i is not None else None
+
+    def por_ids(self, ids: List[int], campos: Optional[List[str]] = None) -> Tuple[List[dict], List[int]]:
+        """(filas, faltantes) en el orden pedido y sin repetidos, como crud.get_por_ids."""
+        unicos = list(dict.fromkeys(ids))
+        with self._lock:
+            encontrados = [i for i in unicos if i in self.posicion]
+            posiciones = np.array([self.posicion[i] for i in encontrados], dtype=np.int64)
+            filas = self._filas(posiciones, campos)
+        return filas, [i for i in unicos if i not in self.posicion]
+
+    def _mascara(self, filtros: dict) -> np.ndarray:
+        """Filas vivas que cumplen {campo: [valores]} (OR dentro del campo, AND entre campos)."""
+        mascara = self.vivas[:self.n].copy()
+        for campo, valores in filtros.items():
+            if campo in self._categorias:
+                codigos = self._codigos[campo]
+                mascara &= _en(self._columna(campo), [codigos[v] for v in valores if v in codigos])
+                continue
+            mascara &= _en(self._columna(campo), valores)
+            if campo in self._nulos:
+                mascara &= ~self._nulos[campo][:self.n]
+        return mascara
+
+    def _tomar(self, campo: str, posiciones: Optional[np.ndarray], nulos: bool = False) -> np.ndarray:
+        """Columna (o su máscara de nulos) en `posiciones`; None = todas las filas vivas."""
+        columna = (self._nulos if nulos else self._arrays)[campo][:self.n]
+        if posiciones is None:
+            return columna[self.vivas[:self.n]] if self.huecos else columna
+        # take con índices es mucho más rápido que indexar con una máscara dispersa
+        return columna.take(posiciones)
+
+    def conteos(self, campo: str, posiciones: Optional[np.ndarray] = None) -> List[Tuple[object, int]]:
+        """[(valor, filas)] de la columna (GROUP BY campo), ordenado por valor; NULL al final."""
+        with self._lock:
+            columna = self._tomar(campo, posiciones)
+            if campo in self._categorias:
+                categorias = self._categorias[campo]
+                totales = np.bincount(columna + 1, minlength=len(categorias) + 1).tolist()
+                pares = sorted((categorias[c - 1], t) for c, t in enumerate(totales) if t and c)
+                return pares + ([(None, totales[0])] if totales[0] else [])
+            nulos = 0
+            if campo in self._nulos:
+                es_nulo = self._tomar(campo, posiciones, nulos=True)
+                nulos, columna = int(es_nulo.sum()), columna[~es_nulo]
+            if columna.dtype == np.bool_:
+                totales = np.bincount(columna.view(np.uint8), minlength=2).tolist()
+                pares = [(v, t) for v, t in zip((False, True), totales) if t]
+                return pares + ([(None, nulos)] if nulos else [])
+            valores, totales = np.unique(columna, return_counts=True)
+            return list(zip(valores.tolist(), totales.tolist())) + ([(None, nulos)] if nulos else [])
+
+    def medias(self, grupo: str, campo: str) -> List[Tuple[object, Optional[float]]]:
+        """[(valor de grupo, media de campo)] para una columna categórica (AVG ... GROUP BY)."""
+        with self._lock:
+            codigos = self._tomar(grupo, None) + 1
+            valores = self._tomar(campo, None).astype(np.float64)
+            minimo = len(self._categorias[grupo]) + 1
+            filas = cuentas = np.bincount(codigos, minlength=minimo)
+            if campo in self._nulos:
+                validos = ~self._tomar(campo, None, nulos=True)
+                cuentas = np.bincount(codigos, weights=validos.astype(np.float64), minlength=minimo)
+                valores = np.where(validos, valores, 0.0)
+            sumas = np.bincount(codigos, weights=valores, minlength=minimo)
+            categorias = [None] + self._categorias[grupo]
+        pares = [
+            (categorias[c], float(sumas[c] / cuentas[c]) if cuentas[c] else None)
+            for c in range(minimo) if filas[c]
+        ]
+        return sorted(pares, key=lambda p: (p[0] is None, p[0] or ""))
+
+    def numericos(self, campo: str) -> np.ndarray:
+        """Valores no nulos de una columna numérica como float64 (copia)."""
+        with self._lock:
+            valores = self._tomar(campo, None).astype(np.float64)
+            if campo in self._nulos:
+                valores = valores[~self._tomar(campo, None, nulos=True)]
+            return valores
+
+    def facetas(self, filtros: dict, facetas: Sequence[str], campos: Optional[List[str]] = None,
+                skip: int = 0, limit: int = 20) -> dict:
+        """Mismo resultado que crud.get_facetas, con máscaras sobre las columnas."""
+        with self._lock:
+            self._ordenar()
+            # Sin filtros las facetas cuentan todas las filas vivas (posiciones=None)
+            posiciones = np.flatnonzero(self._mascara(filtros) if filtros else self.vivas[:self.n])
+            conteos = {}
+            for faceta in facetas:
+                valores = [{"valor": v, "total": t} for v, t in self.conteos(faceta, posiciones if filtros else None)]
+                valores.sort(key=lambda v: (-v["total"], str(v["valor"])))
+                conteos[faceta] = valores
+            pagina = posiciones[max(skip, 0):max(skip, 0) + limit]
+            return {"total": len(posiciones), "resultados": self._filas(pagina, campos), "facetas": conteos}
+
+
+def nueva_tabla(entidad: str) -> TablaColumnar:
+    """Tabla vacía con las columnas del esquema de respuesta de la entidad."""
+    columnas = _MODELOS[entidad].__table__.c
+    campos = list(_ESQUEMAS[entidad].model_fields)
+    return TablaColumnar(
+        campos,
+        {campo: columnas[campo].type.python_type for campo in campos},
+        nulables=[campo for campo in campos if columnas[campo].nullable],
+        categoricas=CATEGORICAS[entidad],
+    )
+
+
+# --------------------- Copias de la aplicación ---------------------
+
+def _memoria_otras(entidad: str) -> int:
+    return sum(t.memoria() for e, t in _copias.actuales().items() if e != entidad and t is not None)
+
+
+def _construir(entidad: str, db: Session) -> Optional[TablaColumnar]:
+    nueva = nueva_tabla(entidad)
+    sql = _MODELOS[entidad].__table__
+    columnas = [sql.c[campo] for campo in nueva.campos]
+    muestra = db.execute(select(*columnas).limit(FILAS_MUESTRA)).all()
+    filas = db.execute(select(func.count()).select_from(sql)).scalar_one()
+    estimado = filas * nueva.estimar_bytes_por_fila(muestra)
+    disponible = SNAPSHOT_MAX_MB * 2 ** 20 - _memoria_otras(entidad)
+    if estimado > disponible:
+        logger.warning("Snapshot de %s omitido: ~%.1f MB estimados y %.1f MB libres (SNAPSHOT_MAX_MB=%s)",
+                       entidad, estimado / 2 ** 20, max(disponible, 0) / 2 ** 20, SNAPSHOT_MAX_MB)
+        return None
+    nueva.cargar(db.execute(select(*columnas).order_by(sql.c.id)).all())
+    logger.info("Snapshot de %s: %d filas, ~%.1f MB", entidad, len(nueva), nueva.memoria() / 2 ** 20)
+    return nueva
+
+
+# entidad -> TablaColumnar (o None si no cabe: se guarda igual para no reintentar hasta el TTL)
+_copias = eventos.CacheEventos("snapshot_catalogo", _construir, TablaColumnar.aplicar, ttl=SNAPSHOT_TTL_SEGUNDOS)
+
+
+def tabla(db: Session, entidad: str) -> Optional[TablaColumnar]:
+    """
+    Copia de la entidad; la construye si no existe o caducó. None si el
+    snapshot está desactivado o la copia no cabe: en ese caso se lee de la base.
+    """
+    if not SNAPSHOT_CATALOGO:
+        return None
+    return _copias.obtener(entidad, db)
+
+
+def invalidar(entidad: Optional[str] = None):
+    """Descarta las copias (todas o la de una entidad) para releerlas en la próxima consulta."""
+    _copias.invalidar(entidad)
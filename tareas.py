@@ -0,0 +1,243 @@
+"""
+tareas.py - Cola de tareas en segundo plano (asyncio)
+
+Saca del camino de la respuesta el trabajo secundario (escritura de archivos,
+refrescos, miniaturas...). Las tareas se registran por nombre con
+`@cola.registrar("nombre")` y se encolan con `await cola.encolar("nombre", **datos)`.
+
+- Trabajadores asyncio; las funciones síncronas y los accesos a la tabla de
+  tareas se ejecutan en un hilo para no bloquear el bucle de eventos.
+- Reintentos con espera exponencial hasta TAREAS_MAX_INTENTOS.
+- Cola acotada (TAREAS_MAX_PENDIENTES): si se llena, encolar lanza ColaLlena.
+- Las tareas persistentes se guardan en la tabla tareas_pendientes antes de
+  encolarse y se borran al completarse, así sobreviven a un reinicio.
+
+La cola arranca y se detiene con el lifespan de FastAPI. Si no está iniciada
+(scripts, TestClient sin contexto) las tareas se ejecutan en línea.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, or_, select, update
+
+import models_sql
+from database import SessionLocal
+
+logger = logging.getLogger("tareas")
+
+TAREAS_TRABAJADORES = int(os.getenv("TAREAS_TRABAJADORES", "2"))
+TAREAS_MAX_PENDIENTES = int(os.getenv("TAREAS_MAX_PENDIENTES", "1000"))
+TAREAS_MAX_INTENTOS = int(os.getenv("TAREAS_MAX_INTENTOS", "3"))
+TAREAS_ESPERA_REINTENTO = float(os.getenv("TAREAS_ESPERA_REINTENTO", "1.0"))
+# Tareas de otro proceso sin actividad en este tiempo se consideran abandonadas
+TAREAS_RECLAMAR_SEGUNDOS = int(os.getenv("TAREAS_RECLAMAR_SEGUNDOS", "600"))
+
+_TABLA = models_sql.TareaSQL.__table__
+
+
+class ColaLlena(Exception):
+    """La cola alcanzó TAREAS_MAX_PENDIENTES."""
+
+
+class ColaTareas:
+
+    def __init__(self, session_factory=SessionLocal, trabajadores: int = TAREAS_TRABAJADORES,
+                 max_pendientes: int = TAREAS_MAX_PENDIENTES, max_intentos: int = TAREAS_MAX_INTENTOS,
+                 espera_reintento: float = TAREAS_ESPERA_REINTENTO):
+        self.session_factory = session_factory
+        self.trabajadores = trabajadores
+        self.max_pendientes = max_pendientes
+        self.max_intentos = max_intentos
+        self.espera_reintento = espera_reintento
+        self.propietario = f"{socket.gethostname()}:{os.getpid()}"
+        self.completadas = 0
+        self.fallidas = 0
+        self._funciones = {}
+        self._cola: Optional[asyncio.Queue] = None
+        self._workers = []
+        self._reintentos = set()
+
+    @property
+    def iniciada(self) -> bool:
+        return self._cola is not None
+
+    def registrar(self, nombre: str, persistente: bool = True):
+        """
+        Decorador que registra una función (síncrona o async) como tarea.
+        Las no persistentes (p. ej. con bytes en los datos) no se guardan en la base.
+        """
+        def decorador(funcion):
+            self._funciones[nombre] = (funcion, persistente)
+            return funcion
+        return decorador
+
+    async def encolar(self, tipo: str, **datos) -> Optional[int]:
+        """Encola una tarea y devuelve su id persistido (None si no se persiste)."""
+        if tipo not in self._funciones:
+            raise ValueError(f"Tarea no registrada: {tipo}")
+        funcion, persistente = self._funciones[tipo]
+
+        if not self.iniciada:
+            await self._ejecutar(funcion, datos)
+            return None
+        if self._cola.qsize() >= self.max_pendientes:
+            raise ColaLlena(f"Hay {self._cola.qsize()} tareas pendientes")
+
+        tarea_id = await asyncio.to_thread(self._persistir, tipo, datos) if persistente else None
+        self._cola.put_nowait((tarea_id, tipo, datos, 0))
+        return tarea_id
+
+    def estado(self) -> dict:
+        return {
+            "iniciada": self.iniciada,
+            "trabajadores": len(self._workers),
+            "en_cola": self._cola.qsize() if self.iniciada else 0,
+            "reintentos_programados": len(self._reintentos),
+            "completadas": self.completadas,
+            "fallidas": self.fallidas,
+        }
+
+    # ------------------ Ciclo de vida ------------------
+
+    async def iniciar(self):
+        if self.iniciada:
+            return
+        self._cola = asyncio.Queue()
+        recuperadas = await asyncio.to_thread(self._reclamar_pendientes)
+        for tarea in recuperadas:
+            self._cola.put_nowait(tarea)
+        if recuperadas:
+            logger.info("%s tarea(s) pendientes recuperadas de la base de datos", len(recuperadas))
+        self._workers = [
+            asyncio.create_task(self._trabajador(), name=f"tareas-{i}") for i in range(self.trabajadores)
+        ]
+
+    async def detener(self, espera: float = 5.0):
+        """Espera a que se vacíe la cola; lo que quede persistido se retoma en el próximo arranque."""
+        if not self.iniciada:
+            return
+        try:
+            await asyncio.wait_for(self._cola.join(), espera)
+        except asyncio.TimeoutError:
+            logger.warning("Deteniendo con %s tarea(s) sin terminar", self._cola.qsize())
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        for handle in self._reintentos:
+            handle.cancel()
+        self._reintentos.clear()
+        await asyncio.to_thread(self._liberar)
+        self._cola = None
+        self._workers = []
+
+    # ------------------ Ejecución ------------------
+
+    @staticmethod
+    async def _ejecutar(funcion, datos: dict):
+        if asyncio.iscoroutinefunction(funcion):
+            await funcion(**datos)
+        else:
+            await asyncio.to_thread(funcion, **datos)
+
+    async def _trabajador(self):
+        while True:
+            tarea_id, tipo, datos, intentos = await self._cola.get()
+            try:
+                if tipo not in self._funciones:
+                    raise ValueError(f"Tarea no registrada: {tipo}")
+                await self._ejecutar(self._funciones[tipo][0], datos)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await self._fallo(tarea_id, tipo, datos, intentos + 1, e)
+            else:
+                self.completadas += 1
+                await asyncio.to_thread(self._borrar, tarea_id)
+            finally:
+                self._cola.task_done()
+
+    async def _fallo(self, tarea_id, tipo, datos, intentos, error):
+        if intentos >= self.max_intentos:
+            self.fallidas += 1
+            logger.error("Tarea %s (%s) descartada tras %s intentos: %s", tarea_id, tipo, intentos, error,
+                         exc_info=error)
+            await asyncio.to_thread(self._actualizar, tarea_id, estado="fallida", intentos=intentos,
+                                    ultimo_error=repr(error))
+            return
+
+        espera = self.espera_reintento * 2 ** (intentos - 1)
+        logger.warning("Tarea %s (%s) falló (intento %s/%s): %s. Reintento en %.1fs",
+                       tarea_id, tipo, intentos, self.max_intentos, error, espera)
+        await asyncio.to_thread(self._actualizar, tarea_id, intentos=intentos, ultimo_error=repr(error))
+
+        def reencolar():
+            self._reintentos.discard(handle)
+            if self._cola is not None:
+                self._cola.put_nowait((tarea_id, tipo, datos, intentos))
+
+        handle = asyncio.get_running_loop().call_later(espera, reencolar)
+        self._reintentos.add(handle)
+
+    # ------------------ Persistencia ------------------
+
+    def _persistir(self, tipo: str, datos: dict) -> int:
+        with self.session_factory() as db:
+            tarea = models_sql.TareaSQL(tipo=tipo, payload=json.dumps(datos), propietario=self.propietario)
+            db.add(tarea)
+            db.commit()
+            return tarea.id
+
+    def _reclamar_pendientes(self) -> list:
+        """Toma las tareas sin dueño (o abandonadas) de forma atómica con UPDATE ... RETURNING."""
+        limite = datetime.utcnow() - timedelta(seconds=TAREAS_RECLAMAR_SEGUNDOS)
+        condicion = (_TABLA.c.estado == "pendiente") & or_(
+            _TABLA.c.propietario.is_(None), _TABLA.c.actualizada_en < limite
+        )
+        valores = {"propietario": self.propietario, "actualizada_en": datetime.utcnow()}
+        columnas = (_TABLA.c.id, _TABLA.c.tipo, _TABLA.c.payload, _TABLA.c.intentos)
+        try:
+            with self.session_factory() as db:
+                if db.get_bind().dialect.update_returning:
+                    filas = db.execute(update(_TABLA).where(condicion).values(**valores).returning(*columnas)).all()
+                else:
+                    filas = db.execute(select(*columnas).where(condicion)).all()
+                    db.execute(update(_TABLA).where(_TABLA.c.id.in_([f.id for f in filas])).values(**valores))
+                db.commit()
+        except Exception as e:
+            logger.error("No se pudieron recuperar las tareas pendientes: %s", e, exc_info=True)
+            return []
+        return [(f.id, f.tipo, json.loads(f.payload), f.intentos) for f in filas]
+
+    def _liberar(self):
+        self._modificar(
+            update(_TABLA)
+            .where(_TABLA.c.propietario == self.propietario, _TABLA.c.estado == "pendiente")
+            .values(propietario=None)
+        )
+
+    def _actualizar(self, tarea_id: Optional[int], **valores):
+        if tarea_id is not None:
+            self._modificar(update(_TABLA).where(_TABLA.c.id == tarea_id).values(**valores))
+
+    def _borrar(self, tarea_id: Optional[int]):
+        if tarea_id is not None:
+            self._modificar(delete(_TABLA).where(_TABLA.c.id == tarea_id))
+
+    def _modificar(self, sentencia):
+        try:
+            with self.session_factory() as db:
+                db.execute(sentencia)
+                db.commit()
+        except Exception as e:
+            # Un fallo de la base no debe tumbar al trabajador: como mucho la tarea se repite
+            logger.error("Error al actualizar la tabla de tareas: %s", e, exc_info=True)
+
+
+# Cola de la aplicación; main.py la inicia en el lifespan
+cola = ColaTareas()
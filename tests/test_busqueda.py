@@ -0,0 +1,99 @@
+"""
+Pruebas de los índices en memoria para el autocompletado y la búsqueda aproximada (busqueda.py)
+"""
+
+import busqueda
+
+
+def _indice():
+    indice = busqueda.IndicePrefijos(("marca", "modelo"))
+    indice.cargar([
+        {"id": 1, "marca": "Tesla", "modelo": "Model 3"},
+        {"id": 2, "marca": "Tesla", "modelo": "Model Y"},
+        {"id": 3, "marca": "Škoda", "modelo": "Enyaq"},
+    ])
+    return indice
+
+
+def _indice_ngramas():
+    indice = busqueda.IndiceNgramas(("marca", "modelo"))
+    indice.cargar([
+        {"id": 1, "marca": "Tesla", "modelo": "Model 3"},
+        {"id": 2, "marca": "Hyundai", "modelo": "Kona Electric"},
+        {"id": 3, "marca": "Nissan", "modelo": "Leaf"},
+    ])
+    return indice
+
+
+class TestIndicePrefijos:
+    """Pruebas del índice de prefijos (autocompletado)"""
+
+    def test_prefijo_normalizado_y_por_palabra(self):
+        """Test: Los prefijos ignoran mayúsculas y acentos y encuentran cualquier palabra"""
+        indice = _indice()
+        assert [s["texto"] for s in indice.sugerir("MOD")] == ["Model 3", "Model Y"]
+        assert indice.sugerir("sko") == [{"texto": "Škoda", "campo": "marca", "total": 1}]
+        assert [s["texto"] for s in indice.sugerir("y")] == ["Model Y"]
+        assert indice.sugerir("zz") == [] and indice.sugerir("  ") == []
+
+    def test_ordena_por_frecuencia_y_limita(self):
+        """Test: Las sugerencias se ordenan por frecuencia y respetan el límite"""
+        indice = _indice()
+        assert indice.sugerir("t") == [{"texto": "Tesla", "campo": "marca", "total": 2}]
+        assert len(indice.sugerir("e", limite=1)) == 1
+
+    def test_popular_al_final_del_rango(self):
+        """Test: Un término frecuente gana aunque muchos raros lo precedan alfabéticamente"""
+        indice = busqueda.IndicePrefijos(("marca",))
+        raros = [{"id": i, "marca": f"Aa{i:04d}"} for i in range(1000)]
+        populares = [{"id": 1000 + i, "marca": "Azul"} for i in range(5)]
+        indice.cargar(raros + populares)
+        assert indice.sugerir("a", limite=1) == [{"texto": "Azul", "campo": "marca", "total": 5}]
+
+    def test_actualizaciones_incrementales(self):
+        """Test: Altas, cambios y bajas actualizan el índice sin reconstruirlo"""
+        indice = _indice()
+        indice.upsert(2, {"marca": "Tesla", "modelo": "Cybertruck"})
+        assert [s["texto"] for s in indice.sugerir("model")] == ["Model 3"]
+        assert indice.sugerir("cyber")[0]["texto"] == "Cybertruck"
+
+        indice.eliminar(1)
+        indice.eliminar(1)
+        assert indice.sugerir("model") == []
+        assert indice.sugerir("tesla") == [{"texto": "Tesla", "campo": "marca", "total": 1}]
+
+        indice.upsert(4, {"marca": "Kia", "modelo": "EV6"})
+        assert len(indice) == 3
+
+
+class TestIndiceNgramas:
+    """Pruebas de la búsqueda aproximada por trigramas"""
+
+    def test_distancia_edicion_con_transposiciones(self):
+        """Test: Una transposición cuenta como una sola edición"""
+        assert busqueda.distancia_edicion("tesal", "tesla") == 1
+        assert busqueda.distancia_edicion("kitten", "sitting") == 3
+        assert busqueda.distancia_edicion("", "abc") == 3
+
+    def test_busqueda_aproximada_tolera_erratas(self):
+        """Test: Se encuentran resultados con erratas y nada con texto sin parecido"""
+        indice = _indice_ngramas()
+        assert [id for id, _ in indice.buscar("Tesal")] == [1]
+        assert indice.buscar("Kona Electrc")[0][0] == 2
+        assert indice.buscar("qqqq") == []
+
+    def test_busqueda_aproximada_incremental_y_compactacion(self, monkeypatch):
+        """Test: Los cambios se reflejan al momento y la compactación recoge las filas muertas"""
+        indice = _indice_ngramas()
+        indice.upsert(3, {"marca": "Nissan", "modelo": "Ariya"})
+        assert indice.buscar("leaf") == []
+        assert indice.buscar("ariya")[0][0] == 3
+
+        indice.eliminar(1)
+        assert indice.buscar("tesla") == []
+        assert len(indice) == 2
+
+        monkeypatch.setattr(indice, "_muertos", 10_000)
+        indice.upsert(4, {"marca": "Kia", "modelo": "EV6"})
+        assert indice._muertos == 0 and len(indice._textos) == 3
+        assert indice.buscar("Hyundia Kona")[0][0] == 2
@@ -1,10 +1,17 @@
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.orm import sessionmaker
 from database import Base, get_db
 from main import app
+import main
 import models_sql
+import crud
+import busqueda
+import distribuciones
+import matriz_carga
+import snapshot_catalogo
+import tareas
 from auth_utils import get_password_hash
 
 # Base de datos en memoria para testing
@@ -23,6 +30,8 @@ def override_get_db():
 
 
 app.dependency_overrides[get_db] = override_get_db
+# Sin lifespan las tareas corren en línea, contra la misma base que las peticiones
+tareas.cola.session_factory = TestingSessionLocal
 client = TestClient(app)
 
 
@@ -30,6 +39,12 @@ client = TestClient(app)
 def test_db():
     """Fixture que crea y limpia la base de datos para cada test"""
     Base.metadata.create_all(bind=engine)
+    # Los totales de paginación se guardan en memoria entre peticiones
+    crud.invalidar_totales()
+    busqueda.invalidar()
+    distribuciones.invalidar()
+    matriz_carga.invalidar()
+    snapshot_catalogo.invalidar()
     yield TestingSessionLocal()
     Base.metadata.drop_all(bind=engine)
 
@@ -189,6 +204,42 @@ class TestAutosUpdate:
         data = response.json()
         assert data["autonomia_km"] == 600.0
 
+    def test_actualizar_auto_un_solo_statement(self, test_db, auto_test_data, monkeypatch):
+        """Test: La actualización se resuelve con un único UPDATE ... RETURNING"""
+        create_response = client.post("/api/autos", json=auto_test_data)
+        auto_id = create_response.json()["id"]
+
+        # Sin lifespan el refresco de distribuciones correría en línea dentro de la petición
+        async def sin_refresco(entidad):
+            pass
+        monkeypatch.setattr(main, "_encolar_refresco", sin_refresco)
+
+        statements = []
+
+        def contar(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(engine, "before_cursor_execute", contar)
+        try:
+            response = client.put(f"/api/autos/{auto_id}", json={"autonomia_km": 610.0})
+        finally:
+            event.remove(engine, "before_cursor_execute", contar)
+
+        assert response.status_code == 200
+        assert response.json()["autonomia_km"] == 610.0
+        assert response.json()["marca"] == auto_test_data["marca"]
+        assert len(statements) == 1
+        assert statements[0].lstrip().upper().startswith("UPDATE")
+
+    def test_actualizar_auto_sin_cambios(self, test_db, auto_test_data):
+        """Test: Una actualización vacía devuelve el auto sin modificarlo"""
+        create_response = client.post("/api/autos", json=auto_test_data)
+        auto_id = create_response.json()["id"]
+
+        response = client.put(f"/api/autos/{auto_id}", json={})
+        assert response.status_code == 200
+        assert response.json()["autonomia_km"] == auto_test_data["autonomia_km"]
+
     def test_actualizar_auto_inexistente(self, test_db):
         """Test: Fallo al actualizar auto que no existe"""
         update_data = {"autonomia_km": 600.0}
@@ -417,6 +468,573 @@ class TestEstadisticas:
         data = response.json()
         assert isinstance(data, list)
 
+    def test_distribucion_autonomia(self, test_db, auto_test_data):
+        """Test: Histograma y percentiles desde la instantánea, que se refresca al escribir"""
+        client.post("/api/autos", json=auto_test_data)
+        url = "/api/statistics/distribution?entity=autos&field=autonomia_km&bins=2&percentiles=50"
+        assert client.get(url).json()["percentiles"] == {"p50": 500.0}
+
+        client.post("/api/autos", json={**auto_test_data, "modelo": "Model Y", "autonomia_km": 300.0})
+        data = client.get(url).json()
+        assert data["n"] == 2
+        assert data["percentiles"] == {"p50": 400.0}
+        assert data["histograma"] == {"bordes": [300.0, 400.0, 500.0], "conteos": [1, 1]}
+
+    def test_escritura_encola_refresco_de_distribuciones(self, test_db, auto_test_data):
+        """Test: Tras una escritura la instantánea ya está leída cuando llega la siguiente petición"""
+        client.post("/api/autos", json=auto_test_data)
+        copias = distribuciones._instantaneas.actuales()
+        assert copias["autos"]["autonomia_km"].tolist() == [500.0]
+
+        client.delete(f"/api/autos/{client.get('/api/autos').json()[0]['id']}")
+        assert distribuciones._instantaneas.actuales()["autos"]["autonomia_km"].size == 0
+
+    def test_distribucion_campo_invalido(self, test_db):
+        """Test: Campo no numérico o percentil fuera de rango devuelven 400"""
+        assert client.get("/api/statistics/distribution?entity=autos&field=marca").status_code == 400
+        url = "/api/statistics/distribution?entity=estaciones&field=potencia_kw&percentiles=150"
+        assert client.get(url).status_code == 400
+
+
+# ==================== TESTS DE LECTURA POR LOTES ====================
+
+class TestLecturaPorIds:
+    """Pruebas de ?ids=1,2,3 en los listados y en el historial"""
+
+    def test_autos_por_ids_en_orden(self, test_db, auto_test_data):
+        """Test: Se respeta el orden pedido y se informan los ids inexistentes"""
+        primero = client.post("/api/autos", json=auto_test_data).json()["id"]
+        segundo = client.post("/api/autos", json={**auto_test_data, "modelo": "Model Y"}).json()["id"]
+
+        response = client.get(f"/api/autos?ids={segundo},9999,{primero},{segundo}")
+        assert response.status_code == 200
+        assert [a["id"] for a in response.json()] == [segundo, primero]
+        assert response.headers["X-Missing-Ids"] == "9999"
+
+    def test_estaciones_por_ids_sin_faltantes(self, test_db, estacion_test_data):
+        """Test: Sin ids inexistentes no se envía la cabecera"""
+        estacion_id = client.post("/api/estaciones", json=estacion_test_data).json()["id"]
+
+        response = client.get(f"/api/estaciones?ids={estacion_id}")
+        assert [e["nombre"] for e in response.json()] == [estacion_test_data["nombre"]]
+        assert "X-Missing-Ids" not in response.headers
+
+    def test_historial_por_ids(self, test_db, carga_test_data):
+        """Test: El historial de eliminados también admite ids"""
+        carga_id = client.post("/api/cargas", json=carga_test_data).json()["id"]
+        client.delete(f"/api/cargas/{carga_id}")
+
+        response = client.get("/api/historial/cargas?ids=1,2")
+        assert response.status_code == 200
+        data = response.json()
+        assert [c["id_original"] for c in data] == [carga_id]
+        assert response.headers["X-Missing-Ids"] == "2"
+
+    def test_ids_invalidos(self, test_db):
+        """Test: ids mal formados devuelven 400"""
+        assert client.get("/api/cargas?ids=1,a").status_code == 400
+        assert client.get("/api/autos?ids=").status_code == 400
+
+
+class TestProyeccionCampos:
+    """Pruebas de ?fields= en los listados"""
+
+    def test_listado_con_fields(self, test_db, estacion_test_data):
+        """Test: Solo se devuelven las columnas pedidas más el id"""
+        client.post("/api/estaciones", json=estacion_test_data)
+
+        response = client.get("/api/estaciones?fields=nombre,potencia_kw")
+        assert response.status_code == 200
+        data = response.json()
+        assert set(data[0]) == {"id", "nombre", "potencia_kw"}
+        assert data[0]["nombre"] == estacion_test_data["nombre"]
+
+    def test_fields_con_ids(self, test_db, auto_test_data):
+        """Test: fields se combina con ids y conserva la cabecera de faltantes"""
+        auto_id = client.post("/api/autos", json=auto_test_data).json()["id"]
+
+        response = client.get(f"/api/autos?ids={auto_id},9999&fields=modelo")
+        assert response.json() == [{"id": auto_id, "modelo": auto_test_data["modelo"]}]
+        assert response.headers["X-Missing-Ids"] == "9999"
+
+    def test_fields_invalido(self, test_db):
+        """Test: Un campo desconocido devuelve 400"""
+        response = client.get("/api/cargas?fields=modelo_auto,hashed_password")
+        assert response.status_code == 400
+        assert "hashed_password" in response.json()["detail"]
+
+
+class TestFormatos:
+    """Pruebas de Accept: application/msgpack y layout=columns"""
+
+    def test_listado_msgpack(self, test_db, auto_test_data):
+        """Test: El listado completo se devuelve en MessagePack si se pide"""
+        msgpack = pytest.importorskip("msgpack")
+        client.post("/api/autos", json=auto_test_data)
+
+        response = client.get("/api/autos", headers={"Accept": "application/msgpack"})
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/msgpack"
+        data = msgpack.unpackb(response.content)
+        assert data == client.get("/api/autos").json()
+
+    def test_listado_por_columnas(self, test_db, auto_test_data):
+        """Test: layout=columns devuelve un array por campo"""
+        client.post("/api/autos", json=auto_test_data)
+        client.post("/api/autos", json={**auto_test_data, "modelo": "Model Y"})
+
+        data = client.get("/api/autos?layout=columns&fields=modelo").json()
+        assert data == {"id": [1, 2], "modelo": [auto_test_data["modelo"], "Model Y"]}
+
+    def test_estadisticas_y_cambios_msgpack(self, test_db, auto_test_data):
+        """Test: Estadísticas y feed de cambios también negocian el formato"""
+        msgpack = pytest.importorskip("msgpack")
+        client.post("/api/autos", json=auto_test_data)
+        cabeceras = {"Accept": "application/msgpack"}
+
+        stats = client.get("/api/statistics/cars_by_brand?layout=columns", headers=cabeceras)
+        assert msgpack.unpackb(stats.content) == {"marca": [auto_test_data["marca"]], "count": [1]}
+        cambios = msgpack.unpackb(client.get("/api/autos/changes", headers=cabeceras).content)
+        assert cambios["cambios"][0]["datos"]["modelo"] == auto_test_data["modelo"]
+
+
+class TestTotales:
+    """Pruebas de X-Total-Count / X-Total-Is-Estimate y crud.contar"""
+
+    def test_total_exacto_y_mantenido(self, test_db, auto_test_data):
+        """Test: El total se informa y se ajusta con las altas y bajas"""
+        auto_id = client.post("/api/autos", json=auto_test_data).json()["id"]
+        client.post("/api/autos", json={**auto_test_data, "modelo": "Model Y"})
+
+        response = client.get("/api/autos?limit=1")
+        assert len(response.json()) == 1
+        assert response.headers["X-Total-Count"] == "2"
+        assert response.headers["X-Total-Is-Estimate"] == "false"
+
+        client.delete(f"/api/autos/{auto_id}")
+        assert client.get("/api/autos?limit=1").headers["X-Total-Count"] == "1"
+
+    def test_estimacion_con_estadisticas(self, test_db, auto_test_data, monkeypatch):
+        """Test: Por encima del umbral se usan las estadísticas de SQLite (sqlite_stat1)"""
+        for i in range(3):
+            client.post("/api/autos", json={**auto_test_data, "modelo": f"Model {i}"})
+        test_db.execute(text("ANALYZE"))
+        test_db.commit()
+        monkeypatch.setattr(crud, "CONTEO_UMBRAL", 2)
+        crud.invalidar_totales()
+
+        assert crud.contar(test_db, "autos") == (3, True)
+
+    def test_contar_con_filtro_acotado(self, test_db, auto_test_data, monkeypatch):
+        """Test: Con filtros se cuenta hasta el umbral y después se marca como estimación"""
+        for i in range(3):
+            client.post("/api/autos", json={**auto_test_data, "modelo": f"Model {i}"})
+        filtro = models_sql.AutoElectricoSQL.marca == auto_test_data["marca"]
+
+        assert crud.contar(test_db, "autos", filtro) == (3, False)
+        monkeypatch.setattr(crud, "CONTEO_UMBRAL", 1)
+        assert crud.contar(test_db, "autos", filtro) == (2, True)
+
+
+# ==================== TESTS DE AUTOCOMPLETADO ====================
+
+class TestSugerencias:
+    """Pruebas de GET /api/suggest"""
+
+    def test_sugerencias_siguen_las_escrituras(self, test_db, auto_test_data):
+        """Test: El índice se construye una vez y se actualiza con los cambios de crud"""
+        auto_id = client.post("/api/autos", json=auto_test_data).json()["id"]
+
+        response = client.get("/api/suggest?entity=autos&q=mod")
+        assert response.status_code == 200
+        assert response.json() == [{"texto": "Model 3", "campo": "modelo", "total": 1}]
+
+        client.post("/api/autos", json={**auto_test_data, "modelo": "Model Y"})
+        client.put(f"/api/autos/{auto_id}", json={"modelo": "Cybertruck"})
+        assert [s["texto"] for s in client.get("/api/suggest?entity=autos&q=mod").json()] == ["Model Y"]
+
+        client.delete(f"/api/autos/{auto_id}")
+        assert client.get("/api/suggest?entity=autos&q=cyb").json() == []
+
+    def test_busqueda_aproximada(self, test_db, auto_test_data, estacion_test_data):
+        """Test: Con fuzzy=true la búsqueda tolera erratas y sigue las escrituras"""
+        assert client.get("/api/autos/search/?modelo=Modle").status_code == 404
+        client.post("/api/autos", json=auto_test_data)
+
+        response = client.get("/api/autos/search/?modelo=Modle&fuzzy=true")
+        assert response.status_code == 200
+        assert [a["modelo"] for a in response.json()] == [auto_test_data["modelo"]]
+
+        client.post("/api/estaciones", json=estacion_test_data)
+        response = client.get("/api/estaciones/search/?nombre=Superchargr&fuzzy=true")
+        assert response.json()[0]["nombre"] == estacion_test_data["nombre"]
+        assert client.get("/api/estaciones/search/?nombre=qqqq&fuzzy=true").status_code == 404
+
+    def test_sugerencias_parametros_invalidos(self, test_db):
+        """Test: Entidad desconocida o q vacío devuelven 422"""
+        assert client.get("/api/suggest?entity=usuarios&q=a").status_code == 422
+        assert client.get("/api/suggest?entity=autos&q=").status_code == 422
+
+
+# ==================== TESTS DE FACETAS ====================
+
+class TestFacetas:
+    """Pruebas de GET /api/{entidad}/facets"""
+
+    def test_facetas_sin_filtro(self, test_db, auto_test_data):
+        """Test: Resultados y conteos de todas las facetas en una respuesta"""
+        client.post("/api/autos", json=auto_test_data)
+        client.post("/api/autos", json={**auto_test_data, "modelo": "Model Y", "disponible": False})
+        client.post("/api/autos", json={**auto_test_data, "marca": "Kia", "modelo": "EV6", "anio": 2022})
+
+        response = client.get("/api/autos/facets")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["total"] == 3 and len(data["resultados"]) == 3
+        assert data["facetas"]["marca"] == [{"valor": "Tesla", "total": 2}, {"valor": "Kia", "total": 1}]
+        assert data["facetas"]["anio"] == [{"valor": 2023, "total": 2}, {"valor": 2022, "total": 1}]
+        assert {"valor": False, "total": 1} in data["facetas"]["disponible"]
+
+    def test_facetas_con_filtros(self, test_db, auto_test_data):
+        """Test: Los conteos y resultados respetan el filtro actual (OR dentro de una faceta)"""
+        client.post("/api/autos", json=auto_test_data)
+        client.post("/api/autos", json={**auto_test_data, "modelo": "Model Y", "disponible": False})
+        client.post("/api/autos", json={**auto_test_data, "marca": "Kia", "modelo": "EV6", "anio": 2022})
+
+        data = client.get("/api/autos/facets?marca=Tesla&disponible=true").json()
+        assert data["total"] == 1
+        assert [a["modelo"] for a in data["resultados"]] == ["Model 3"]
+        assert data["facetas"]["anio"] == [{"valor": 2023, "total": 1}]
+
+        data = client.get("/api/autos/facets?anio=2022,2023&limit=1").json()
+        assert data["total"] == 3 and len(data["resultados"]) == 1
+
+    def test_facetas_estaciones_y_valor_invalido(self, test_db, estacion_test_data):
+        """Test: Facetas de estaciones y 400 con un valor mal tipado"""
+        client.post("/api/estaciones", json=estacion_test_data)
+
+        data = client.get("/api/estaciones/facets?acceso_publico=true").json()
+        assert data["facetas"]["tipo_conector"] == [{"valor": "Tesla", "total": 1}]
+        assert client.get("/api/estaciones/facets?acceso_publico=quizas").status_code == 400
+        assert client.get("/api/autos/facets?anio=dos").status_code == 400
+
+
+# ==================== TESTS DE HORARIOS DE APERTURA ====================
+
+class TestHorarioApertura:
+    """Pruebas del filtro open_at sobre los intervalos de horarios_estaciones"""
+
+    def test_listado_open_at(self, test_db, estacion_test_data):
+        """Test: Solo salen las estaciones abiertas en el momento pedido"""
+        client.post("/api/estaciones", json=estacion_test_data)
+        client.post("/api/estaciones", json={**estacion_test_data, "nombre": "Oficina",
+                                             "horario_apertura": "L-V 9:00-17:00"})
+        client.post("/api/estaciones", json={**estacion_test_data, "nombre": "Nocturna",
+                                             "horario_apertura": "22:00-06:00"})
+
+        response = client.get("/api/estaciones?open_at=X 10:00")
+        assert response.status_code == 200
+        assert sorted(e["nombre"] for e in response.json()) == ["Oficina", "Supercharger Test"]
+        assert response.headers["X-Total-Count"] == "2"
+
+        nombres = [e["nombre"] for e in client.get("/api/estaciones?open_at=D 03:30&fields=nombre").json()]
+        assert sorted(nombres) == ["Nocturna", "Supercharger Test"]
+        assert client.get("/api/estaciones/search/?nombre=Oficina&open_at=S 10:00").status_code == 404
+        assert client.get("/api/estaciones/search/?nombre=Oficina&open_at=V 16:59").status_code == 200
+
+    def test_busqueda_aproximada_open_at(self, test_db, estacion_test_data):
+        """Test: fuzzy=true con open_at filtra por horario sin fallar"""
+        client.post("/api/estaciones", json={**estacion_test_data, "nombre": "Estacion Centro",
+                                             "horario_apertura": "L-V 9:00-17:00"})
+
+        response = client.get("/api/estaciones/search/?nombre=Estacoin Centro&fuzzy=true&open_at=X 10:00")
+        assert response.status_code == 200
+        assert [e["nombre"] for e in response.json()] == ["Estacion Centro"]
+        assert client.get("/api/estaciones/search/?nombre=Estacoin Centro&fuzzy=true&open_at=D 10:00").status_code == 404
+
+    def test_horario_actualizado_y_borrado(self, test_db, estacion_test_data):
+        """Test: Los intervalos se sustituyen al actualizar el horario y se eliminan con la estación"""
+        estacion_id = client.post("/api/estaciones", json=estacion_test_data).json()["id"]
+        client.put(f"/api/estaciones/{estacion_id}", json={"horario_apertura": "S-D 10:00-14:00"})
+        assert client.get("/api/estaciones?open_at=L 12:00").json() == []
+        assert len(client.get("/api/estaciones?open_at=D 12:00").json()) == 1
+
+        client.delete(f"/api/estaciones/{estacion_id}")
+        assert test_db.query(models_sql.IntervaloHorarioSQL).count() == 0
+
+    def test_open_at_invalido(self, test_db):
+        """Test: 400 con un momento que no se entiende"""
+        assert client.get("/api/estaciones?open_at=mañana").status_code == 400
+        assert client.get("/api/estaciones?open_at=now&ids=1").status_code == 400
+
+
+# ==================== TESTS DE TIEMPO Y COSTE DE CARGA ====================
+
+class TestMatrizCarga:
+    """Pruebas de GET /api/autos/{auto_id}/estaciones"""
+
+    def test_estaciones_mas_baratas_y_rapidas(self, test_db, auto_test_data, carga_test_data, estacion_test_data):
+        """Test: Orden por coste y por tiempo, con la potencia AC limitada por las cargas del modelo"""
+        auto_id = client.post("/api/autos", json=auto_test_data).json()["id"]
+        # Tesla Model 3: 75 kWh en 8 h -> 9.375 kW en AC
+        client.post("/api/cargas", json=carga_test_data)
+        client.post("/api/estaciones", json=estacion_test_data)
+        client.post("/api/estaciones", json={**estacion_test_data, "nombre": "Casa", "potencia_kw": 22.0,
+                                             "coste_por_kwh": 0.15})
+
+        response = client.get(f"/api/autos/{auto_id}/estaciones?sort=cost")
+        assert response.status_code == 200
+        data = response.json()
+        assert [r["estacion"]["nombre"] for r in data] == ["Casa", "Supercharger Test"]
+        assert data[0]["energia_kwh"] == 52.5
+        assert data[0]["coste"] == round(52.5 / 0.9 * 0.15, 2)
+        assert data[0]["tiempo_horas"] == round(52.5 / (9.375 * 0.9), 3)
+
+        data = client.get(f"/api/autos/{auto_id}/estaciones?sort=time&k=1").json()
+        assert [r["estacion"]["nombre"] for r in data] == ["Supercharger Test"]
+
+    def test_actualizacion_incremental(self, test_db, auto_test_data, estacion_test_data):
+        """Test: Los cambios de estaciones llegan a la matriz sin reconstruirla"""
+        auto_id = client.post("/api/autos", json=auto_test_data).json()["id"]
+        client.post("/api/estaciones", json=estacion_test_data)
+        client.get(f"/api/autos/{auto_id}/estaciones")
+        construida = matriz_carga._matriz.actuales()[None]
+
+        barata = client.post("/api/estaciones", json={**estacion_test_data, "nombre": "Barata",
+                                                      "coste_por_kwh": 0.05}).json()
+        data = client.get(f"/api/autos/{auto_id}/estaciones").json()
+        assert data[0]["estacion_id"] == barata["id"]
+        client.delete(f"/api/estaciones/{barata['id']}")
+        data = client.get(f"/api/autos/{auto_id}/estaciones").json()
+        assert [r["estacion"]["nombre"] for r in data] == ["Supercharger Test"]
+        assert matriz_carga._matriz.actuales()[None] is construida
+        assert client.get("/api/autos/9999/estaciones").status_code == 404
+
+    def test_estaciones_recomendadas(self, test_db, auto_test_data, estacion_test_data):
+        """Test: Ranking por distancia con pesos del cliente y conectores de la marca"""
+        auto_id = client.post("/api/autos", json=auto_test_data).json()["id"]
+        client.post("/api/estaciones", json={**estacion_test_data, "latitud": 4.711, "longitud": -74.072})
+        client.post("/api/estaciones", json={**estacion_test_data, "nombre": "Medellín", "latitud": 6.244,
+                                             "longitud": -75.581, "coste_por_kwh": 0.10})
+        client.post("/api/estaciones", json={**estacion_test_data, "nombre": "CHAdeMO", "tipo_conector": "CHAdeMO"})
+
+        response = client.get(f"/api/autos/{auto_id}/recommended_stations?lat=4.7&lon=-74.07&w_cost=0&w_distance=1")
+        assert response.status_code == 200
+        data = response.json()
+        # Un Tesla no usa CHAdeMO
+        assert [r["estacion"]["nombre"] for r in data] == ["Supercharger Test", "Medellín"]
+        assert data[0]["distancia_km"] < 2
+
+        data = client.get(f"/api/autos/{auto_id}/recommended_stations?w_cost=1&w_distance=0").json()
+        assert data[0]["estacion"]["nombre"] == "Medellín"
+        assert client.get(f"/api/autos/{auto_id}/recommended_stations?lat=4.7").status_code == 400
+        assert client.get("/api/autos/9999/recommended_stations").status_code == 404
+
+
+# ==================== TESTS DE ENLACE CARGAS - AUTOS ====================
+
+class TestAutoCompleto:
+    """Pruebas de cargas.auto_id y GET /api/autos/{auto_id}/full"""
+
+    def test_emparejar_cargas(self):
+        """Test: Marca y modelo normalizados; solo modelo si es de una única marca; el año más reciente gana"""
+        autos = [
+            {"id": 1, "marca": "Tesla", "modelo": "Model 3", "anio": 2021},
+            {"id": 2, "marca": "Tesla", "modelo": "Model 3", "anio": 2023},
+            {"id": 3, "marca": "Citroën", "modelo": "ë-C4", "anio": 2022},
+            {"id": 4, "marca": "Kia", "modelo": "EV", "anio": 2022},
+            {"id": 5, "marca": "Hyundai", "modelo": "EV", "anio": 2022},
+        ]
+        cargas = [
+            {"id": 10, "modelo_auto": "tesla  model 3"},
+            {"id": 11, "modelo_auto": "Citroen e-C4"},
+            {"id": 12, "modelo_auto": "Model 3"},
+            {"id": 13, "modelo_auto": "EV"},
+            {"id": 14, "modelo_auto": "Nissan Leaf"},
+        ]
+        assert crud.emparejar_cargas(autos, cargas) == {10: 2, 11: 3, 12: 2}
+
+    def test_enlace_al_crear_igual_que_emparejar(self, test_db, auto_test_data, carga_test_data):
+        """Test: Al crear una carga se enlaza sin distinguir acentos, como en el enlace por lotes"""
+        auto_id = client.post("/api/autos", json={**auto_test_data, "marca": "Citroën", "modelo": "ë-C4"}).json()["id"]
+        for texto in ("Citroen e-C4", "e-c4"):
+            carga = client.post("/api/cargas", json={**carga_test_data, "modelo_auto": texto}).json()
+            assert carga["auto_id"] == auto_id
+
+    def test_carga_enlazada_y_detalle(self, test_db, auto_test_data, carga_test_data, estacion_test_data):
+        """Test: La carga se enlaza al crearla y /full devuelve auto, cargas y estaciones compatibles"""
+        auto_id = client.post("/api/autos", json=auto_test_data).json()["id"]
+        carga = client.post("/api/cargas", json=carga_test_data).json()
+        assert carga["auto_id"] == auto_id
+        otra = client.post("/api/cargas", json={**carga_test_data, "modelo_auto": "Nissan Leaf"}).json()
+        assert otra["auto_id"] is None
+        client.post("/api/estaciones", json=estacion_test_data)
+        client.post("/api/estaciones", json={**estacion_test_data, "nombre": "CHAdeMO", "tipo_conector": "CHAdeMO"})
+
+        response = client.get(f"/api/autos/{auto_id}/full")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["auto"]["modelo"] == "Model 3"
+        assert [c["id"] for c in data["cargas"]] == [carga["id"]]
+        assert data["estaciones"]["total"] == 1
+        assert data["estaciones"]["mas_barata"]["estacion_id"] == data["estaciones"]["mas_rapida"]["estacion_id"]
+
+    def test_auto_sin_cargas_y_borrado(self, test_db, auto_test_data, carga_test_data):
+        """Test: /full sin cargas, 404 y auto_id a NULL al borrar el auto"""
+        auto_id = client.post("/api/autos", json=auto_test_data).json()["id"]
+        assert client.get(f"/api/autos/{auto_id}/full").json()["cargas"] == []
+        carga_id = client.post("/api/cargas", json={**carga_test_data, "auto_id": auto_id}).json()["id"]
+        assert client.post("/api/cargas", json={**carga_test_data, "auto_id": 999}).status_code == 400
+
+        client.delete(f"/api/autos/{auto_id}")
+        assert client.get(f"/api/cargas/{carga_id}").json()["auto_id"] is None
+        assert client.get(f"/api/autos/{auto_id}/full").status_code == 404
+
+
+# ==================== TESTS DEL FEED DE CAMBIOS ====================
+
+class TestSnapshotCatalogo:
+    """Pruebas de los endpoints servidos desde snapshot_catalogo (SNAPSHOT_CATALOGO=true)"""
+
+    @pytest.fixture(autouse=True)
+    def activar(self, monkeypatch):
+        monkeypatch.setattr(snapshot_catalogo, "SNAPSHOT_CATALOGO", True)
+
+    def test_lecturas_iguales_que_desde_la_base(self, test_db, auto_test_data, monkeypatch):
+        """Test: Listado, detalle, ids, facetas y estadísticas coinciden con la lectura de la base"""
+        client.post("/api/autos", json=auto_test_data)
+        client.post("/api/autos", json={**auto_test_data, "modelo": "Model Y", "disponible": False, "url_imagen": None})
+        client.post("/api/autos", json={**auto_test_data, "marca": "Kia", "modelo": "EV6", "anio": 2022})
+        urls = ["/api/autos", "/api/autos?skip=1&limit=1&fields=modelo,anio", "/api/autos?ids=3,1,9",
+                "/api/autos/2", "/api/autos/facets?marca=Tesla", "/api/statistics/cars_by_brand"]
+
+        desde_snapshot = [client.get(url) for url in urls]
+        assert snapshot_catalogo.tabla(test_db, "autos") is not None
+        monkeypatch.setattr(snapshot_catalogo, "SNAPSHOT_CATALOGO", False)
+        desde_base = [client.get(url) for url in urls]
+        for url, a, b in zip(urls, desde_snapshot, desde_base):
+            assert a.json() == b.json(), url
+            assert a.headers.get("X-Total-Count") == b.headers.get("X-Total-Count"), url
+        assert desde_snapshot[2].headers["X-Missing-Ids"] == "9"
+
+    def test_escrituras_se_reflejan(self, test_db, estacion_test_data):
+        """Test: Altas, cambios y bajas se aplican a la copia sin releer la tabla"""
+        primera = client.post("/api/estaciones", json=estacion_test_data).json()
+        assert client.get("/api/estaciones").headers["X-Total-Count"] == "1"
+        tabla = snapshot_catalogo.tabla(test_db, "estaciones")
+
+        segunda = client.post("/api/estaciones", json={**estacion_test_data, "tipo_conector": "CCS"}).json()
+        client.put(f"/api/estaciones/{primera['id']}", json={"potencia_kw": 150.0})
+        assert client.get(f"/api/estaciones/{primera['id']}").json()["potencia_kw"] == 150.0
+        stats = client.get("/api/statistics/station_power_by_connector_type").json()
+        assert stats == [{"tipo_conector": "CCS", "avg_potencia_kw": 250.0},
+                         {"tipo_conector": "Tesla", "avg_potencia_kw": 150.0}]
+
+        client.delete(f"/api/estaciones/{primera['id']}")
+        assert client.get(f"/api/estaciones/{primera['id']}").status_code == 404
+        assert [e["id"] for e in client.get("/api/estaciones").json()] == [segunda["id"]]
+        assert snapshot_catalogo.tabla(test_db, "estaciones") is tabla
+
+    def test_sin_memoria_lee_de_la_base(self, test_db, carga_test_data, monkeypatch):
+        """Test: Si la copia no cabe en SNAPSHOT_MAX_MB se sirve desde la base"""
+        monkeypatch.setattr(snapshot_catalogo, "SNAPSHOT_MAX_MB", 0)
+        carga = client.post("/api/cargas", json=carga_test_data).json()
+        assert snapshot_catalogo.tabla(test_db, "cargas") is None
+        assert client.get(f"/api/cargas/{carga['id']}").json()["modelo_auto"] == "Tesla Model 3"
+        assert client.get("/api/statistics/charge_difficulty_distribution").json() == [{"dificultad": "Baja", "count": 1}]
+
+
+class TestCambios:
+    """Pruebas de GET /api/{entidad}/changes"""
+
+    def test_feed_incremental(self, test_db, auto_test_data):
+        """Test: Solo se devuelven los cambios posteriores al token, incluidos los borrados"""
+        auto_id = client.post("/api/autos", json=auto_test_data).json()["id"]
+        otro = client.post("/api/autos", json={**auto_test_data, "modelo": "Model Y"}).json()["id"]
+
+        inicial = client.get("/api/autos/changes").json()
+        assert [c["id"] for c in inicial["cambios"]] == [auto_id, otro]
+        assert inicial["cambios"][0]["datos"]["created_at"] is not None
+
+        client.put(f"/api/autos/{auto_id}", json={"autonomia_km": 520.0})
+        client.delete(f"/api/autos/{otro}")
+
+        response = client.get(f"/api/autos/changes?since={inicial['token']}")
+        assert response.status_code == 200
+        data = response.json()
+        assert [(c["accion"], c["id"]) for c in data["cambios"]] == [("upsert", auto_id), ("delete", otro)]
+        assert data["cambios"][0]["datos"]["autonomia_km"] == 520.0
+        assert data["token"] > inicial["token"]
+
+        vacio = client.get(f"/api/autos/changes?since={data['token']}").json()
+        assert vacio["cambios"] == [] and vacio["token"] == data["token"]
+
+    def test_feed_paginado(self, test_db, estacion_test_data):
+        """Test: Con limit se indica que hay más cambios pendientes"""
+        for i in range(3):
+            client.post("/api/estaciones", json={**estacion_test_data, "nombre": f"Estación {i}"})
+
+        data = client.get("/api/estaciones/changes?limit=2").json()
+        assert len(data["cambios"]) == 2 and data["hay_mas"]
+        resto = client.get(f"/api/estaciones/changes?since={data['token']}&limit=2").json()
+        assert len(resto["cambios"]) == 1 and not resto["hay_mas"]
+
+    def test_entidad_invalida(self, test_db):
+        """Test: Una entidad desconocida devuelve 422"""
+        assert client.get("/api/usuarios/changes").status_code == 422
+
+
+# ==================== TESTS DE MONITOREO ====================
+
+class TestMetricas:
+    """Pruebas del endpoint /metrics"""
+
+    def test_metrics_formato_prometheus(self, test_db, auto_test_data):
+        """Test: /metrics expone conteos y latencias por plantilla de ruta"""
+        create_response = client.post("/api/autos", json=auto_test_data)
+        client.get(f"/api/autos/{create_response.json()['id']}")
+
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        cuerpo = response.text
+        assert 'http_requests_total{method="GET",route="/api/autos/{auto_id}",status="200"}' in cuerpo
+        assert "# TYPE http_request_duration_seconds histogram" in cuerpo
+        assert 'http_request_duration_seconds_bucket{method="POST",route="/api/autos",le="+Inf"}' in cuerpo
+        assert "http_requests_in_flight" in cuerpo
+
+    def test_aciertos_de_caches(self, test_db, auto_test_data):
+        """Test: /metrics cuenta aciertos y fallos de las cachés internas"""
+        client.post("/api/autos", json=auto_test_data)
+        client.get("/api/autos")
+        client.get("/api/autos")
+        client.get("/api/suggest?entity=autos&q=mod")
+
+        cuerpo = client.get("/metrics").text
+        assert 'cache_requests_total{cache="totales",result="hit"}' in cuerpo
+        assert 'cache_requests_total{cache="busqueda",result="miss"}' in cuerpo
+        assert 'cache_hit_ratio{cache="totales"}' in cuerpo
+
+    def test_server_timing_en_respuestas(self, test_db):
+        """Test: Las respuestas incluyen el tiempo en base de datos"""
+        response = client.get("/api/autos")
+        assert response.headers["server-timing"].startswith("db;dur=")
+
+
+
+# ==================== TESTS DE IMÁGENES ====================
+
+class TestSubirImagen:
+    """Pruebas de POST /api/upload-image"""
+
+    def test_url_con_archivo_escrito(self, monkeypatch, tmp_path):
+        """Test: La URL devuelta apunta a un archivo que ya existe"""
+        monkeypatch.setattr(main, "UPLOAD_DIRECTORY", tmp_path)
+        response = client.post("/api/upload-image", files={"file": ("foto.png", b"\x89PNG datos", "image/png")})
+        assert response.status_code == 200
+        nombre = response.json()["url"].rsplit("/", 1)[1]
+        assert (tmp_path / nombre).read_bytes() == b"\x89PNG datos"
+
 
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
\ No newline at end of file
@@ -0,0 +1,169 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import select, text
+
+import database
+import db_init
+from database import Base, crear_engine, crear_sessionmaker
+import models_sql
+import monitoreo_sql
+
+
+@pytest.fixture
+def engines_replicados(tmp_path):
+    """Primario y réplica como dos archivos SQLite independientes"""
+    primario = crear_engine(f"sqlite:///{tmp_path / 'primario.db'}")
+    replica = crear_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    Base.metadata.create_all(bind=primario)
+    Base.metadata.create_all(bind=replica)
+    yield primario, replica
+    primario.dispose()
+    replica.dispose()
+
+
+def _auto(modelo):
+    return models_sql.AutoElectricoSQL(
+        marca="Tesla", modelo=modelo, anio=2023,
+        capacidad_bateria_kwh=75.0, autonomia_km=500.0, disponible=True
+    )
+
+
+class TestReplicasLectura:
+    """Pruebas del enrutado de lecturas a réplicas"""
+
+    def test_lecturas_van_a_la_replica(self, engines_replicados):
+        """Test: Un SELECT sin escrituras previas se resuelve en la réplica"""
+        primario, replica = engines_replicados
+        SessionReplica = crear_sessionmaker(replica)
+        with SessionReplica() as db:
+            db.add(_auto("Solo Replica"))
+            db.commit()
+
+        SessionLocal = crear_sessionmaker(primario, [replica])
+        with SessionLocal() as db:
+            db.enrutador.ventana_escritura = 0
+            modelos = db.scalars(select(models_sql.AutoElectricoSQL.modelo)).all()
+        assert modelos == ["Solo Replica"]
+
+    def test_escrituras_van_al_primario(self, engines_replicados):
+        """Test: Las escrituras se aplican en el primario, no en la réplica"""
+        primario, replica = engines_replicados
+        SessionLocal = crear_sessionmaker(primario, [replica])
+        with SessionLocal() as db:
+            db.add(_auto("Model 3"))
+            db.commit()
+
+        with crear_sessionmaker(primario)() as db:
+            assert db.scalar(select(models_sql.AutoElectricoSQL.modelo)) == "Model 3"
+        with crear_sessionmaker(replica)() as db:
+            assert db.scalar(select(models_sql.AutoElectricoSQL.modelo)) is None
+
+    def test_read_your_writes(self, engines_replicados):
+        """Test: La sesión que escribió sigue leyendo del primario"""
+        primario, replica = engines_replicados
+        SessionLocal = crear_sessionmaker(primario, [replica])
+        with SessionLocal() as db:
+            db.enrutador.ventana_escritura = 0
+            db.add(_auto("Model Y"))
+            db.commit()
+            assert db.escribio
+            assert db.scalar(select(models_sql.AutoElectricoSQL.modelo)) == "Model Y"
+
+    def test_replica_con_retraso_usa_primario(self, engines_replicados):
+        """Test: Si la réplica supera el retraso máximo se lee del primario"""
+        primario, replica = engines_replicados
+        with crear_sessionmaker(primario)() as db:
+            db.add(_auto("Leaf"))
+            db.commit()
+
+        SessionLocal = crear_sessionmaker(primario, [replica])
+        with SessionLocal() as db:
+            db.enrutador.ventana_escritura = 0
+            db.enrutador.medir_lag = lambda engine: 60.0
+            assert db.scalar(select(models_sql.AutoElectricoSQL.modelo)) == "Leaf"
+
+    def test_escritura_de_otro_cliente_no_saca_de_la_replica(self, engines_replicados):
+        """Test: La ventana de read-your-writes es del cliente que escribió, no de todo el proceso"""
+        primario, replica = engines_replicados
+        SessionLocal = crear_sessionmaker(primario, [replica])
+
+        escritor = database.iniciar_cliente()
+        with SessionLocal() as db:
+            db.add(_auto("Ioniq 5"))
+            db.commit()
+            assert db.enrutador.engine_lectura() is primario
+        database.finalizar_cliente(escritor)
+
+        lector = database.iniciar_cliente()
+        with SessionLocal() as db:
+            assert db.enrutador.engine_lectura() is replica
+        database.finalizar_cliente(lector)
+
+    def test_cookie_de_ultima_escritura(self, engines_replicados):
+        """Test: El middleware devuelve la cookie al escribir y la usa en las lecturas siguientes"""
+        primario, replica = engines_replicados
+        enrutador = database.EnrutadorReplicas(primario, [replica])
+        app = FastAPI()
+        app.add_middleware(database.LecturasPropiasMiddleware, ventana=60)
+
+        @app.post("/escribir")
+        def escribir():
+            enrutador.registrar_escritura()
+
+        @app.get("/leer")
+        def leer():
+            return {"primario": enrutador.engine_lectura() is primario}
+
+        cliente = TestClient(app)
+        assert cliente.get("/leer").json() == {"primario": False}
+        respuesta = cliente.post("/escribir")
+        assert database.COOKIE_ULTIMA_ESCRITURA in respuesta.cookies
+        assert cliente.get("/leer").json() == {"primario": True}
+        assert TestClient(app).get("/leer").json() == {"primario": False}
+
+
+class TestMonitoreoSQL:
+    """Pruebas de la instrumentación de consultas por petición"""
+
+    def test_normalizar_sql(self):
+        """Test: Literales, parámetros y listas IN se reemplazan por '?'"""
+        sql = "SELECT * FROM autos WHERE  id IN (?, ?, ?) AND marca = 'Tesla' LIMIT 10"
+        assert monitoreo_sql.normalizar_sql(sql) == "SELECT * FROM autos WHERE id IN (?) AND marca = ? LIMIT ?"
+
+    def test_cuenta_consultas_de_la_peticion(self, engines_replicados, caplog):
+        """Test: Se cuentan las consultas y se detecta el patrón N+1"""
+        primario, _ = engines_replicados
+        SessionLocal = crear_sessionmaker(primario)
+
+        token = monitoreo_sql.iniciar_peticion("/prueba")
+        with SessionLocal() as db:
+            for auto_id in range(monitoreo_sql.SQL_N_PLUS_ONE_THRESHOLD):
+                db.scalar(select(models_sql.AutoElectricoSQL).where(models_sql.AutoElectricoSQL.id == auto_id))
+        with caplog.at_level("WARNING", logger="monitoreo_sql"):
+            stats = monitoreo_sql.finalizar_peticion(token)
+
+        assert stats.consultas == monitoreo_sql.SQL_N_PLUS_ONE_THRESHOLD
+        assert stats.tiempo_db > 0
+        assert "Posible N+1" in caplog.text
+        assert monitoreo_sql.resumen()["rutas"]["/prueba"]["peticiones"] >= 1
+
+
+class TestMigracionEsquema:
+    """Pruebas de migrar_esquema sobre bases ya desplegadas"""
+
+    def test_columna_nueva_con_clave_foranea(self, tmp_path):
+        """Test: cargas.auto_id añadida por ALTER TABLE conserva su REFERENCES ... ON DELETE SET NULL"""
+        engine = crear_engine(f"sqlite:///{tmp_path / 'antigua.db'}")
+        Base.metadata.create_all(bind=engine, tables=[t for t in Base.metadata.sorted_tables if t.name != "cargas"])
+        with engine.begin() as conn:
+            conn.execute(text("CREATE TABLE cargas (id INTEGER PRIMARY KEY, modelo_auto VARCHAR(50) NOT NULL)"))
+
+        db_init.migrar_esquema(engine)
+        # La reflexión de SQLAlchemy no lee ON DELETE de una columna añadida; PRAGMA sí
+        with engine.connect() as conn:
+            claves = conn.execute(text("PRAGMA foreign_key_list(cargas)")).all()
+        engine.dispose()
+        assert [(c.table, c._mapping["from"], c.to, c.on_delete) for c in claves] == [
+            ("autos_electricos", "auto_id", "id", "SET NULL")
+        ]
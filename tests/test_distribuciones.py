@@ -0,0 +1,58 @@
+"""
+Pruebas de histogramas y percentiles (distribuciones.py)
+"""
+
+import numpy as np
+
+import distribuciones
+import eventos
+from database import Base, crear_engine, crear_sessionmaker
+
+
+class TestDistribucion:
+    """Pruebas del resumen, percentiles e histograma de una columna"""
+
+    def test_distribucion_percentiles_e_histograma(self):
+        """Test: Percentiles con interpolación lineal e histograma de anchos iguales"""
+        valores = np.arange(1, 101, dtype=np.float64)
+        resultado = distribuciones.distribucion(valores, bins=4, percentiles=[0, 50, 90])
+
+        assert resultado["n"] == 100
+        assert (resultado["min"], resultado["max"]) == (1.0, 100.0)
+        assert resultado["media"] == 50.5
+        # Interpolación lineal, igual que percentile_cont
+        assert resultado["percentiles"] == {"p0": 1.0, "p50": 50.5, "p90": 90.1}
+        assert resultado["histograma"]["conteos"] == [25, 25, 25, 25]
+        assert resultado["histograma"]["bordes"] == [1.0, 25.75, 50.5, 75.25, 100.0]
+
+    def test_distribucion_vacia(self):
+        """Test: Sin valores todo es None y el histograma está vacío"""
+        resultado = distribuciones.distribucion(np.array([]), percentiles=[50])
+        assert resultado["n"] == 0
+        assert resultado["percentiles"] == {"p50": None}
+        assert resultado["histograma"] == {"bordes": [], "conteos": []}
+
+
+class TestInstantanea:
+    """Pruebas de la instantánea por columnas de cada entidad"""
+
+    def test_escritura_durante_la_lectura_no_se_guarda(self, tmp_path, monkeypatch):
+        """Test: Lo leído mientras llega una escritura se usa pero no se guarda"""
+        engine = crear_engine(f"sqlite:///{tmp_path / 'distribuciones.db'}")
+        Base.metadata.create_all(bind=engine)
+        leer = distribuciones._instantaneas.construir
+
+        def leer_con_escritura(entidad, db):
+            columnas = leer(entidad, db)
+            eventos.publicar(entidad, "reset", None)
+            return columnas
+
+        monkeypatch.setattr(distribuciones._instantaneas, "construir", leer_con_escritura)
+        distribuciones.invalidar()
+        try:
+            with crear_sessionmaker(engine)() as db:
+                assert distribuciones.instantanea(db, "autos")["autonomia_km"].size == 0
+            assert "autos" not in distribuciones._instantaneas.actuales()
+        finally:
+            distribuciones.invalidar()
+            engine.dispose()
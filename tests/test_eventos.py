@@ -0,0 +1,143 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+import crud
+import eventos
+from database import Base, crear_engine, crear_sessionmaker
+from main import app
+from modelos import AutoElectrico, AutoActualizado
+
+client = TestClient(app)
+
+
+def _recoger(bus, publicar, entidades=(), desde=None, max_pendientes=None):
+    """Suscribe, publica con `publicar(bus)` y devuelve el lote recibido."""
+    async def escenario():
+        if max_pendientes is not None:
+            bus.max_pendientes = max_pendientes
+        suscriptor = bus.suscribir(entidades, desde=desde)
+        publicar(bus)
+        await asyncio.sleep(0)
+        lote = await suscriptor.siguientes(0.1)
+        bus.cancelar(suscriptor)
+        return lote
+    return asyncio.run(escenario())
+
+
+class TestBusEventos:
+    """Pruebas del bus de eventos y del feed SSE"""
+
+    def test_combina_eventos_de_la_misma_fila(self):
+        """Test: create+update llega como un create con los datos nuevos; create+delete no llega"""
+        def publicar(bus):
+            bus.publicar("autos", "create", 1, {"modelo": "A"})
+            bus.publicar("autos", "update", 1, {"modelo": "B"})
+            bus.publicar("autos", "create", 2, {"modelo": "C"})
+            bus.publicar("autos", "delete", 2)
+            bus.publicar("cargas", "update", 5, {})
+
+        lote = _recoger(eventos.BusEventos(), publicar, entidades=["autos"])
+        assert [(e.accion, e.id, e.datos) for e in lote] == [("create", 1, {"modelo": "B"})]
+
+    def test_cliente_lento_recibe_reset(self):
+        """Test: Si se acumulan demasiadas filas pendientes se envía un único 'reset'"""
+        def publicar(bus):
+            for i in range(10):
+                bus.publicar("autos", "update", i, {})
+
+        lote = _recoger(eventos.BusEventos(), publicar, max_pendientes=5)
+        assert [e.accion for e in lote] == ["reset"]
+
+    def test_reanuda_con_last_event_id(self):
+        """Test: Con Last-Event-ID se reenvían los eventos posteriores del historial"""
+        bus = eventos.BusEventos()
+        primero = bus.publicar("autos", "update", 1, {})
+        bus.publicar("autos", "update", 2, {})
+
+        lote = _recoger(bus, lambda b: None, desde=primero.secuencia)
+        assert [e.id for e in lote] == [2]
+
+        lote = _recoger(bus, lambda b: None, desde=999)
+        assert [e.accion for e in lote] == ["reset"]
+
+    def test_crud_publica_cambios(self, tmp_path):
+        """Test: crud publica create/update/delete después de confirmar"""
+        engine = crear_engine(f"sqlite:///{tmp_path / 'eventos.db'}")
+        Base.metadata.create_all(bind=engine)
+        recibidos = []
+        oyente = eventos.bus.escuchar(lambda e: recibidos.append((e.entidad, e.accion, e.id)))
+        try:
+            with crear_sessionmaker(engine)() as db:
+                auto = crud.create_auto(db, AutoElectrico(
+                    marca="Tesla", modelo="Model 3", anio=2023,
+                    capacidad_bateria_kwh=75.0, autonomia_km=500.0, disponible=True))
+                crud.update_auto(db, auto["id"], AutoActualizado(disponible=False))
+                crud.delete_auto(db, auto["id"])
+        finally:
+            eventos.bus.dejar_de_escuchar(oyente)
+            engine.dispose()
+
+        assert recibidos == [("autos", "create", auto["id"]), ("autos", "update", auto["id"]),
+                             ("autos", "delete", auto["id"])]
+
+    def test_entidad_desconocida(self):
+        """Test: El feed SSE rechaza entidades que no existen"""
+        response = client.get("/api/eventos?entidades=autos,aviones")
+        assert response.status_code == 400
+
+
+class TestCacheEventos:
+    """Pruebas del ciclo de vida común de las cachés (CacheEventos)"""
+
+    def test_aplica_eventos_y_descarta_con_reset(self):
+        """Test: Los eventos se aplican a la copia y un 'reset' la descarta"""
+        construidas = []
+
+        def construir(clave):
+            construidas.append(clave)
+            return []
+
+        cache = eventos.CacheEventos("prueba", construir, lambda copia, e: copia.append(e.id))
+        try:
+            copia = cache.obtener("autos")
+            eventos.publicar("autos", "create", 1)
+            eventos.publicar("cargas", "create", 2)
+            assert cache.obtener("autos") is copia and copia == [1]
+
+            eventos.publicar("autos", "reset", None)
+            assert cache.obtener("autos") is not copia
+            assert construidas == ["autos", "autos"]
+        finally:
+            eventos.bus.dejar_de_escuchar(cache._al_cambiar)
+
+    def test_eventos_durante_la_construccion(self):
+        """Test: Lo recibido al construir se aplica; con un 'reset' la copia no se guarda"""
+        accion = ["update"]
+
+        def construir(clave):
+            eventos.publicar("autos", accion[0], 7)
+            return []
+
+        cache = eventos.CacheEventos("prueba", construir, lambda copia, e: copia.append(e.id))
+        try:
+            copia = cache.obtener("autos")
+            assert copia == [7] and cache.actuales() == {"autos": copia}
+
+            cache.invalidar("autos")
+            accion[0] = "reset"
+            assert cache.obtener("autos") == [] and cache.actuales() == {}
+        finally:
+            eventos.bus.dejar_de_escuchar(cache._al_cambiar)
+
+    def test_sin_aplicar_cualquier_evento_descarta(self):
+        """Test: Sin función de aplicar, una escritura descarta la copia"""
+        cache = eventos.CacheEventos("prueba", lambda clave: object())
+        try:
+            copia = cache.obtener("estaciones")
+            eventos.publicar("autos", "update", 1)
+            assert cache.obtener("estaciones") is copia
+            eventos.publicar("estaciones", "update", 1)
+            assert cache.obtener("estaciones") is not copia
+        finally:
+            eventos.bus.dejar_de_escuchar(cache._al_cambiar)
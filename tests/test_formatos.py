@@ -0,0 +1,47 @@
+"""
+Pruebas de la negociación de formato (formatos.py)
+"""
+
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+import formatos
+
+
+def _peticion(accept=None):
+    return SimpleNamespace(headers={"accept": accept} if accept else {})
+
+
+class TestNegociacion:
+    """Pruebas de la elección entre JSON y MessagePack según Accept"""
+
+    def test_sin_accept_o_json_responde_json(self):
+        """Test: Sin Accept o pidiendo JSON se responde JSON"""
+        assert not formatos.pide_msgpack(_peticion())
+        assert not formatos.pide_msgpack(_peticion("application/json, */*"))
+
+    def test_msgpack_segun_calidad(self):
+        """Test: Se elige MessagePack cuando su calidad (q) es la mayor"""
+        pytest.importorskip("msgpack")
+        assert formatos.pide_msgpack(_peticion("application/x-msgpack"))
+        assert formatos.pide_msgpack(_peticion("application/json;q=0.5, application/msgpack"))
+        assert not formatos.pide_msgpack(_peticion("application/msgpack;q=0.2, application/json"))
+
+    def test_sin_libreria_msgpack(self, monkeypatch):
+        """Test: Sin msgpack se responde JSON si se acepta, y 406 si no"""
+        monkeypatch.setattr(formatos, "msgpack", None)
+        assert not formatos.pide_msgpack(_peticion("application/msgpack, application/json;q=0.1"))
+        with pytest.raises(HTTPException) as error:
+            formatos.pide_msgpack(_peticion("application/msgpack"))
+        assert error.value.status_code == 406
+
+
+class TestColumnas:
+    """Pruebas de la disposición por columnas (layout=columns)"""
+
+    def test_a_columnas(self):
+        """Test: Las filas se convierten en un array por campo"""
+        assert formatos.a_columnas([]) == {}
+        assert formatos.a_columnas([{"a": 1, "b": "x"}, {"a": 2, "b": "y"}]) == {"a": [1, 2], "b": ["x", "y"]}
@@ -0,0 +1,55 @@
+import random
+
+from sqlalchemy import func, select
+
+import generar_datos
+import models_sql
+from database import Base, crear_engine
+
+
+class TestGenerarDatos:
+    """Pruebas del generador de datos sintéticos"""
+
+    def test_misma_semilla_mismos_datos(self):
+        """Test: La generación es determinista para una semilla"""
+        primera = list(generar_datos.generar_autos(50, random.Random(7)))
+        segunda = list(generar_datos.generar_autos(50, random.Random(7)))
+        assert primera == segunda
+
+    def test_filas_validas(self):
+        """Test: Todas las filas cumplen los modelos Pydantic del API"""
+        rnd = random.Random(1)
+        generar_datos.validar("autos", list(generar_datos.generar_autos(500, rnd)))
+        generar_datos.validar("cargas", list(generar_datos.generar_cargas(500, rnd)))
+        generar_datos.validar("estaciones", list(generar_datos.generar_estaciones(500, rnd)))
+
+    def test_modelo_anio_unicos(self):
+        """Test: No se repite (modelo, anio), como exige create_auto"""
+        autos = list(generar_datos.generar_autos(2000, random.Random(3)))
+        assert len({(a["modelo"], a["anio"]) for a in autos}) == len(autos)
+
+    def test_poblar_db(self, tmp_path):
+        """Test: poblar_db inserta catálogo e historial por lotes"""
+        engine = crear_engine(f"sqlite:///{tmp_path / 'sintetico.db'}")
+        Base.metadata.create_all(bind=engine)
+        totales = generar_datos.poblar_db(engine, 250, fraccion_historial=0.1, tamano_lote=100)
+        with engine.connect() as conn:
+            autos = conn.scalar(select(func.count()).select_from(models_sql.AutoElectricoSQL))
+            eliminados = conn.scalar(select(func.count()).select_from(models_sql.AutoEliminadoSQL))
+        engine.dispose()
+        assert totales["autos"] == autos == 250
+        assert totales["autos_eliminados"] == eliminados == 25
+
+    def test_main_crear_tablas(self, tmp_path, monkeypatch):
+        """Test: --crear-tablas prepara una base vacía, incluidas versiones y horarios"""
+        url = f"sqlite:///{tmp_path / 'vacia.db'}"
+        monkeypatch.setattr("sys.argv", ["generar_datos.py", "--autos", "50", "--destino", "db",
+                                         "--crear-tablas", "--url", url])
+        generar_datos.main()
+        engine = crear_engine(url)
+        with engine.connect() as conn:
+            autos = conn.scalar(select(func.count()).select_from(models_sql.AutoElectricoSQL))
+            versiones = conn.scalar(select(func.count()).select_from(models_sql.VersionCatalogoSQL))
+        engine.dispose()
+        assert autos == 50
+        assert versiones > 0
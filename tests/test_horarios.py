@@ -0,0 +1,57 @@
+"""
+Pruebas de la interpretación de horarios de apertura (horarios.py)
+"""
+
+from datetime import datetime
+
+import pytest
+
+import horarios
+
+
+class TestParsearHorario:
+    """Pruebas de horario_apertura -> intervalos en minutos de la semana"""
+
+    def test_parsear_formatos_del_catalogo(self):
+        """Test: 24/7, rangos de días, horas sin días y varios tramos"""
+        assert horarios.parsear("24/7") == [(0, horarios.MINUTOS_SEMANA)]
+        # L-V 9:00-17:00: cinco intervalos de lunes a viernes
+        assert horarios.parsear("L-V 9:00-17:00")[0] == (540, 1020)
+        assert len(horarios.parsear("L-V 9:00-17:00")) == 5
+        # Sin días: todos los días de la semana
+        assert len(horarios.parsear("06:00-22:00")) == 7
+        assert horarios.parsear("L-V 8:00-20:00; S 9:00-14:00")[-1] == (5 * 1440 + 540, 5 * 1440 + 840)
+
+    def test_parsear_cruce_de_medianoche(self):
+        """Test: Un tramo que pasa de medianoche se parte al final de la semana"""
+        # Domingo 22:00 a lunes 02:00
+        assert horarios.parsear("D 22:00-02:00") == [(0, 120), (6 * 1440 + 1320, horarios.MINUTOS_SEMANA)]
+        assert horarios.parsear("00:00-24:00") == [(0, horarios.MINUTOS_SEMANA)]
+
+    def test_parsear_invalido(self):
+        """Test: Un horario que no se entiende lanza ValueError y no da intervalos"""
+        for texto in ("cerrado", "L-V 25:00-26:00", "Q 9:00-10:00"):
+            with pytest.raises(ValueError):
+                horarios.parsear(texto)
+        assert horarios.intervalos("cerrado") == ()
+
+
+class TestParsearInstante:
+    """Pruebas de open_at -> minuto de la semana"""
+
+    def test_parsear_instante(self):
+        """Test: now, HH:MM, día y hora y fecha ISO"""
+        sabado = datetime(2024, 5, 4, 10, 0)
+        assert horarios.parsear_instante("22:30", ahora=sabado) == 5 * 1440 + 1350
+        assert horarios.parsear_instante("L 08:15", ahora=sabado) == 495
+        assert horarios.parsear_instante("now", ahora=sabado) == 5 * 1440 + 600
+        assert horarios.parsear_instante("2024-05-06T07:00") == 420
+
+    def test_instante_frente_a_intervalos(self):
+        """Test: El minuto de open_at cae en el intervalo guardado del día que corresponde"""
+        sabado = horarios.intervalos("L-S 07:00-22:00")[-1]
+        assert sabado == (5 * 1440 + 420, 5 * 1440 + 1320)
+        assert sabado[0] <= horarios.parsear_instante("S 21:59") < sabado[1]
+        assert horarios.parsear_instante("S 22:00") == sabado[1]
+        # Domingo: después del último intervalo de la semana
+        assert horarios.parsear_instante("D 12:00") >= sabado[1]
@@ -0,0 +1,108 @@
+"""
+Pruebas del aviso de cambios entre procesos (invalidacion.py)
+"""
+
+import threading
+
+import crud
+import eventos
+import invalidacion
+import snapshot_catalogo
+from database import Base, crear_engine, crear_sessionmaker
+from modelos import AutoActualizado, AutoElectrico
+
+AUTO = AutoElectrico(marca="Tesla", modelo="Model 3", anio=2023, capacidad_bateria_kwh=75.0,
+                     autonomia_km=500.0, disponible=True)
+
+
+def _engine(tmp_path):
+    engine = crear_engine(f"sqlite:///{tmp_path / 'invalidacion.db'}")
+    Base.metadata.create_all(bind=engine)
+    return engine
+
+
+class TestVigilante:
+
+    def test_revisar_separa_escrituras_propias_y_ajenas(self):
+        """Test: Solo se avisa si la versión avanzó más que las escrituras propias"""
+        vigilante = invalidacion.Vigilante()
+        assert vigilante.revisar({"autos": 10, "cargas": 4}) == []
+        vigilante.propia("autos", 11)
+        vigilante.propia("autos", 12)
+        assert vigilante.revisar({"autos": 12, "cargas": 4}) == []
+        vigilante.propia("autos", 13)
+        assert vigilante.revisar({"autos": 14, "cargas": 5}) == ["autos", "cargas"]
+        # Una versión propia ya vista no se cuenta dos veces
+        vigilante.propia("autos", 14)
+        assert vigilante.revisar({"autos": 15, "cargas": 5}) == ["autos"]
+
+    def test_avisos_propios_por_origen(self):
+        """Test: Los avisos con el token del proceso se ignoran"""
+        vigilante = invalidacion.Vigilante()
+        otro = invalidacion.Vigilante()
+        assert vigilante.origen != otro.origen
+        avisos = [f"autos:{vigilante.origen}", f"cargas:{otro.origen}", "estaciones:", "usuarios:x"]
+        assert vigilante.ajenas(avisos) == ["cargas", "estaciones"]
+
+    def test_versiones_desde_sqlite(self, tmp_path, monkeypatch):
+        """Test: Las escrituras de crud suben la versión y se registran como propias"""
+        engine = _engine(tmp_path)
+        vigilante = invalidacion.Vigilante()
+        try:
+            with engine.connect() as conn:
+                vigilante.revisar(invalidacion.versiones_actuales(conn))
+            with crear_sessionmaker(engine)() as db:
+                # Escritura de "otro proceso": la registra otro vigilante
+                auto = crud.create_auto(db, AUTO)
+                with engine.connect() as conn:
+                    assert vigilante.revisar(invalidacion.versiones_actuales(conn)) == ["autos"]
+
+                monkeypatch.setattr(invalidacion, "vigilante", vigilante)
+                crud.update_auto(db, auto["id"], AutoActualizado(disponible=False))
+                crud.delete_auto(db, auto["id"])
+                with engine.connect() as conn:
+                    assert vigilante.revisar(invalidacion.versiones_actuales(conn)) == []
+        finally:
+            engine.dispose()
+
+    def test_sondeo_publica_reset(self, tmp_path):
+        """Test: El hilo de sondeo publica 'reset' al detectar escrituras ajenas"""
+        engine = _engine(tmp_path)
+        vigilante = invalidacion.Vigilante(intervalo_ms=10)
+        recibido = threading.Event()
+        oyente = eventos.bus.escuchar(
+            lambda e: recibido.set() if (e.entidad, e.accion) == ("autos", "reset") else None)
+        try:
+            vigilante.iniciar(engine, modo="sondeo")
+            # Primera revisión (punto de partida) antes de escribir
+            for _ in range(200):
+                if vigilante._vistas:
+                    break
+                threading.Event().wait(0.01)
+            with crear_sessionmaker(engine)() as db:
+                crud.create_auto(db, AUTO)
+            assert recibido.wait(2)
+        finally:
+            vigilante.detener()
+            eventos.bus.dejar_de_escuchar(oyente)
+            engine.dispose()
+
+    def test_reset_descarta_cachés(self, tmp_path, monkeypatch):
+        """Test: Un 'reset' descarta el snapshot y los totales de esa entidad"""
+        engine = _engine(tmp_path)
+        monkeypatch.setattr(snapshot_catalogo, "SNAPSHOT_CATALOGO", True)
+        snapshot_catalogo.invalidar()
+        crud.invalidar_totales()
+        try:
+            with crear_sessionmaker(engine)() as db:
+                tabla = snapshot_catalogo.tabla(db, "autos")
+                crud.contar(db, "autos")
+                assert snapshot_catalogo.tabla(db, "autos") is tabla and "autos" in crud._totales
+
+                eventos.publicar("autos", "reset", None)
+                assert "autos" not in crud._totales
+                assert snapshot_catalogo.tabla(db, "autos") is not tabla
+        finally:
+            snapshot_catalogo.invalidar()
+            crud.invalidar_totales()
+            engine.dispose()
@@ -0,0 +1,43 @@
+import json
+import queue
+import logging
+
+import logging_config
+
+
+def _registro(nivel=logging.INFO, nombre="prueba", mensaje="Login exitoso para: %s", args=("123",)):
+    return logging.LogRecord(nombre, nivel, __file__, 1, mensaje, args, None)
+
+
+class TestLoggingConfig:
+    """Pruebas de la configuración de logging asíncrono"""
+
+    def test_formato_json(self):
+        """Test: El registro se serializa como JSON con los campos extra"""
+        registro = _registro()
+        registro.ruta = "/api/login"
+        datos = json.loads(logging_config.FormateadorJSON().format(registro))
+        assert datos["mensaje"] == "Login exitoso para: 123"
+        assert datos["nivel"] == "INFO"
+        assert datos["ruta"] == "/api/login"
+
+    def test_muestreo_debug(self):
+        """Test: Solo se conserva una fracción de los DEBUG; INFO pasa siempre"""
+        filtro = logging_config.MuestreoDebug(0.25)
+        debug = [filtro.filter(_registro(logging.DEBUG)) for _ in range(100)]
+        assert sum(debug) == 25
+        assert all(filtro.filter(_registro(logging.INFO)) for _ in range(10))
+
+    def test_niveles_por_logger(self):
+        """Test: LOG_LEVELS se interpreta como pares logger=nivel"""
+        niveles = logging_config._niveles_por_logger("auth_utils=warning, FastAPI=DEBUG,,malo")
+        assert niveles == {"auth_utils": "WARNING", "FastAPI": "DEBUG"}
+
+    def test_cola_no_formatea_en_el_hilo_que_registra(self):
+        """Test: El handler encola el registro sin interpolar sus argumentos"""
+        handler = logging_config.ColaHandler(queue.Queue(maxsize=1))
+        registro = _registro()
+        handler.emit(registro)
+        handler.emit(_registro())
+        assert handler.queue.get_nowait().msg == "Login exitoso para: %s"
+        assert handler.descartados == 1
@@ -0,0 +1,102 @@
+"""
+Pruebas del motor de tiempo y coste de carga autos × estaciones (matriz_carga.py)
+"""
+
+import numpy as np
+
+import eventos
+import matriz_carga
+
+AUTOS = [
+    {"id": 1, "marca": "Tesla", "modelo": "Model 3", "capacidad_bateria_kwh": 75.0},
+    {"id": 2, "marca": "Nissan", "modelo": "Leaf", "capacidad_bateria_kwh": 40.0},
+]
+CARGAS = [{"id": 1, "modelo_auto": "Nissan Leaf", "auto_id": 2, "tiempo_carga_horas": 6.0}]
+ESTACIONES = [
+    {"id": 10, "potencia_kw": 150.0, "coste_por_kwh": 0.40, "tipo_conector": "CCS", "acceso_publico": True},
+    {"id": 11, "potencia_kw": 22.0, "coste_por_kwh": 0.20, "tipo_conector": "Tipo 2", "acceso_publico": True},
+    {"id": 12, "potencia_kw": 7.4, "coste_por_kwh": 0.10, "tipo_conector": "Tipo 2", "acceso_publico": False},
+]
+
+
+def _matriz():
+    matriz = matriz_carga.MatrizCarga()
+    matriz.cargar(AUTOS, CARGAS, ESTACIONES)
+    return matriz
+
+
+class TestMatrizCarga:
+    """Pruebas de tiempo, coste y recomendación sobre la matriz autos × estaciones"""
+
+    def test_bloques_igual_que_calculo_por_auto(self):
+        """Test: Recorrer por bloques da lo mismo que calcular auto por auto"""
+        matriz = _matriz()
+        ids, tiempo, coste = next(matriz.bloques())
+        assert ids.tolist() == [1, 2] and tiempo.shape == (2, 3)
+        # Leaf: 40 kWh en 6 h -> 6.67 kW en AC, por debajo de los 22 kW de la estación
+        assert np.isclose(tiempo[1, 1], 40 * 0.7 / (40 / 6 * 0.9))
+        # Sin cargas del Model 3 la potencia AC no se limita
+        assert np.isclose(tiempo[0, 1], 75 * 0.7 / (22 * 0.9))
+        assert np.allclose(coste[0], 75 * 0.7 / 0.9 * np.array([0.40, 0.20, 0.10]))
+        por_auto = [np.vstack(partes) for partes in zip(*(b[1:] for b in matriz.bloques(filas_por_bloque=1)))]
+        assert np.allclose(por_auto[0], tiempo) and np.allclose(por_auto[1], coste)
+
+    def test_top_k_y_eventos(self):
+        """Test: El top-k por coste o tiempo sigue las altas, bajas y cargas nuevas"""
+        matriz = _matriz()
+        assert [m["estacion_id"] for m in matriz.mejores(1, k=2, criterio="coste")] == [12, 11]
+        assert [m["estacion_id"] for m in matriz.mejores(1, k=1, criterio="tiempo")] == [10]
+
+        matriz.aplicar(eventos.Evento(1, "estaciones", "create", 13, {**ESTACIONES[0], "potencia_kw": 350.0, "coste_por_kwh": 0.05}))
+        assert matriz.mejores(1, k=1, criterio="coste")[0]["estacion_id"] == 13
+        matriz.aplicar(eventos.Evento(2, "estaciones", "delete", 12))
+        assert [m["estacion_id"] for m in matriz.mejores(1, k=5)] == [13, 11, 10]
+
+        # Una carga del Model 3 limita su potencia AC
+        matriz.aplicar(eventos.Evento(3, "cargas", "create", 2, {"modelo_auto": "Tesla Model 3", "auto_id": 1,
+                                                                 "tiempo_carga_horas": 10.0}))
+        lenta = next(m for m in matriz.mejores(1, k=5) if m["estacion_id"] == 11)
+        assert lenta["tiempo_horas"] == round(75 * 0.7 / (7.5 * 0.9), 3)
+        assert matriz.mejores(99) is None
+
+    def test_recomendar_pesos_distancia_y_conectores(self):
+        """Test: La recomendación pondera coste y distancia y filtra por conector"""
+        matriz = matriz_carga.MatrizCarga()
+        estaciones = [
+            # Lejos y barata; cerca y cara; cerca con conector incompatible
+            {"id": 1, "potencia_kw": 50.0, "coste_por_kwh": 0.10, "tipo_conector": "CCS", "acceso_publico": True,
+             "latitud": 6.244, "longitud": -75.581},
+            {"id": 2, "potencia_kw": 150.0, "coste_por_kwh": 0.40, "tipo_conector": "CCS", "acceso_publico": True,
+             "latitud": 4.711, "longitud": -74.072},
+            {"id": 3, "potencia_kw": 150.0, "coste_por_kwh": 0.05, "tipo_conector": "CHAdeMO", "acceso_publico": True,
+             "latitud": 4.711, "longitud": -74.072},
+        ]
+        matriz.cargar([{"id": 1, "marca": "Kia", "modelo": "EV6", "capacidad_bateria_kwh": 77.4}], [], estaciones)
+
+        solo_coste = matriz.recomendar(1, k=5, pesos={"coste": 1, "potencia": 0, "distancia": 0, "publica": 0})
+        assert [r["estacion_id"] for r in solo_coste] == [1, 2]
+        cerca = matriz.recomendar(1, k=5, latitud=4.70, longitud=-74.05,
+                                  pesos={"coste": 0.2, "potencia": 0, "distancia": 1, "publica": 0})
+        assert [r["estacion_id"] for r in cerca] == [2, 1]
+        assert cerca[0]["distancia_km"] < 3 and cerca[1]["distancia_km"] > 200
+        assert matriz.recomendar(1, k=1, conectores=["CHAdeMO"])[0]["estacion_id"] == 3
+        assert matriz.recomendar(7) is None
+
+    def test_conectores_desconocidos_no_se_registran(self):
+        """Test: Un conector pedido que no existe no coincide con nada ni se registra"""
+        matriz = _matriz()
+        codigos = dict(matriz_carga._codigos_conector)
+        assert matriz.recomendar(1, k=5, conectores=["Inventado-123"]) == []
+        resumen = matriz.resumen_estaciones(["Tipo 2", "Inventado-456"])
+        assert [c["estaciones"] for c in resumen["por_conector"]] == [2, 0]
+        assert matriz_carga._codigos_conector == codigos
+
+    def test_potencia_ac_por_auto_id(self):
+        """Test: La potencia AC sale de las cargas enlazadas por auto_id"""
+        matriz = _matriz()
+        # El texto no importa: la carga se cambia al Model 3 por su auto_id
+        matriz.aplicar(eventos.Evento(1, "cargas", "update", 1, {"modelo_auto": "Leaf", "auto_id": 1,
+                                                                 "tiempo_carga_horas": 10.0}))
+        _, tiempo, _ = next(matriz.bloques())
+        assert np.isclose(tiempo[0, 1], 75 * 0.7 / (7.5 * 0.9))
+        assert np.isclose(tiempo[1, 1], 40 * 0.7 / (22 * 0.9))
@@ -0,0 +1,84 @@
+"""
+Pruebas de la copia por columnas del catálogo (snapshot_catalogo.py)
+"""
+
+import numpy as np
+
+import eventos
+import snapshot_catalogo
+
+ESTACIONES = [
+    {"id": 1, "nombre": "Centro", "ubicacion": "Calle 1", "tipo_conector": "CCS", "potencia_kw": 150.0,
+     "num_conectores": 4, "acceso_publico": True, "horario_apertura": "24/7", "coste_por_kwh": 0.4,
+     "operador": "Enel", "url_imagen": None, "latitud": 4.6, "longitud": -74.1},
+    {"id": 2, "nombre": "Norte", "ubicacion": "Calle 2", "tipo_conector": "Tipo 2", "potencia_kw": 22.0,
+     "num_conectores": 2, "acceso_publico": False, "horario_apertura": "08:00-20:00", "coste_por_kwh": 0.2,
+     "operador": "Celsia", "url_imagen": "/static/x.jpg", "latitud": None, "longitud": None},
+    {"id": 3, "nombre": "Sur", "ubicacion": "Calle 3", "tipo_conector": "CCS", "potencia_kw": 50.0,
+     "num_conectores": 2, "acceso_publico": None, "horario_apertura": "24/7", "coste_por_kwh": 0.3,
+     "operador": "Enel", "url_imagen": None, "latitud": 6.2, "longitud": -75.5},
+]
+
+
+def _tabla(filas=ESTACIONES):
+    tabla = snapshot_catalogo.nueva_tabla("estaciones")
+    tabla.cargar([tuple(f[c] for c in tabla.campos) for f in filas])
+    return tabla
+
+
+class TestTablaColumnar:
+    """Pruebas de la copia por columnas de una entidad"""
+
+    def test_filas_iguales_a_las_originales(self):
+        """Test: Página, detalle y lectura por ids devuelven las filas tal como se cargaron"""
+        tabla = _tabla()
+        assert len(tabla) == 3
+        assert tabla.pagina(0, 10) == [{c: f[c] for c in tabla.campos} for f in ESTACIONES]
+        assert tabla.obtener(2) == ESTACIONES[1] and tabla.obtener(99) is None
+        assert tabla.pagina(1, 1, ["nombre"]) == [{"id": 2, "nombre": "Norte"}]
+        assert tabla.por_ids([3, 99, 1, 3], ["operador"]) == (
+            [{"id": 3, "operador": "Enel"}, {"id": 1, "operador": "Enel"}], [99])
+
+    def test_eventos_altas_cambios_y_bajas(self):
+        """Test: Los eventos de crud actualizan la copia fila a fila"""
+        tabla = _tabla()
+        tabla.aplicar(eventos.Evento(1, "estaciones", "create", 4, {**ESTACIONES[0], "id": 4, "operador": "Nuevo"}))
+        tabla.aplicar(eventos.Evento(2, "estaciones", "update", 2,
+                                     {**ESTACIONES[1], "potencia_kw": 11.0, "latitud": 5.0}))
+        tabla.aplicar(eventos.Evento(3, "estaciones", "delete", 1))
+        assert len(tabla) == 3
+        assert [f["id"] for f in tabla.pagina(0, 10)] == [2, 3, 4]
+        assert tabla.obtener(2)["potencia_kw"] == 11.0 and tabla.obtener(2)["latitud"] == 5.0
+        assert tabla.obtener(4)["operador"] == "Nuevo" and tabla.obtener(1) is None
+        assert [f["id"] for f in tabla.pagina(1, 1)] == [3]
+
+    def test_compacta_y_reordena_por_id(self):
+        """Test: Al compactar se recogen los huecos y las filas quedan ordenadas por id"""
+        tabla = _tabla(ESTACIONES[1:])
+        tabla.upsert(1, ESTACIONES[0])
+        assert [f["id"] for f in tabla.pagina(0, 10)] == [1, 2, 3]
+        assert tabla.huecos == 0 and tabla.posicion == {1: 0, 2: 1, 3: 2}
+        tabla.eliminar(2)
+        tabla.eliminar(3)
+        assert tabla.huecos == 0 and tabla.pagina(0, 10) == [ESTACIONES[0]]
+
+    def test_facetas_y_estadisticas(self):
+        """Test: Facetas, conteos, medias y columnas numéricas sin NULL"""
+        tabla = _tabla()
+        datos = tabla.facetas({"tipo_conector": ["CCS"]}, ("tipo_conector", "operador", "acceso_publico"), ["nombre"])
+        assert datos["total"] == 2
+        assert datos["resultados"] == [{"id": 1, "nombre": "Centro"}, {"id": 3, "nombre": "Sur"}]
+        assert datos["facetas"]["operador"] == [{"valor": "Enel", "total": 2}]
+        assert datos["facetas"]["acceso_publico"] == [{"valor": None, "total": 1}, {"valor": True, "total": 1}]
+        assert tabla.facetas({"operador": ["Otro"]}, ("operador",))["total"] == 0
+        assert tabla.conteos("tipo_conector") == [("CCS", 2), ("Tipo 2", 1)]
+        assert tabla.medias("tipo_conector", "potencia_kw") == [("CCS", 100.0), ("Tipo 2", 22.0)]
+        assert np.allclose(np.sort(tabla.numericos("latitud")), [4.6, 6.2])
+
+    def test_memoria_estimada(self):
+        """Test: La estimación por fila incluye el índice y la tabla informa su memoria"""
+        tabla = snapshot_catalogo.nueva_tabla("estaciones")
+        por_fila = tabla.estimar_bytes_por_fila([tuple(f[c] for c in tabla.campos) for f in ESTACIONES])
+        tabla.cargar([tuple(f[c] for c in tabla.campos) for f in ESTACIONES])
+        assert por_fila > snapshot_catalogo.BYTES_INDICE_POR_FILA
+        assert tabla.memoria() > 0
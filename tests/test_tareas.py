@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+from sqlalchemy import select
+
+import models_sql
+from database import Base, crear_engine, crear_sessionmaker
+from tareas import ColaLlena, ColaTareas
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = crear_engine(f"sqlite:///{tmp_path / 'tareas.db'}")
+    Base.metadata.create_all(bind=engine)
+    yield crear_sessionmaker(engine)
+    engine.dispose()
+
+
+def _filas(session_factory):
+    with session_factory() as db:
+        return db.scalars(select(models_sql.TareaSQL)).all()
+
+
+class TestColaTareas:
+    """Pruebas de la cola de tareas en segundo plano"""
+
+    def test_sin_iniciar_ejecuta_en_linea(self, session_factory):
+        """Test: Sin lifespan la tarea se ejecuta al encolar y no se persiste"""
+        cola = ColaTareas(session_factory)
+        hechas = []
+        cola.registrar("anotar")(lambda valor: hechas.append(valor))
+
+        assert asyncio.run(cola.encolar("anotar", valor=1)) is None
+        assert hechas == [1]
+        assert _filas(session_factory) == []
+
+    def test_trabajador_ejecuta_y_borra(self, session_factory):
+        """Test: La tarea persistida se ejecuta y desaparece de la tabla"""
+        cola = ColaTareas(session_factory, trabajadores=2)
+        hechas = []
+
+        @cola.registrar("anotar")
+        async def anotar(valor):
+            hechas.append(valor)
+
+        async def escenario():
+            await cola.iniciar()
+            ids = [await cola.encolar("anotar", valor=i) for i in range(5)]
+            await cola.detener()
+            return ids
+
+        ids = asyncio.run(escenario())
+        assert all(ids)
+        assert sorted(hechas) == list(range(5))
+        assert _filas(session_factory) == []
+
+    def test_reintentos_y_fallo_definitivo(self, session_factory):
+        """Test: Se reintenta hasta max_intentos y luego queda marcada como fallida"""
+        cola = ColaTareas(session_factory, max_intentos=3, espera_reintento=0.01)
+        intentos = []
+
+        @cola.registrar("rota")
+        def rota():
+            intentos.append(1)
+            raise RuntimeError("fallo")
+
+        async def escenario():
+            await cola.iniciar()
+            await cola.encolar("rota")
+            await asyncio.sleep(0.2)
+            await cola.detener()
+
+        asyncio.run(escenario())
+        filas = _filas(session_factory)
+        assert len(intentos) == 3
+        assert [(f.estado, f.intentos) for f in filas] == [("fallida", 3)]
+        assert cola.fallidas == 1
+
+    def test_pendientes_sobreviven_reinicio(self, session_factory):
+        """Test: Una tarea persistida y no ejecutada se retoma en el siguiente arranque"""
+        hechas = []
+        with session_factory() as db:
+            db.add(models_sql.TareaSQL(tipo="anotar", payload='{"valor": 7}'))
+            db.commit()
+
+        cola = ColaTareas(session_factory)
+        cola.registrar("anotar")(lambda valor: hechas.append(valor))
+
+        async def escenario():
+            await cola.iniciar()
+            await cola.detener()
+
+        asyncio.run(escenario())
+        assert hechas == [7]
+        assert _filas(session_factory) == []
+
+    def test_cola_acotada(self, session_factory):
+        """Test: Al superar max_pendientes se lanza ColaLlena"""
+        cola = ColaTareas(session_factory, trabajadores=0, max_pendientes=2)
+        cola.registrar("nada", persistente=False)(lambda: None)
+
+        async def escenario():
+            await cola.iniciar()
+            await cola.encolar("nada")
+            await cola.encolar("nada")
+            with pytest.raises(ColaLlena):
+                await cola.encolar("nada")
+            await cola.detener(espera=0)
+
+        asyncio.run(escenario())